@@ -0,0 +1,55 @@
+""" Benchmarks raw METAR decoding throughput over a synthetic corpus
+
+Usage: python -m benchmarks.bench_metar_decoder [count]
+"""
+
+import random
+import sys
+import time
+from datetime import datetime
+import metar
+
+
+COVERS = ('FEW', 'SCT', 'BKN', 'OVC')
+WEATHER = ('', '-RA', 'RA', '+TSRA', '-DZ BR', 'BR', 'FG', '-SN', 'VCSH', 'HZ')
+VISIBILITIES = ('10SM', 'P6SM', '5SM', '3SM', '1 1/2SM', '1/2SM', 'M1/4SM', '9999', '4000', 'CAVOK')
+
+
+def synthetic_metar(rng):
+    """ Builds one random but well-formed METAR """
+    station = rng.choice('CK') + ''.join(rng.choice('ABCDEFGHIJKLMNOPQRSTUVWXYZ') for _ in range(3))
+    groups = [
+        station,
+        '{:02d}{:02d}{:02d}Z'.format(rng.randint(1, 28), rng.randint(0, 23), rng.choice((0, 53))),
+        '{:03d}{:02d}KT'.format(rng.randrange(0, 360, 10), rng.randint(0, 35)),
+        rng.choice(VISIBILITIES),
+        rng.choice(WEATHER),
+    ]
+    base = rng.randint(2, 60)
+    for _ in range(rng.randint(0, 3)):
+        groups.append('{}{:03d}'.format(rng.choice(COVERS), base))
+        base += rng.randint(5, 60)
+    temp = rng.randint(-30, 35)
+    groups.append('{}/{}'.format(
+        ('M%02d' % -temp) if temp < 0 else '%02d' % temp,
+        ('M%02d' % -(temp - 3)) if temp - 3 < 0 else '%02d' % (temp - 3),
+    ))
+    groups.append('A{:04d}'.format(rng.randint(2900, 3080)))
+    groups.append('RMK AO2 SLP{:03d}'.format(rng.randint(0, 999)))
+    return ' '.join(group for group in groups if group)
+
+
+def main(count=100000):
+    rng = random.Random(1)
+    corpus = [synthetic_metar(rng) for _ in range(count)]
+    now = datetime(2018, 10, 30)
+    start = time.perf_counter()
+    decoded = sum(1 for _ in metar.decode_lines(corpus, now))
+    elapsed = time.perf_counter() - start
+    print('{:<40} {:>10.0f} reports/s ({:.1f} us/report, {} decoded)'.format(
+        'metar.decode', count / elapsed, elapsed / count * 1e6, decoded
+    ))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
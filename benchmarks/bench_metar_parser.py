@@ -0,0 +1,38 @@
+""" Benchmarks parsing the METAR fixture into a dictionary
+
+Compares BeautifulSoup (html.parser) plus parse_metar_to_dict against the
+streaming ADDS parser fed the undecoded response bytes.
+
+Usage: python -m benchmarks.bench_metar_parser
+"""
+
+import os
+import timeit
+from bs4 import BeautifulSoup
+import adds
+import helpers
+from tests.helpers import get_data_directory
+
+
+def report(label, seconds, number):
+    """ Prints the mean time per call """
+    print('{:<40} {:>10.1f} us/parse'.format(label, seconds / number * 1e6))
+
+
+def main(number=5000):
+    with open(os.path.join(get_data_directory(), 'metar.txt'), 'rb') as metar:
+        content = metar.read()
+
+    def soup():
+        return helpers.parse_metar_to_dict(BeautifulSoup(content.decode('utf-8'), features='html.parser'))
+
+    def stream():
+        return adds.parse_metar(content)
+
+    assert soup() == stream()
+    report('BeautifulSoup + parse_metar_to_dict', timeit.timeit(soup, number=number), number)
+    report('adds.parse_metar (bytes)', timeit.timeit(stream, number=number), number)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+""" Benchmarks Observation records against plain METAR dictionaries
+
+Reports the memory held by a few thousand cached stations and the cost of
+the weather accessors that get_metar_parsed calls on every request.
+
+Usage: python -m benchmarks.bench_observation
+"""
+
+import os
+import timeit
+import tracemalloc
+import adds
+import weather
+from observation import Observation
+from tests.helpers import get_data_directory
+
+
+def retained_bytes(build, count):
+    """ Returns the bytes retained by count objects built with build(index) """
+    tracemalloc.start()
+    objects = [build(index) for index in range(count)]
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del objects
+    return current
+
+
+def read_all(metar_dict):
+    """ The accessors get_metar_parsed uses """
+    weather.get_station_id(metar_dict)
+    weather.get_flight_category(metar_dict)
+    weather.get_wind_information(metar_dict)
+    weather.get_visibility(metar_dict)
+    weather.get_altimeter(metar_dict)
+    weather.get_temperature(metar_dict)
+    weather.get_dewpoint(metar_dict)
+    weather.get_time(metar_dict)
+    weather.get_sky_conditions(metar_dict)
+
+
+def main(stations=5000, number=20000):
+    with open(os.path.join(get_data_directory(), 'metar.txt'), 'rb') as metar:
+        content = metar.read()
+
+    def build_dict(index):
+        return adds.parse_metar(content.replace(b'CYYZ', b'K%03d' % (index % 1000)))
+
+    def build_observation(index):
+        return Observation(build_dict(index))
+
+    for label, build in (('dict', build_dict), ('Observation', build_observation)):
+        print('{:<40} {:>10.0f} bytes/station'.format(
+            label + ' memory', retained_bytes(build, stations) / float(stations)
+        ))
+
+    metar_dict = build_dict(0)
+    observation = Observation(metar_dict)
+    for label, record in (('dict', metar_dict), ('Observation', observation)):
+        seconds = timeit.timeit(lambda: read_all(record), number=number)
+        print('{:<40} {:>10.1f} us/request'.format(label + ' accessors', seconds / number * 1e6))
+
+
+if __name__ == '__main__':
+    main()
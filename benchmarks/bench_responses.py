@@ -0,0 +1,64 @@
+""" Benchmarks the per-request cost of rendering responses
+
+Compares the original approach (re-parsing responses.yaml on every
+get_response call) against the process-wide compiled template registry,
+and against render cache hits for a cached Observation.
+
+Usage: python -m benchmarks.bench_responses
+"""
+
+import os
+import timeit
+from bs4 import BeautifulSoup
+from ruamel.yaml import YAML
+import helpers
+import responses
+from observation import Observation
+from templates import RESPONSES_PATH, CompiledTemplate
+from tests.helpers import get_data_directory
+
+
+def legacy_get_response(category, speech_or_text='both', key='standard'):
+    """ The original get_response: builds a parser and reads the file every call """
+    yaml = YAML()
+    with open(RESPONSES_PATH, 'r') as yaml_responses:
+        loaded = yaml.load(yaml_responses)
+        if speech_or_text == 'both':
+            return CompiledTemplate(loaded[category][key]['speech']), CompiledTemplate(loaded[category][key]['text'])
+        return CompiledTemplate(loaded[category][key][speech_or_text])
+
+
+def load_metar_dict():
+    """ Loads the fixture METAR as a dictionary """
+    with open(os.path.join(get_data_directory(), 'metar.txt'), 'r') as metar:
+        return helpers.parse_metar_to_dict(BeautifulSoup(metar.read(), features='html.parser'))
+
+
+def report(label, seconds, number):
+    """ Prints the mean time per call """
+    print('{:<40} {:>10.1f} us/request'.format(label, seconds / number * 1e6))
+
+
+def main(number=200):
+    metar_dict = load_metar_dict()
+
+    def render_all():
+        responses.get_metar_parsed(metar_dict, 'Test Airport')
+        responses.get_flight_category(metar_dict, 'Test Airport')
+
+    responses.get_response = legacy_get_response
+    report('get_metar_parsed (yaml per call)', timeit.timeit(render_all, number=number), number)
+    responses.get_response = helpers.get_response
+    report('get_metar_parsed (compiled registry)', timeit.timeit(render_all, number=number), number)
+
+    observation = Observation(metar_dict)
+
+    def render_cached():
+        responses.get_metar_parsed(observation, 'Test Airport')
+        responses.get_flight_category(observation, 'Test Airport')
+
+    report('get_metar_parsed (render cache hit)', timeit.timeit(render_cached, number=number), number)
+
+
+if __name__ == '__main__':
+    main()
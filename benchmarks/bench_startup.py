@@ -0,0 +1,44 @@
+""" Reports the cold import time of each module, as a cold start would pay it
+
+Every module is imported in a fresh interpreter with `python -X importtime`
+and its cumulative import time (including its dependencies) is reported.
+The deferred third-party dependencies are listed too, for comparison.
+
+Usage: python -m benchmarks.bench_startup [repeat]
+"""
+
+import os
+import subprocess
+import sys
+
+
+SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'src')
+MODULES = (
+    'main', 'helpers', 'responses', 'weather', 'templates', 'cache', 'adds', 'metar', 'upstream',
+)
+DEFERRED = ('requests', 'bs4', 'ruamel.yaml', 'dateparser', 'timeago', 'phonetic_alphabet')
+
+
+def import_time_us(module):
+    """ Returns the cumulative import time of module in a fresh interpreter, in microseconds """
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+        cwd=SRC, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True,
+    )
+    for line in reversed(result.stderr.splitlines()):
+        parts = line.split('|')
+        if len(parts) == 3 and parts[2].strip() == module:
+            return int(parts[1])
+    raise RuntimeError('Could not import {}: {}'.format(module, result.stderr[-500:]))
+
+
+def main(repeat=5):
+    for title, modules in (('Project modules', MODULES), ('Deferred dependencies', DEFERRED)):
+        print(title)
+        for module in modules:
+            best = min(import_time_us(module) for _ in range(repeat))
+            print('  {:<30} {:>10.1f} ms'.format(module, best / 1000.0))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,195 @@
+""" Benchmarks the webhook end-end against a local stand-in for aviationweather.gov
+
+main.main is driven with Dialogflow requests built from the sample request,
+varied across every intent and a set of stations, with the parameters each
+intent reads (device location, route, time, distance). The stub server
+answers like ADDS from the recorded responses: the TAF for forecasts, and
+one METAR per requested station (several per station, spread over the hours
+asked about, for trends), all re-labelled and observed up to now. Results
+are reproducible and no network is needed.
+
+Each intent is measured cold (METAR and render caches cleared before every
+request, so each one fetches and parses) and warm (served from cache).
+Throughput and p50/p95/p99 latency are reported per intent.
+
+Usage: python -m benchmarks.bench_webhook [requests_per_intent] [max_cold_p95_ms]
+
+The run fails (exits non-zero) if any request is answered with the
+standard error message, and, with max_cold_p95_ms, if any intent's cold
+p95 exceeds it.
+"""
+
+import copy
+import json
+import os
+import sys
+import time
+import helpers
+import history
+import main as webhook
+import responses
+import stations
+import taf
+import upstream
+from metrics import LatencyHistogram
+from tests.helpers import get_data_directory, load_sample_dialogflow_request
+from tests.stub_server import StubServer
+
+
+STATIONS = ('CYXU', 'CYYZ', 'KSFO', 'KJFK', 'EGLL', 'LFPG', 'RJTT', 'YSSY')
+# Within the validity of the recorded TAF
+FORECAST_TIME = '2018-10-03T12:00:00+00:00'
+VFR_NEARBY_DISTANCE = {'amount': 60, 'unit': 'nmi'}
+# Reports served per station and hour asked about, for trends
+HISTORY_REPORTS_PER_HOUR = 1
+
+
+class FakeRequest:
+    """ The part of the GCF (Flask) request main.main uses """
+
+    def __init__(self, request_json):
+        self._request_json = request_json
+
+    def get_json(self):
+        return self._request_json
+
+
+def _airport(icao_code):
+    """ Returns the Dialogflow airport parameter of a station """
+    return {'ICAO': icao_code, 'name': 'Airport ' + icao_code}
+
+
+def build_requests(intent, count):
+    """Returns Dialogflow requests for an intent, cycling through STATIONS
+
+    Each request carries what its intent reads: the device location (at the
+    station) for the nearest intents, a departure, destination and alternate
+    for route briefings, a time for forecasts and a distance for sweeps.
+    """
+    sample = load_sample_dialogflow_request()
+    handler = webhook.INTENTS[intent]
+    index = stations.station_index()
+    requests = []
+    for number in range(count):
+        request_json = copy.deepcopy(sample)
+        request_json['queryResult']['intent']['displayName'] = intent
+        parameters = request_json['queryResult']['parameters']
+        station = STATIONS[number % len(STATIONS)]
+        parameters['airport'] = _airport(station)
+        if getattr(handler, 'location', False):
+            located = index.get(station)
+            request_json['originalDetectIntentRequest']['payload'] = {
+                'device': {'location': {'coordinates': {
+                    'latitude': located.latitude, 'longitude': located.longitude
+                }}}
+            }
+        if getattr(handler, 'route', False):
+            parameters['departure'] = _airport(station)
+            parameters['destination'] = _airport(STATIONS[(number + 1) % len(STATIONS)])
+            parameters['alternates'] = [_airport(STATIONS[(number + 2) % len(STATIONS)])]
+        if getattr(handler, 'forecast', False):
+            parameters['time'] = FORECAST_TIME
+        if getattr(handler, 'area', False):
+            parameters['distance'] = dict(VFR_NEARBY_DISTANCE)
+        requests.append(FakeRequest(request_json))
+    return requests
+
+
+def recorded_adds_response():
+    """Returns a stub response handler answering like ADDS from the recorded responses
+
+    TAF queries get the recorded TAF; METAR queries get the recorded METAR
+    for every station of the (comma-separated) stationString, observed now,
+    or, for history queries (no mostRecent constraint), several reports per
+    station spread over the hours asked about.
+    """
+    data_directory = get_data_directory()
+    with open(os.path.join(data_directory, 'metar.txt'), 'rb') as metar:
+        recorded_metar = metar.read()
+    with open(os.path.join(data_directory, 'taf.txt'), 'rb') as recorded_taf:
+        recorded_taf = recorded_taf.read()
+    element = recorded_metar[recorded_metar.index(b'<METAR>'):recorded_metar.index(b'</METAR>') + len(b'</METAR>')]
+
+    def observed(seconds_ago):
+        return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(time.time() - seconds_ago)).encode()
+
+    def respond(query):
+        station_codes = query.get('stationString', ['CYYZ'])[0].split(',')
+        if query.get('dataSource', ['metars'])[0] == 'tafs':
+            return 200, recorded_taf.replace(b'KSFO', station_codes[0].encode('ascii')), 0
+        if 'mostRecent' in query or 'mostRecentForEachStation' in query:
+            ages = [0]
+        else:
+            reports = max(2, int(float(query.get('hoursBeforeNow', ['3'])[0]) * HISTORY_REPORTS_PER_HOUR))
+            ages = [3600 * index / HISTORY_REPORTS_PER_HOUR for index in range(reports)]
+        reports = [
+            element.replace(b'CYYZ', station.encode('ascii')).replace(b'2018-10-02T21:00:00Z', observed(age))
+            for station in station_codes for age in ages
+        ]
+        return 200, b'<response><data>' + b''.join(reports) + b'</data></response>', 0
+    return respond
+
+
+def run(requests, cold):
+    """Sends every request through main.main
+
+    Returns:
+        tuple -- (elapsed seconds, LatencyHistogram of the requests, requests answered with the standard error)
+    """
+    histogram = LatencyHistogram(size=len(requests))
+    error_message = helpers.get_standard_error_message()
+    errors = 0
+    started = time.perf_counter()
+    for request in requests:
+        if cold:
+            helpers.metar_cache.clear()
+            taf.taf_cache.clear()
+            history.history_cache.clear()
+            responses.render_cache.clear()
+        request_started = time.perf_counter()
+        response = webhook.main(request)
+        histogram.record('request', time.perf_counter() - request_started)
+        if json.loads(response)['fulfillmentText'] == error_message:
+            errors += 1
+    return time.perf_counter() - started, histogram, errors
+
+
+def report(label, elapsed, histogram, count):
+    """ Prints throughput and latency percentiles, returning the p95 in milliseconds """
+    latency = histogram.percentiles('request')
+    print('{:<28} {:>9.0f} req/s   p50 {:>8.3f} ms   p95 {:>8.3f} ms   p99 {:>8.3f} ms'.format(
+        label, count / elapsed, latency[50], latency[95], latency[99]
+    ))
+    return latency[95]
+
+
+def main(count=200, max_cold_p95_ms=None):
+    slowest = 0.0
+    failed = []
+    with StubServer(recorded_adds_response()) as stub:
+        upstream.adds = upstream.Upstream(stub.url, retries=0)
+        for intent in sorted(webhook.INTENTS):
+            requests = build_requests(intent, count)
+            # Prime the template registry, imports and connection pool
+            run(requests[:len(STATIONS)], cold=True)
+            elapsed, histogram, cold_errors = run(requests, cold=True)
+            slowest = max(slowest, report(intent + ' (cold)', elapsed, histogram, count))
+            run(requests[:len(STATIONS)], cold=False)
+            elapsed, histogram, warm_errors = run(requests, cold=False)
+            report(intent + ' (warm)', elapsed, histogram, count)
+            if cold_errors or warm_errors:
+                failed.append('{} ({} of {} requests)'.format(intent, cold_errors + warm_errors, 2 * count))
+    if failed:
+        print('Answered with the standard error message: ' + ', '.join(failed))
+        sys.exit(1)
+    if max_cold_p95_ms is not None and slowest > max_cold_p95_ms:
+        print('Cold p95 of {:.3f} ms exceeds the {:.3f} ms budget'.format(slowest, max_cold_p95_ms))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    arguments = sys.argv[1:]
+    main(
+        int(arguments[0]) if arguments else 200,
+        float(arguments[1]) if len(arguments) > 1 else None,
+    )
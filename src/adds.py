@@ -0,0 +1,179 @@
+""" Streaming parsers for aviationweather.gov ADDS XML responses (METARs and TAFs) """
+# -*- coding: utf-8 -*-
+
+from xml.etree.ElementTree import XMLPullParser
+
+
+CHUNK_SIZE = 64 * 1024
+
+
+def _element_string(element):
+    """Returns the text of an element the way BeautifulSoup's `.string` would
+
+    Arguments:
+        element {Element} -- A parsed XML element
+
+    Returns:
+        string|None -- The element's only string, or None
+    """
+    if len(element) == 0:
+        return element.text
+    if len(element) == 1 and not element.text and not element[0].tail:
+        return _element_string(element[0])
+    return None
+
+
+def _metar_from_element(metar, fields=None):
+    """Converts a <METAR> element to the dictionary shape of parse_metar_to_dict
+
+    Arguments:
+        metar {Element} -- A complete <METAR> element
+        fields {set} -- Only decode these keys (all keys if None)
+
+    Returns:
+        dictionary -- Dictionary of values in the metar
+    """
+    dictionary = {}
+    sky_conditions = []
+    want_sky = fields is None or 'sky_conditions' in fields
+    for tag in metar:
+        if fields is not None and tag.tag not in fields:
+            if not (want_sky and tag.tag == 'sky_condition'):
+                continue
+        if tag.tag == 'sky_condition':
+            try:
+                sky_conditions.append({
+                    'cloud_base_ft_agl': tag.attrib['cloud_base_ft_agl'],
+                    'sky_cover': tag.attrib['sky_cover']
+                })
+            except KeyError:
+                pass
+        string = _element_string(tag)
+        if string:
+            dictionary[tag.tag.lower()] = string
+    if want_sky:
+        dictionary['sky_conditions'] = sky_conditions
+    return dictionary
+
+
+def _chunks(source):
+    """ Yields the source in chunks, from bytes, str or a binary file-like object """
+    if isinstance(source, (bytes, bytearray, str)):
+        view = memoryview(source) if not isinstance(source, str) else source
+        for start in range(0, len(source), CHUNK_SIZE):
+            yield view[start:start + CHUNK_SIZE]
+        return
+    while True:
+        chunk = source.read(CHUNK_SIZE)
+        if not chunk:
+            return
+        yield chunk
+
+
+def iter_elements(source, tag):
+    """Incrementally parses XML, yielding each complete element with a given tag
+
+    Each yielded element is detached from its parent once the caller moves on,
+    so memory stays bounded by the size of a single element.
+
+    Arguments:
+        source {bytes|string|file} -- The XML document (or a binary stream of it)
+        tag {string} -- Tag name to yield (case insensitive)
+
+    Yields:
+        Element -- Each matching element
+    """
+    tag = tag.lower()
+    parser = XMLPullParser(events=('start', 'end'))
+    stack = []
+    for chunk in _chunks(source):
+        parser.feed(chunk)
+        for event, element in parser.read_events():
+            if event == 'start':
+                stack.append(element)
+                continue
+            stack.pop()
+            if element.tag.lower() == tag:
+                yield element
+                if stack:
+                    stack[-1].remove(element)
+    parser.close()
+
+
+def iter_metars(source, fields=None):
+    """Incrementally parses an ADDS METAR response
+
+    Arguments:
+        source {bytes|string|file} -- The XML document (or a binary stream of it)
+        fields {set} -- Only decode these keys (all keys if None)
+
+    Yields:
+        dictionary -- Each METAR, shaped like parse_metar_to_dict's output
+    """
+    for element in iter_elements(source, 'metar'):
+        yield _metar_from_element(element, fields)
+
+
+def parse_metar(source, fields=None):
+    """Parses the first METAR of an ADDS response
+
+    Arguments:
+        source {bytes|string|file} -- The XML response body
+        fields {set} -- Only decode these keys (all keys if None)
+
+    Returns:
+        dictionary -- Dictionary of values in the metar, or empty dict if none
+    """
+    for metar in iter_metars(source, fields):
+        return metar
+    return {}
+
+
+def _taf_from_element(taf):
+    """Converts a <TAF> element to a dictionary
+
+    Arguments:
+        taf {Element} -- A complete <TAF> element
+
+    Returns:
+        dictionary -- The TAF's values, with its <forecast> periods (shaped
+        like METAR dictionaries) in order under 'forecasts'
+    """
+    dictionary = {}
+    forecasts = []
+    for tag in taf:
+        if tag.tag == 'forecast':
+            forecasts.append(_metar_from_element(tag))
+            continue
+        string = _element_string(tag)
+        if string:
+            dictionary[tag.tag.lower()] = string
+    dictionary['forecasts'] = forecasts
+    return dictionary
+
+
+def iter_tafs(source):
+    """Incrementally parses an ADDS TAF response
+
+    Arguments:
+        source {bytes|string|file} -- The XML document (or a binary stream of it)
+
+    Yields:
+        dictionary -- Each TAF (see _taf_from_element)
+    """
+    for element in iter_elements(source, 'taf'):
+        yield _taf_from_element(element)
+
+
+def parse_taf(source):
+    """Parses the first TAF of an ADDS response
+
+    Arguments:
+        source {bytes|string|file} -- The XML response body
+
+    Returns:
+        dictionary -- The TAF, or empty dict if none
+    """
+    for taf in iter_tafs(source):
+        return taf
+    return {}
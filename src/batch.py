@@ -0,0 +1,109 @@
+""" Columnar batches of observations, for deriving weather across many stations at once
+
+Requires NumPy; imported only by the multi-station queries, so a
+single-station request never pays for it.
+"""
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import metar
+from observation import Observation
+
+
+def _visibility(observation):
+    """ Returns the visibility in statute miles, or NaN if unknown """
+    if isinstance(observation, Observation):
+        visibility = observation.get_value('visibility_statute_mi')
+    else:
+        visibility = observation.get('visibility_statute_mi')
+    try:
+        return float(visibility)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def _sky_layers(observation):
+    """Yields the (cover, base in feet) of every layer that has a base
+
+    Observations already hold typed layer tuples; layers of plain METAR
+    dictionaries without a readable base are skipped.
+    """
+    if isinstance(observation, Observation):
+        for layer in observation.get_value('sky_conditions') or ():
+            yield layer
+        return
+    for condition in observation.get('sky_conditions') or ():
+        try:
+            yield condition['sky_cover'], float(condition.get('cloud_base_ft_agl'))
+        except (KeyError, TypeError, ValueError):
+            continue
+
+
+class ObservationBatch:
+    """Observations of many stations, stored column by column
+
+    Sky conditions are flattened into parallel layer arrays (owning
+    station, cover, base), so the ceiling of every station is one masked
+    reduction. Thresholds come from metar.FLIGHT_CATEGORIES, exactly as in
+    the per-station metar.flight_category.
+
+    Arguments:
+        observations {list} -- Observations (or METAR dictionaries)
+    """
+
+    def __init__(self, observations):
+        self.observations = list(observations)
+        count = len(self.observations)
+        self.station_ids = [observation.get('station_id') for observation in self.observations]
+        self.visibility = np.array([_visibility(observation) for observation in self.observations], dtype=np.float64)
+        reported = []
+        owners = []
+        covers = []
+        bases = []
+        for index, observation in enumerate(self.observations):
+            reported.append((observation.get('flight_category') or '').strip().upper())
+            for cover, base in _sky_layers(observation):
+                owners.append(index)
+                covers.append(cover)
+                bases.append(base)
+        self.reported_categories = np.array(reported, dtype='<U4')
+        self._layer_owner = np.array(owners, dtype=np.intp)
+        self._layer_cover = np.array(covers, dtype='<U3')
+        self._layer_base = np.array(bases, dtype=np.float64)
+
+    def __len__(self):
+        return len(self.observations)
+
+    def ceilings(self):
+        """Returns the ceiling of every station
+
+        Returns:
+            ndarray -- Feet AGL of the lowest broken/overcast layer (inf when unlimited)
+        """
+        ceilings = np.full(len(self), np.inf)
+        is_ceiling = np.isin(self._layer_cover, metar.CEILING_COVERS)
+        np.minimum.at(ceilings, self._layer_owner[is_ceiling], self._layer_base[is_ceiling])
+        return ceilings
+
+    def derived_categories(self):
+        """Derives the flight category of every station from its ceiling and visibility
+
+        Returns:
+            ndarray -- LIFR, IFR, MVFR or VFR per station
+        """
+        ceilings = self.ceilings()
+        categories = np.full(len(self), 'VFR', dtype='<U4')
+        # Least to most restrictive, so the most restrictive matching category wins
+        for category, ceiling_below, visibility_below in reversed(metar.FLIGHT_CATEGORIES):
+            # NaN (unknown) visibilities compare False, as None does per station
+            below = (ceilings < ceiling_below) | (self.visibility < visibility_below)
+            categories[below] = category
+        return categories
+
+    def flight_categories(self):
+        """Returns the flight category of every station: as reported by ADDS, else derived
+
+        Returns:
+            ndarray -- LIFR, IFR, MVFR or VFR per station
+        """
+        return np.where(self.reported_categories != '', self.reported_categories, self.derived_categories())
@@ -0,0 +1,172 @@
+""" In-process caching primitives """
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+from collections import OrderedDict
+
+
+# How get_or_load_outcome answered: from the cache, by calling the loader,
+# or by waiting on a load another caller had already started
+HIT = 'hit'
+MISS = 'miss'
+COALESCED = 'coalesced'
+
+
+class _InFlight:
+    """ A load in progress that concurrent callers for the same key wait on """
+
+    __slots__ = ('event', 'value', 'error')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class TTLCache:
+    """A bounded LRU cache with per-entry expiry and coalesced misses
+
+    Arguments:
+        ttl {float} -- Default lifetime of an entry, in seconds
+        max_entries {int} -- Least recently used entries are evicted past this size
+        clock {callable} -- Returns the current time in seconds (for testing)
+    """
+
+    def __init__(self, ttl, max_entries=1024, clock=time.time):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """Returns a fresh cached value, or None
+
+        Arguments:
+            key {hashable} -- The cache key
+
+        Returns:
+            object|None -- The cached value if present and not expired
+        """
+        with self._lock:
+            return self._get_locked(key, self.clock())
+
+    def set(self, key, value, expires_at=None):
+        """Stores a value, evicting the least recently used entry if full
+
+        Arguments:
+            key {hashable} -- The cache key
+            value {object} -- The value to store
+            expires_at {float} -- Absolute expiry time (defaults to now + ttl)
+        """
+        if expires_at is None:
+            expires_at = self.clock() + self.ttl
+        with self._lock:
+            self._set_locked(key, value, expires_at)
+
+    def replace(self, key, old, new):
+        """Swaps an entry's value, keeping its expiry, if it still holds old
+
+        Arguments:
+            key {hashable} -- The cache key
+            old {object} -- The value expected to be cached
+            new {object} -- The replacement value
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] is old:
+                self._entries[key] = (new, entry[1])
+
+    def invalidate(self, key):
+        """ Removes a key from the cache if present """
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """ Removes every entry from the cache """
+        with self._lock:
+            self._entries.clear()
+
+    def get_or_load(self, key, loader, expires=None):
+        """Returns the cached value for key, calling loader on a miss
+
+        Concurrent misses for the same key share a single call to loader.
+        Falsy results are returned but never cached.
+
+        Arguments:
+            key {hashable} -- The cache key
+            loader {callable} -- Called with no arguments to produce the value
+            expires {callable} -- Optional (value, now) -> absolute expiry time
+
+        Returns:
+            object -- The cached or freshly loaded value
+        """
+        return self.get_or_load_outcome(key, loader, expires)[0]
+
+    def get_or_load_outcome(self, key, loader, expires=None):
+        """Like get_or_load, but also tells how the value was obtained
+
+        Arguments:
+            key {hashable} -- The cache key
+            loader {callable} -- Called with no arguments to produce the value
+            expires {callable} -- Optional (value, now) -> absolute expiry time
+
+        Returns:
+            tuple -- (value, HIT, MISS or COALESCED)
+        """
+        with self._lock:
+            now = self.clock()
+            value = self._get_locked(key, now)
+            if value is not None:
+                return value, HIT
+            in_flight = self._in_flight.get(key)
+            owner = in_flight is None
+            if owner:
+                in_flight = self._in_flight[key] = _InFlight()
+
+        if not owner:
+            in_flight.event.wait()
+            if in_flight.error is not None:
+                raise in_flight.error
+            return in_flight.value, COALESCED
+
+        value = None
+        try:
+            value = loader()
+            in_flight.value = value
+        except Exception as exc:
+            in_flight.error = exc
+            raise
+        finally:
+            with self._lock:
+                if in_flight.error is None and value:
+                    now = self.clock()
+                    expires_at = expires(value, now) if expires else now + self.ttl
+                    self._set_locked(key, value, expires_at)
+                del self._in_flight[key]
+            in_flight.event.set()
+        return value, MISS
+
+    def _get_locked(self, key, now):
+        """ Looks up a key, dropping it if expired (lock must be held) """
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if now >= expires_at:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def _set_locked(self, key, value, expires_at):
+        """ Stores an entry and enforces the size bound (lock must be held) """
+        self._entries[key] = (value, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
@@ -2,10 +2,52 @@
 # -*- coding: utf-8 -*-
 
 import os
-from ruamel.yaml import YAML
-import requests
-from bs4 import BeautifulSoup
+import time
+import calendar
+from datetime import datetime
 import logging
+import threading
+import adds
+import metrics
+import upstream
+from xml.etree.ElementTree import ParseError
+from templates import TemplateRegistry
+from cache import TTLCache
+from observation import Observation, StaleObservation
+
+
+# METARs are issued roughly hourly; cached reports are kept for at most
+# METAR_CACHE_TTL seconds and dropped as soon as a newer report could exist.
+METAR_CACHE_TTL = int(os.environ.get('METAR_CACHE_TTL', 15 * 60))
+METAR_CACHE_MIN_TTL = int(os.environ.get('METAR_CACHE_MIN_TTL', 60))
+METAR_CACHE_SIZE = int(os.environ.get('METAR_CACHE_SIZE', 2048))
+METAR_ISSUE_INTERVAL = 60 * 60
+
+# Optional local snapshot of the worldwide METAR bulk file (see snapshot.py);
+# its reports are served when no older than SNAPSHOT_MAX_AGE seconds
+SNAPSHOT_PATH = os.environ.get('METAR_SNAPSHOT_PATH')
+SNAPSHOT_MAX_AGE = int(os.environ.get('METAR_SNAPSHOT_MAX_AGE', 90 * 60))
+# Shared second-level cache (see shared_cache.py); disabled when unset
+SHARED_CACHE_URL = os.environ.get('SHARED_CACHE_URL')
+
+# When aviation.gov fails, the last report of a station is still served (with
+# its age) for up to LAST_KNOWN_GOOD_MAX_AGE seconds after it was observed
+LAST_KNOWN_GOOD_MAX_AGE = int(os.environ.get('LAST_KNOWN_GOOD_MAX_AGE', 6 * 60 * 60))
+
+# Always decoded, whichever fields a request needs (cache expiry and render keys)
+METAR_KEY_FIELDS = frozenset(['station_id', 'observation_time'])
+
+# Upper bound on the comma-separated stationString of one bulk request,
+# keeping the full URL well under common 2,000 character limits.
+STATION_STRING_BUDGET = 1500
+
+_templates = TemplateRegistry()
+metar_cache = TTLCache(ttl=METAR_CACHE_TTL, max_entries=METAR_CACHE_SIZE)
+last_known_good = TTLCache(ttl=LAST_KNOWN_GOOD_MAX_AGE, max_entries=METAR_CACHE_SIZE)
+_snapshot_store = None
+_shared_metar_cache = None
+_revalidating = set()
+_revalidating_lock = threading.Lock()
 
 
 def get_standard_error_message():
@@ -62,64 +104,165 @@ def get_intent(request_dictionary):
         return None
 
 
+def get_route_from_dialogflow(request_dictionary):
+    """Gets the airports of a route: departure, waypoints, destination, then alternates
+
+    Each is an airport parameter like 'airport' (an object with 'ICAO' and
+    'name'); 'waypoints' and 'alternates' may hold a list of them.
+
+    Arguments:
+        request_dictionary {dict} -- The JSON request object from DF as a dictionary
+
+    Returns:
+        list -- (role, ICAO code, airport name) for every airport given, in route order
+    """
+    try:
+        parameters = request_dictionary['queryResult']['parameters']
+    except KeyError:
+        return []
+    route = []
+    for role, key in (('Departure', 'departure'), ('Waypoint', 'waypoints'),
+                      ('Destination', 'destination'), ('Alternate', 'alternates')):
+        airports = parameters.get(key) or []
+        if isinstance(airports, dict):
+            airports = [airports]
+        for airport in airports:
+            if isinstance(airport, dict) and airport.get('ICAO'):
+                route.append((role, airport['ICAO'], airport.get('name') or airport['ICAO']))
+    return route
+
+
+def get_location_from_dialogflow(request_dictionary):
+    """Gets the user's device location, when they granted the location permission
+
+    Arguments:
+        request_dictionary {dict} -- The JSON request object from DF as a dictionary
+
+    Returns:
+        tuple|None -- (latitude, longitude) in degrees, or None
+    """
+    try:
+        coordinates = request_dictionary['originalDetectIntentRequest']['payload']['device']['location']['coordinates']
+        return float(coordinates['latitude']), float(coordinates['longitude'])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+# Length units of @sys.unit-length, in nautical miles
+_NAUTICAL_MILES_PER_UNIT = {'nmi': 1.0, 'NM': 1.0, 'km': 1 / 1.852, 'mi': 1.609344 / 1.852}
+
+
+def get_distance_from_dialogflow(request_dictionary):
+    """Gets the distance the user asked about (the @sys.unit-length 'distance' parameter)
+
+    Arguments:
+        request_dictionary {dict} -- The JSON request object from DF as a dictionary
+
+    Returns:
+        float|None -- The distance in nautical miles, or None if not given or unreadable
+    """
+    try:
+        distance = request_dictionary['queryResult']['parameters']['distance']
+        return float(distance['amount']) * _NAUTICAL_MILES_PER_UNIT[distance.get('unit', 'nmi')]
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def get_time_from_dialogflow(request_dictionary, now=None):
+    """Gets the time the user asked about (the @sys.time / @sys.date-time parameter)
+
+    Arguments:
+        request_dictionary {dict} -- The JSON request object from DF as a dictionary
+        now {float} -- The current UNIX time, for times without a date (default: now)
+
+    Returns:
+        float|None -- The time as a UNIX timestamp, or None if not given or unreadable
+    """
+    try:
+        requested = request_dictionary['queryResult']['parameters']['time']
+    except KeyError:
+        return None
+    if not requested:
+        return None
+    now = time.time() if now is None else now
+    try:
+        if 'T' in requested:
+            return datetime.strptime(requested, '%Y-%m-%dT%H:%M:%S%z').timestamp()
+        # A bare time of day: its next occurrence (in UTC)
+        hours, minutes, seconds = (int(part) for part in requested.split(':'))
+        today = now - now % 86400
+        timestamp = today + hours * 3600 + minutes * 60 + seconds
+        return timestamp if timestamp >= now else timestamp + 86400
+    except ValueError:
+        logging.error('Unreadable time provided: ' + str(requested))
+        return None
+
+
 def parse_metar_to_dict(aviation_gov_soup):
     """Parses the METAR BS-XML object to a KV dictionary
 
     Arguments:
-        aviation_gov_soup {BeautifulSoupObject} -- Object with METAR info
+        aviation_gov_soup {BeautifulSoupObject|None} -- Object with METAR info (None if the fetch failed)
 
     Returns:
         dictionary -- Dictionary of values in the metar, or empty dict if none
     """
-    metar = aviation_gov_soup.find('metar')
-    dictionary = {}
-    sky_conditions = []
-    for tag in metar:
-        if tag.name == 'sky_condition':
-            try:
-                sky_conditions.append({
-                    'cloud_base_ft_agl': tag['cloud_base_ft_agl'],
-                    'sky_cover': tag['sky_cover']
-                })
-            except (TypeError, KeyError):
-                pass
-        if tag.name and tag.string:
-            dictionary[tag.name] = tag.string
-    dictionary['sky_conditions'] = sky_conditions
-    return dictionary
+    if aviation_gov_soup is None:
+        return {}
+    with metrics.span('parse'):
+        metar = aviation_gov_soup.find('metar')
+        if metar is None:
+            return {}
+        dictionary = {}
+        sky_conditions = []
+        for tag in metar:
+            if tag.name == 'sky_condition':
+                try:
+                    sky_conditions.append({
+                        'cloud_base_ft_agl': tag['cloud_base_ft_agl'],
+                        'sky_cover': tag['sky_cover']
+                    })
+                except (TypeError, KeyError):
+                    pass
+            if tag.name and tag.string:
+                dictionary[tag.name] = tag.string
+        dictionary['sky_conditions'] = sky_conditions
+        return dictionary
 
 
 def get_response(category, speech_or_text='both', key="standard"):
     """Gets a response from the YAML dictionary
 
+    The YAML file is parsed and compiled once per process and only re-read
+    when its modification time changes.
+
     Arguments:
         category {string} -- Category of the response (base of the yaml file)
         speech_or_text {string} -- "speech" or "text" or "both"
         key {string} -- The key of the response (example "IFR")
     """
-    responses_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'responses.yaml')
-    yaml = YAML()
-    with open(responses_path, 'r') as yaml_responses:
-        try:
-            responses = yaml.load(yaml_responses)
-            if speech_or_text == 'both':
-                return responses[category][key]['speech'], responses[category][key]['text']
-            return responses[category][key][speech_or_text]
-        except Exception as exc:
-            print(exc)
-            logging.error(exc)
+    try:
+        responses = _templates.templates(time.monotonic())
+        if speech_or_text == 'both':
+            return responses[category][key]['speech'], responses[category][key]['text']
+        return responses[category][key][speech_or_text]
+    except Exception as exc:
+        print(exc)
+        logging.error(exc)
 
 
-def get_weather_from_aviation_gov(icao_code, **kwargs):
-    """Gets weather information from aviation.gov
+def fetch_aviation_gov_xml(icao_code, **kwargs):
+    """Gets the raw ADDS XML response body from aviation.gov
+
+    Requests share a pooled keep-alive session with timeouts, retries and a
+    circuit breaker (see upstream.py), so a degraded upstream fails fast.
 
     Arguments:
         icao_code {string} -- the ICAO code as provided by the user
 
     Returns:
-        BeautifulSoup Object || None -- Returns a BS Object if successful
+        bytes || None -- The undecoded response body if successful
     """
-    base_url = "https://www.aviationweather.gov/adds/dataserver_current/httpparam"
     parameters = {
         'dataSource': kwargs.get('type', 'metars'),
         'requestType': "retrieve",
@@ -128,7 +271,449 @@ def get_weather_from_aviation_gov(icao_code, **kwargs):
         'hoursBeforeNow': kwargs.get('hours', '3'),
         'mostRecent': True,
     }
-    response = requests.get(base_url, params=parameters)
-    if response.status_code != 200:
+    if not kwargs.get('most_recent', True):
+        del parameters['mostRecent']
+    elif kwargs.get('each_station'):
+        del parameters['mostRecent']
+        parameters['mostRecentForEachStation'] = 'constraint'
+    with metrics.span('fetch'):
+        return upstream.adds.get(parameters)
+
+
+def get_responses_generation():
+    """Returns a number that changes whenever responses.yaml is reloaded
+
+    Returns:
+        int -- The generation of the currently loaded templates
+    """
+    _templates.templates(time.monotonic())
+    return _templates.generation
+
+
+def get_weather_from_aviation_gov(icao_code, **kwargs):
+    """Gets weather information from aviation.gov
+
+    Arguments:
+        icao_code {string} -- the ICAO code as provided by the user
+
+    Returns:
+        BeautifulSoup Object || None -- Returns a BS Object if successful
+    """
+    from bs4 import BeautifulSoup
+    content = fetch_aviation_gov_xml(icao_code, **kwargs)
+    if content is None:
+        return None
+    with metrics.span('soup_parse'):
+        return BeautifulSoup(content, features="html.parser")
+
+
+def observation_timestamp(metar_dict):
+    """Returns the METAR observation time as a UNIX timestamp, or None
+
+    Arguments:
+        metar_dict {dict} -- The parsed METAR dictionary
+
+    Returns:
+        float|None -- Seconds since the epoch (UTC)
+    """
+    try:
+        observed = datetime.strptime(metar_dict['observation_time'], '%Y-%m-%dT%H:%M:%SZ')
+    except (KeyError, TypeError, ValueError):
+        return None
+    return calendar.timegm(observed.utctimetuple())
+
+
+class _UndecodedMetar:
+    """A fetched ADDS response cached as bytes until a full decode is needed
+
+    The request that fetched it only decodes the fields it needs (partial);
+    the first later cache hit decodes the rest.
+    """
+
+    __slots__ = ('content', 'partial')
+
+    def __init__(self, content, partial):
+        self.content = content
+        self.partial = partial
+
+
+def metar_expiry(metar_dict, now):
+    """Returns when a cached METAR should be refreshed
+
+    A report stays cached until the next one could have been issued, capped
+    at METAR_CACHE_TTL and never shorter than METAR_CACHE_MIN_TTL (so late
+    reports don't cause a fetch on every request).
+
+    Arguments:
+        metar_dict {dict} -- The parsed METAR dictionary
+        now {float} -- The current time
+
+    Returns:
+        float -- Absolute expiry time
+    """
+    if isinstance(metar_dict, _UndecodedMetar):
+        metar_dict = metar_dict.partial
+    expires_at = now + METAR_CACHE_TTL
+    observed = observation_timestamp(metar_dict)
+    if observed is not None:
+        expires_at = min(expires_at, observed + METAR_ISSUE_INTERVAL)
+    return max(expires_at, now + METAR_CACHE_MIN_TTL)
+
+
+def _snapshot_metar(icao_code):
+    """Looks a station up in the local snapshot, if one is configured
+
+    Arguments:
+        icao_code {string} -- The upper-cased ICAO code
+
+    Returns:
+        Observation|None -- The snapshot's report, if present and recent enough
+    """
+    global _snapshot_store
+    if not SNAPSHOT_PATH:
+        return None
+    if _snapshot_store is None:
+        from snapshot import SnapshotStore
+        _snapshot_store = SnapshotStore(SNAPSHOT_PATH)
+    with metrics.span('snapshot'):
+        observation = _snapshot_store.get(icao_code)
+    if observation is None:
+        metrics.count('snapshot.miss')
+        return None
+    observed = observation_timestamp(observation)
+    if observed is None or time.time() - observed > SNAPSHOT_MAX_AGE:
+        metrics.count('snapshot.stale')
+        return None
+    metrics.count('snapshot.hit')
+    return observation
+
+
+def _shared_cache():
+    """ Returns the shared METAR cache (see shared_cache.py), or None if not configured """
+    global _shared_metar_cache
+    if _shared_metar_cache is None:
+        # Checked first: shared_cache loads sqlite3 and socket, kept off cold starts without one
+        if not SHARED_CACHE_URL:
+            return None
+        import shared_cache
+        _shared_metar_cache = shared_cache.SharedMetarCache(shared_cache.open_backend(SHARED_CACHE_URL))
+    return _shared_metar_cache
+
+
+def _remember(icao_code, cached):
+    """ Keeps a station's newest report as its last known good one """
+    observed = observation_timestamp(cached.partial if isinstance(cached, _UndecodedMetar) else cached)
+    if observed is not None:
+        last_known_good.set(icao_code, cached, observed + LAST_KNOWN_GOOD_MAX_AGE)
+
+
+def _last_known_good_metar(icao_code):
+    """Returns the last known report of a station that could not be fetched
+
+    A background refresh of the station is started, so the next request can
+    be answered with a current report once aviation.gov responds again.
+
+    Arguments:
+        icao_code {string} -- The upper-cased ICAO code
+
+    Returns:
+        StaleObservation|dictionary -- The last known report, or empty dict if none is recent enough
+    """
+    cached = last_known_good.get(icao_code)
+    if cached is None:
+        return {}
+    metrics.count('metar.last_known_good')
+    _start_revalidation(icao_code)
+    if isinstance(cached, _UndecodedMetar):
+        metar_dict = _parse_content(cached.content)
+        cached = Observation(metar_dict) if metar_dict else cached.partial
+    return StaleObservation.copy_of(cached)
+
+
+def _publish(icao_code, content, now):
+    """ Fully decodes a fetched response and writes it to the shared cache """
+    metar_dict = _parse_content(content)
+    if metar_dict:
+        observation = Observation(metar_dict)
+        _shared_cache().set(icao_code, observation, metar_expiry(observation, now))
+
+
+def _revalidate(icao_code):
+    """Fetches a station's report and stores it in both cache tiers
+
+    Runs in the background, at most once per station at a time, while the
+    stale report is being served.
+    """
+    try:
+        content = fetch_aviation_gov_xml(icao_code)
+        metar_dict = _parse_content(content) if content is not None else {}
+        if metar_dict:
+            observation = Observation(metar_dict)
+            now = metar_cache.clock()
+            expires_at = metar_expiry(observation, now)
+            metar_cache.set(icao_code, observation, expires_at)
+            _remember(icao_code, observation)
+            shared = _shared_cache()
+            if shared is not None:
+                shared.set(icao_code, observation, expires_at)
+    finally:
+        with _revalidating_lock:
+            _revalidating.discard(icao_code)
+
+
+def _shared_metar(icao_code):
+    """Looks a station up in the shared cache, if one is configured
+
+    A stale report (past its freshness, but still kept) is returned too, as
+    a StaleObservation so the user is told its age, and a background refresh
+    of the station is started.
+
+    Arguments:
+        icao_code {string} -- The upper-cased ICAO code
+
+    Returns:
+        Observation|StaleObservation|None -- The shared report, if present
+    """
+    shared = _shared_cache()
+    if shared is None:
         return None
-    return BeautifulSoup(response.text, features="html.parser")
+    observation, fresh_until = shared.get(icao_code)
+    if observation is None:
+        metrics.count('shared_cache.miss')
+        return None
+    if metar_cache.clock() < fresh_until:
+        metrics.count('shared_cache.hit')
+        return observation
+    metrics.count('shared_cache.stale')
+    _start_revalidation(icao_code)
+    return StaleObservation.copy_of(observation)
+
+
+def _start_revalidation(icao_code):
+    """ Starts a background refresh of a station, unless one is already running """
+    with _revalidating_lock:
+        if icao_code in _revalidating:
+            return
+        _revalidating.add(icao_code)
+    upstream.executor.submit(_revalidate, icao_code)
+
+
+def _parse_content(content, fields=None):
+    """ Stream-parses an ADDS response body, returning an empty dict if unreadable """
+    try:
+        with metrics.span('parse'):
+            return adds.parse_metar(content, fields)
+    except ParseError as exc:
+        logging.error('Unable to parse ADDS response: %s', exc)
+        return {}
+
+
+def _fetch_metar(icao_code, fields=None):
+    """Reads a METAR from the shared cache or the snapshot, or fetches and stream-parses it
+
+    A fetched report is written to the shared cache in the background, fully
+    decoded, so the request itself still only decodes the fields it needs.
+
+    Arguments:
+        icao_code {string} -- The upper-cased ICAO code
+        fields {set} -- Fields the caller needs (all fields if None)
+
+    Returns:
+        Observation|_UndecodedMetar|dictionary -- The report, or empty dict on failure
+    """
+    observation = _shared_metar(icao_code)
+    if observation is not None:
+        return observation
+    observation = _snapshot_metar(icao_code)
+    if observation is not None:
+        return observation
+    content = fetch_aviation_gov_xml(icao_code)
+    if content is None:
+        return {}
+    if _shared_cache() is not None:
+        upstream.executor.submit(_publish, icao_code, content, metar_cache.clock())
+    if fields is None:
+        metar_dict = _parse_content(content)
+        return Observation(metar_dict) if metar_dict else {}
+    metar_dict = _parse_content(content, METAR_KEY_FIELDS.union(fields))
+    return _UndecodedMetar(content, Observation(metar_dict)) if metar_dict else {}
+
+
+def _decoded(icao_code, cached):
+    """ Returns a cached report as a complete Observation, decoding it in place if needed """
+    if not isinstance(cached, _UndecodedMetar):
+        return cached
+    metar_dict = _parse_content(cached.content)
+    observation = Observation(metar_dict) if metar_dict else cached.partial
+    metar_cache.replace(icao_code, cached, observation)
+    return observation
+
+
+def get_cached_metar(icao_code):
+    """Returns the fresh cached report of a station, without fetching it
+
+    Arguments:
+        icao_code {string} -- The upper-cased ICAO code
+
+    Returns:
+        Observation|StaleObservation|None -- The cached report, fully decoded, or None if not cached
+    """
+    cached = metar_cache.get(icao_code)
+    return _decoded(icao_code, cached) if cached else None
+
+
+def get_metar(icao_code, fields=None):
+    """Gets the parsed METAR for a station, served from cache when fresh
+
+    Concurrent requests for the same station share one upstream fetch.
+    Reports are cached as compact, read-only Observation records. When
+    fields are given, a cache miss only decodes those fields (plus the
+    station and observation time); the rest is decoded on the next hit.
+
+    If no report can be fetched, the station's last known one (see
+    LAST_KNOWN_GOOD_MAX_AGE) is returned as a StaleObservation instead.
+
+    Arguments:
+        icao_code {string} -- the ICAO code as provided by the user
+        fields {iterable} -- METAR fields the caller needs (all fields if None)
+
+    Returns:
+        Observation|dictionary -- The parsed METAR, or empty dict if none
+    """
+    icao_code = icao_code.upper()
+    fetched = []
+
+    def load():
+        fetched.append(_fetch_metar(icao_code, fields))
+        # A stale shared report is served (until revalidated), not remembered as a current one
+        if fetched[0] and not isinstance(fetched[0], StaleObservation):
+            _remember(icao_code, fetched[0])
+        return fetched[0]
+
+    # Requests that waited on another one's fetch are counted apart from true hits
+    cached, outcome = metar_cache.get_or_load_outcome(icao_code, load, expires=metar_expiry)
+    metrics.count('metar_cache.' + outcome)
+    if not cached:
+        return _last_known_good_metar(icao_code)
+    if fetched and fetched[0] is cached and isinstance(cached, _UndecodedMetar):
+        return cached.partial
+    return _decoded(icao_code, cached)
+
+
+async def get_metar_async(icao_code, executor=None, fields=None):
+    """Async variant of get_metar for use on an event loop
+
+    Cache hits are served without leaving the loop; misses run the blocking
+    fetch and parse on an executor, still coalesced per station.
+
+    Arguments:
+        icao_code {string} -- the ICAO code as provided by the user
+        executor {Executor} -- Executor for the blocking fetch (default executor if None)
+        fields {iterable} -- METAR fields the caller needs (all fields if None)
+
+    Returns:
+        Observation|dictionary -- The parsed METAR, or empty dict if none
+    """
+    cached = get_cached_metar(icao_code.upper())
+    if cached:
+        metrics.count('metar_cache.hit')
+        return cached
+    import asyncio
+    import contextvars
+    loop = asyncio.get_event_loop()
+    # Run in a copy of this context so the fetch's spans count towards this request
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(executor, context.run, get_metar, icao_code, fields)
+
+
+def _chunk_station_codes(icao_codes, budget=STATION_STRING_BUDGET):
+    """Splits station codes into comma-joined strings no longer than budget
+
+    Arguments:
+        icao_codes {list} -- Upper-cased, de-duplicated ICAO codes
+        budget {int} -- Maximum length of each joined string
+
+    Yields:
+        string -- A comma-separated stationString
+    """
+    chunk = []
+    length = 0
+    for icao_code in icao_codes:
+        added = len(icao_code) + (1 if chunk else 0)
+        if chunk and length + added > budget:
+            yield ','.join(chunk)
+            chunk = []
+            added = len(icao_code)
+            length = 0
+        chunk.append(icao_code)
+        length += added
+    if chunk:
+        yield ','.join(chunk)
+
+
+def get_metars(icao_codes, refresh=False):
+    """Gets the parsed METARs of many stations with as few upstream calls as possible
+
+    Stations missing from the in-process cache are read from the shared
+    cache in one round trip; the rest are requested in bulk (one request per
+    URL-sized chunk), and every returned report is stored in both tiers.
+
+    Arguments:
+        icao_codes {iterable} -- ICAO codes to fetch
+        refresh {bool} -- Fetch every station, even those cached and fresh
+
+    Returns:
+        dictionary -- ICAO code to Observation (stations without a report are omitted)
+    """
+    wanted = []
+    seen = set()
+    for icao_code in icao_codes:
+        icao_code = icao_code.upper()
+        if icao_code not in seen:
+            seen.add(icao_code)
+            wanted.append(icao_code)
+
+    metars = {}
+    missing = []
+    for icao_code in wanted:
+        cached = None if refresh else get_cached_metar(icao_code)
+        # A stale report is fetched again: answers about many stations only use current ones
+        if cached and not isinstance(cached, StaleObservation):
+            metars[icao_code] = cached
+        else:
+            missing.append(icao_code)
+
+    shared = _shared_cache()
+    if shared is not None and missing and not refresh:
+        now = metar_cache.clock()
+        for icao_code, (observation, fresh_until) in shared.get_many(missing).items():
+            if now < fresh_until:
+                metrics.count('shared_cache.hit')
+                metar_cache.set(icao_code, observation, fresh_until)
+                metars[icao_code] = observation
+        missing = [icao_code for icao_code in missing if icao_code not in metars]
+
+    published = {}
+    for station_string in _chunk_station_codes(missing, STATION_STRING_BUDGET):
+        content = fetch_aviation_gov_xml(station_string, each_station=True)
+        if content is None:
+            logging.error('Bulk METAR fetch failed for: ' + station_string)
+            continue
+        try:
+            fetched = list(adds.iter_metars(content))
+        except ParseError as exc:
+            logging.error('Unable to parse ADDS response: %s', exc)
+            continue
+        now = metar_cache.clock()
+        for metar_dict in fetched:
+            icao_code = metar_dict.get('station_id', '').upper()
+            if icao_code in seen and icao_code not in metars:
+                observation = Observation(metar_dict)
+                expires_at = metar_expiry(observation, now)
+                metar_cache.set(icao_code, observation, expires_at)
+                _remember(icao_code, observation)
+                metars[icao_code] = observation
+                published[icao_code] = (observation, expires_at)
+    if shared is not None and published:
+        shared.set_many(published)
+    return metars
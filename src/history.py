@@ -0,0 +1,133 @@
+""" Recent METAR history per station, for trend questions
+
+Each station keeps a bounded ring buffer of decoded observations, oldest
+first. A query only asks aviation.gov for reports newer than the newest one
+already buffered (and not at all while no newer report can exist yet), so
+the full window is fetched once per station rather than on every query.
+"""
+# -*- coding: utf-8 -*-
+
+import os
+import threading
+import time
+from collections import deque
+import adds
+import helpers
+import metrics
+from cache import TTLCache
+from observation import Observation
+from xml.etree.ElementTree import ParseError
+
+
+# Enough for a few hours of routine reports plus specials
+HISTORY_SIZE = int(os.environ.get('METAR_HISTORY_SIZE', 24))
+# ADDS keeps a limited window of past METARs; never ask for more
+HISTORY_MAX_HOURS = 24
+HISTORY_STATIONS = int(os.environ.get('METAR_HISTORY_STATIONS', 512))
+
+
+class StationHistory:
+    """Ring buffer of one station's observations, oldest first
+
+    Arguments:
+        icao_code {string} -- The upper-cased ICAO code
+        size {int} -- Maximum number of observations kept
+        clock {callable} -- Returns the current UNIX time (for testing)
+    """
+
+    def __init__(self, icao_code, size=HISTORY_SIZE, clock=time.time):
+        self.icao_code = icao_code
+        self.clock = clock
+        self._observations = deque(maxlen=size)
+        # UNIX time of the newest buffered observation, and of the window start covered
+        self._head = None
+        self._covered_from = None
+        self._fresh_until = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, observations):
+        """Appends observations newer than the buffer's head, in time order
+
+        Arguments:
+            observations {iterable} -- Observations (in any order, possibly repeated)
+
+        Returns:
+            int -- Number of observations added
+        """
+        newer = []
+        for observation in observations:
+            observed = helpers.observation_timestamp(observation)
+            if observed is not None and (self._head is None or observed > self._head):
+                newer.append((observed, observation))
+        newer.sort(key=lambda pair: pair[0])
+        added = 0
+        for observed, observation in newer:
+            if observed == self._head:
+                continue
+            self._observations.append(observation)
+            self._head = observed
+            added += 1
+        return added
+
+    def _fetch(self, hours):
+        """ Fetches every report of the last `hours` hours, returning Observations """
+        content = helpers.fetch_aviation_gov_xml(self.icao_code, hours='{:.2f}'.format(hours), most_recent=False)
+        if content is None:
+            return None
+        try:
+            return [Observation(metar_dict) for metar_dict in adds.iter_metars(content) if metar_dict]
+        except ParseError:
+            return None
+
+    def since(self, hours):
+        """Returns the observations of the last `hours` hours, fetching only what is new
+
+        Arguments:
+            hours {float} -- Length of the window
+
+        Returns:
+            list -- Observations, oldest first (empty if none could be fetched)
+        """
+        hours = min(hours, HISTORY_MAX_HOURS)
+        with self._lock:
+            now = self.clock()
+            window_start = now - hours * 3600
+            if self._head is None or self._covered_from is None or self._covered_from > window_start:
+                # Nothing buffered for (all of) this window yet
+                fetch_hours = hours
+            elif now >= self._fresh_until:
+                # Only what was issued after the head, with a minute of slack
+                fetch_hours = (now - self._head) / 3600.0 + 1 / 60.0
+            else:
+                fetch_hours = None
+            metrics.count('metar_history.hit' if fetch_hours is None else 'metar_history.fetch')
+            if fetch_hours is not None:
+                observations = self._fetch(fetch_hours)
+                if observations is not None:
+                    if fetch_hours == hours:
+                        self._covered_from = window_start
+                    self.add(observations)
+                    if self._observations:
+                        self._fresh_until = helpers.metar_expiry(self._observations[-1], now)
+            return [
+                observation for observation in self._observations
+                if helpers.observation_timestamp(observation) >= window_start
+            ]
+
+
+history_cache = TTLCache(ttl=HISTORY_MAX_HOURS * 60 * 60, max_entries=HISTORY_STATIONS)
+
+
+def get_metar_history(icao_code, hours):
+    """Gets a station's observations of the last `hours` hours
+
+    Arguments:
+        icao_code {string} -- the ICAO code as provided by the user
+        hours {float} -- Length of the window
+
+    Returns:
+        list -- Observations, oldest first (empty if unavailable)
+    """
+    icao_code = icao_code.upper()
+    station_history = history_cache.get_or_load(icao_code, lambda: StationHistory(icao_code))
+    return station_history.since(hours)
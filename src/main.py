@@ -2,55 +2,226 @@
 # -*- coding: utf-8 -*-
 
 import os
+import re
+import contextvars
 import sys
-from bs4 import BeautifulSoup
-import requests
+from functools import partial
 import json
 import logging
 import helpers
+import history
+import metrics
 import responses
+import route
+import stations
+import taf
+from observation import StaleObservation
+import prewarm
+from prewarm import station_popularity
 
 
-def build_response(request_json):
-    """Builds the response from the request
+# Intent name to renderer, built once per process rather than per request
+INTENTS = {
+    'get_flight_condition': responses.get_flight_category,
+    'get_wind_information': responses.get_wind_information,
+    'get_elevation': responses.get_elevation,
+    'get_visibility': responses.get_visibility,
+    'get_temperature': responses.get_temperature,
+    'get_metar_raw': responses.get_metar_raw,
+    'get_metar_parsed': responses.get_metar_parsed,
+    'get_altimeter': responses.get_altimeter,
+    'get_ceiling_trend': responses.get_ceiling_trend,
+    'get_wind_trend': responses.get_wind_trend,
+    'get_forecast_category': responses.get_forecast_category,
+    'get_nearest_weather': responses.get_nearest_weather,
+    'get_nearest_vfr': responses.get_nearest_vfr,
+    'get_route_briefing': responses.get_route_briefing,
+    'get_vfr_nearby': responses.get_vfr_nearby,
+}
+
+_ICAO_CODE = re.compile(r'^[A-Za-z][A-Za-z0-9]{3}$')
+
+# Keep the stations this instance is asked about warm, when opted in (see prewarm.py)
+if prewarm.PREWARM_IN_PROCESS:
+    prewarm.start_in_process()
+
+
+def _read_request(request_json):
+    """Reads the fields every intent needs from the request
+
+    Requests are validated here, before any I/O: an unknown intent or a
+    malformed ICAO code never reaches the cache or aviation.gov.
 
     Arguments:
         request_json {dict} -- The dictionary request object
 
     Returns:
-        string -- The string reponse message
+        tuple -- (icao_code, airport_name, handler); handler is None if the request is invalid
     """
-
-    icao_code = helpers.get_icao_code_from_dialogflow(request_json)
-    airport_name = helpers.get_airport_name_from_dialogflow(request_json)
-    intent = helpers.get_intent(request_json)
-    if not icao_code:
+    with metrics.span('dialogflow'):
+        icao_code = helpers.get_icao_code_from_dialogflow(request_json)
+        airport_name = helpers.get_airport_name_from_dialogflow(request_json)
+        intent = helpers.get_intent(request_json)
+    handler = INTENTS.get(intent)
+    if handler is None:
+        logging.error('An unexpected intent occured: ' + str(intent))
+    elif getattr(handler, 'location', False):
+        if helpers.get_location_from_dialogflow(request_json) is None:
+            logging.error('No device location provided.')
+            handler = None
+    elif getattr(handler, 'route', False):
+        if not _valid_route(helpers.get_route_from_dialogflow(request_json)):
+            handler = None
+    elif not icao_code:
         logging.error('No ICAO code provided.')
-        return helpers.get_standard_error_message(), helpers.get_standard_error_message()
+        handler = None
+    elif not _ICAO_CODE.match(icao_code):
+        logging.error('Invalid ICAO code provided: ' + icao_code)
+        handler = None
+    else:
+        station_popularity.record(icao_code)
+    return icao_code, airport_name, handler
+
+
+def _valid_route(airports):
+    """ Returns whether a route has a departure and destination, valid ICAO codes and not too many airports """
+    roles = set(role for role, _, _ in airports)
+    if 'Departure' not in roles or 'Destination' not in roles:
+        logging.error('A route needs a departure and a destination.')
+        return False
+    if len(airports) > route.MAX_ROUTE_POINTS:
+        logging.error('Too many airports in route: {}'.format(len(airports)))
+        return False
+    for _, icao_code, _ in airports:
+        if not _ICAO_CODE.match(icao_code):
+            logging.error('Invalid ICAO code provided: ' + icao_code)
+            return False
+    return True
+
 
-    # Call Aviation.gov
-    bs_data = helpers.get_weather_from_aviation_gov(icao_code)
-    metar_dict = helpers.parse_metar_to_dict(bs_data)
+def _render_response(handler, metar_dict, airport_name):
+    """Renders the response for an intent from a parsed METAR
+
+    Arguments:
+        handler {callable} -- The renderer of the intent (from INTENTS)
+        metar_dict {dict|list|Forecast} -- The parsed METAR, or what the intent needs instead (empty if unavailable)
+        airport_name {string} -- The airport name
+
+    Returns:
+        tuple -- The speech and text responses
+    """
     if not metar_dict:
         logging.error("Wasn't able to get metar dictionary.")
         return helpers.get_standard_error_message(), helpers.get_standard_error_message()
+    with metrics.span('render'):
+        rendered = handler(metar_dict, airport_name)
+        if isinstance(metar_dict, StaleObservation):
+            rendered = responses.add_stale_disclaimer(rendered, metar_dict)
+        return rendered
+
+
+def _tag_request(request_metrics, icao_code, handler):
+    """ Describes the request in its structured metrics log record """
+    request_metrics.tags['station'] = icao_code
+    request_metrics.tags['intent'] = handler.__name__ if handler is not None else None
+
+
+def _forecast_handler(handler, request_json, current):
+    """ Binds the requested time and the current METAR to a forecast renderer """
+    return partial(handler, when=helpers.get_time_from_dialogflow(request_json), metar_dict=current)
+
+
+def _needs_metar(handler):
+    """ Returns whether an intent is answered from the current METAR of its station alone """
+    return not (
+        getattr(handler, 'forecast', False) or getattr(handler, 'history_hours', None) or
+        getattr(handler, 'location', False) or getattr(handler, 'route', False) or
+        getattr(handler, 'area', False)
+    )
 
-    intents = {
-        'get_flight_condition': responses.get_flight_category,
-        'get_wind_information': responses.get_wind_information,
-        'get_elevation': responses.get_elevation,
-        'get_visibility': responses.get_visibility,
-        'get_temperature': responses.get_temperature,
-        'get_metar_raw': responses.get_metar_raw,
-        'get_metar_parsed': responses.get_metar_parsed,
-        'get_altimeter': responses.get_altimeter,
-    }
-
-    if intent not in intents:
-        logging.error('An unexpected intent occured: ' + intent)
-        return helpers.get_standard_error_message(), helpers.get_standard_error_message()
 
-    return intents[intent](metar_dict, airport_name)
+def _fetch(handler, icao_code, request_json):
+    """Gets what an intent is answered from (blocking)
+
+    Arguments:
+        handler {callable} -- The renderer of the intent (from INTENTS)
+        icao_code {string} -- The ICAO code of the request
+        request_json {dict} -- The dictionary request object
+
+    Returns:
+        tuple -- (the renderer to call, what to render it from)
+    """
+    if getattr(handler, 'forecast', False):
+        current, forecast = taf.get_metar_and_taf(icao_code, responses.get_flight_category.fields)
+        return _forecast_handler(handler, request_json, current), forecast
+    if getattr(handler, 'history_hours', None):
+        return handler, history.get_metar_history(icao_code, handler.history_hours)
+    if getattr(handler, 'location', False):
+        latitude, longitude = helpers.get_location_from_dialogflow(request_json)
+        return handler, stations.nearest_reports(latitude, longitude)
+    if getattr(handler, 'area', False):
+        radius = min(
+            helpers.get_distance_from_dialogflow(request_json) or stations.SWEEP_RADIUS_NM, stations.SWEEP_MAX_RADIUS_NM
+        )
+        return partial(handler, radius=radius), stations.sweep_reports(icao_code, radius)
+    if getattr(handler, 'route', False):
+        briefing = route.get_route_briefing(helpers.get_route_from_dialogflow(request_json))
+        # Render only if at least one airport reported in time
+        return handler, briefing if any(observation for _, _, _, observation in briefing) else []
+    # Call Aviation.gov (or reuse a recent report for this station)
+    return handler, helpers.get_metar(icao_code, getattr(handler, 'fields', None))
+
+
+def build_response(request_json):
+    """Builds the response from the request
+
+    Per-stage timings and cache counters are logged for every request
+    (see metrics.py).
+
+    Arguments:
+        request_json {dict} -- The dictionary request object
+
+    Returns:
+        string -- The string reponse message
+    """
+    with metrics.request() as request_metrics:
+        icao_code, airport_name, handler = _read_request(request_json)
+        _tag_request(request_metrics, icao_code, handler)
+        if handler is None:
+            return helpers.get_standard_error_message(), helpers.get_standard_error_message()
+
+        handler, metar_dict = _fetch(handler, icao_code, request_json)
+        return _render_response(handler, metar_dict, airport_name)
+
+
+async def build_response_async(request_json):
+    """Builds the response from the request without blocking the event loop
+
+    Arguments:
+        request_json {dict} -- The dictionary request object
+
+    Returns:
+        string -- The string reponse message
+    """
+    with metrics.request() as request_metrics:
+        icao_code, airport_name, handler = _read_request(request_json)
+        _tag_request(request_metrics, icao_code, handler)
+        if handler is None:
+            return helpers.get_standard_error_message(), helpers.get_standard_error_message()
+
+        if getattr(handler, 'forecast', False):
+            current, metar_dict = await taf.get_metar_and_taf_async(icao_code, responses.get_flight_category.fields)
+            handler = _forecast_handler(handler, request_json, current)
+        elif _needs_metar(handler):
+            metar_dict = await helpers.get_metar_async(icao_code, fields=getattr(handler, 'fields', None))
+        else:
+            import asyncio
+            loop = asyncio.get_event_loop()
+            context = contextvars.copy_context()
+            handler, metar_dict = await loop.run_in_executor(
+                None, context.run, _fetch, handler, icao_code, request_json
+            )
+        return _render_response(handler, metar_dict, airport_name)
 
 
 def main(request):
@@ -66,3 +237,58 @@ def main(request):
     return json.dumps({
         'fulfillmentText': speech
     })
+
+
+async def _send_json(send, status, body):
+    """ Sends a complete JSON HTTP response over ASGI """
+    payload = json.dumps(body).encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [
+            (b'content-type', b'application/json'),
+            (b'content-length', str(len(payload)).encode('ascii')),
+        ],
+    })
+    await send({'type': 'http.response.body', 'body': payload})
+
+
+async def app(scope, receive, send):
+    """ASGI entry point for the webhook (e.g. `uvicorn main:app`)
+
+    Serves the same Dialogflow fulfillment as main(), but many requests can
+    share one worker while they wait on aviation.gov.
+
+    Arguments:
+        scope {dict} -- The ASGI connection scope
+        receive {callable} -- Awaitable returning the next ASGI event
+        send {callable} -- Awaitable sending an ASGI event
+    """
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+    if scope['type'] != 'http':
+        return
+    if scope['method'] != 'POST':
+        await _send_json(send, 405, {'error': 'Method not allowed'})
+        return
+
+    body = b''
+    more_body = True
+    while more_body:
+        message = await receive()
+        body += message.get('body', b'')
+        more_body = message.get('more_body', False)
+    try:
+        request_json = json.loads(body.decode('utf-8'))
+    except ValueError:
+        await _send_json(send, 400, {'error': 'Invalid JSON'})
+        return
+
+    speech, text = await build_response_async(request_json)
+    await _send_json(send, 200, {'fulfillmentText': speech})
@@ -0,0 +1,215 @@
+""" Single-pass decoder for raw METAR reports """
+# -*- coding: utf-8 -*-
+
+import re
+from datetime import datetime, timedelta
+
+
+# Flight category thresholds, as (category, ceiling below ft, visibility below sm)
+FLIGHT_CATEGORIES = (
+    ('LIFR', 500, 1.0),
+    ('IFR', 1000, 3.0),
+    ('MVFR', 3001, 5.01),
+)
+CEILING_COVERS = ('BKN', 'OVC', 'OVX')
+
+_WIND_UNITS_TO_KT = {'KT': 1.0, 'MPS': 1.943844, 'KMH': 0.539957}
+_METERS_PER_STATUTE_MILE = 1609.344
+_IN_HG_PER_HPA = 0.0295299830714
+
+_HEADER = re.compile(
+    r'^(?:(?P<type>METAR|SPECI)\s+)?(?P<station>[A-Z][A-Z0-9]{3})\s+'
+    r'(?:(?P<day>\d{2})(?P<hour>\d{2})(?P<minute>\d{2})Z\s*)?'
+)
+
+# One alternation per group type; finditer walks the body once, whole tokens only
+_BODY = re.compile(r'''(?<!\S)(?:
+    (?P<wind>(?P<wind_dir>\d{3}|VRB)(?P<wind_speed>\d{2,3})(?:G(?P<wind_gust>\d{2,3}))?(?P<wind_unit>KT|MPS|KMH))
+  | (?P<wind_var>\d{3}V\d{3})
+  | (?P<vis_sm>(?P<vis_mod>[MP])?(?:(?P<vis_whole>\d{1,2})\s+)?(?P<vis_num>\d{1,2})(?:/(?P<vis_den>\d{1,2}))?SM)
+  | (?P<vis_m>\d{4})(?:NDV)?
+  | (?P<cavok>CAVOK)
+  | (?P<wx>(?:[-+]|VC)?(?:MI|PR|BC|DR|BL|SH|TS|FZ)?
+           (?:DZ|RA|SN|SG|IC|PL|GR|GS|UP|BR|FG|FU|VA|DU|SA|HZ|PY|PO|SQ|FC|SS|DS)+
+        |(?:[-+]|VC)?(?:TS|SH))
+  | (?P<sky>(?P<sky_cover>FEW|SCT|BKN|OVC|VV)(?P<sky_base>\d{3})(?:CB|TCU|///)?)
+  | (?P<clear>SKC|CLR|NSC|NCD)
+  | (?P<temp>(?P<temp_c>M?\d{2})/(?P<dew_c>M?\d{2})?)
+  | (?P<altim>(?P<altim_unit>[AQ])(?P<altim_value>\d{4}))
+)(?=\s|$)''', re.VERBOSE)
+
+_SLP = re.compile(r'(?<!\S)SLP(\d{3})(?=\s|$)')
+
+
+def ceiling(sky_conditions):
+    """Returns the ceiling from a list of sky conditions
+
+    Arguments:
+        sky_conditions {list} -- Dicts with 'sky_cover' and 'cloud_base_ft_agl'
+
+    Returns:
+        int|None -- Height of the lowest broken/overcast layer in feet AGL
+    """
+    bases = [
+        int(cond['cloud_base_ft_agl']) for cond in sky_conditions
+        if cond['sky_cover'] in CEILING_COVERS
+    ]
+    return min(bases) if bases else None
+
+
+def flight_category(ceiling_ft, visibility_sm):
+    """Derives the flight category from the ceiling and visibility
+
+    Arguments:
+        ceiling_ft {int|None} -- Ceiling in feet AGL (None when unlimited)
+        visibility_sm {float|None} -- Visibility in statute miles (None when unknown)
+
+    Returns:
+        string -- LIFR, IFR, MVFR or VFR
+    """
+    for category, ceiling_below, visibility_below in FLIGHT_CATEGORIES:
+        if ceiling_ft is not None and ceiling_ft < ceiling_below:
+            return category
+        if visibility_sm is not None and visibility_sm < visibility_below:
+            return category
+    return 'VFR'
+
+
+def _celsius(value):
+    """ Converts a METAR temperature group (M for minus) to a float """
+    if value.startswith('M'):
+        return -float(value[1:])
+    return float(value)
+
+
+def _observation_time(day, hour, minute, now):
+    """ Places a day/hour/minute group in the most recent matching month """
+    observed = None
+    month_start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    for _ in range(3):
+        try:
+            observed = month_start.replace(day=day, hour=hour, minute=minute)
+        except ValueError:
+            observed = None
+        if observed is not None and observed <= now + timedelta(hours=1):
+            return observed
+        month_start = (month_start - timedelta(days=1)).replace(day=1)
+    return observed
+
+
+def _visibility_statute_mi(match):
+    """ Returns the visibility of a matched statute-mile group in miles """
+    visibility = float(match.group('vis_num'))
+    if match.group('vis_den'):
+        visibility /= float(match.group('vis_den'))
+    if match.group('vis_whole'):
+        visibility += float(match.group('vis_whole'))
+    return visibility
+
+
+def decode(raw_text, now=None):
+    """Decodes a raw METAR report into the dictionary shape of parse_metar_to_dict
+
+    Values are strings formatted like the ADDS decoded fields, and
+    flight_category is derived from the ceiling and visibility.
+
+    Arguments:
+        raw_text {string} -- The raw METAR, e.g. "CYYZ 022100Z 34008KT ..."
+        now {datetime} -- Reference UTC time to resolve the report's month
+
+    Returns:
+        dictionary -- Dictionary of values in the metar, or empty dict if unreadable
+    """
+    text = ' '.join(raw_text.split())
+    header = _HEADER.match(text)
+    if not header:
+        return {}
+
+    dictionary = {
+        'raw_text': text,
+        'station_id': header.group('station'),
+        'metar_type': header.group('type') or 'METAR',
+    }
+    if header.group('day'):
+        observed = _observation_time(
+            int(header.group('day')), int(header.group('hour')), int(header.group('minute')),
+            now or datetime.utcnow()
+        )
+        if observed is not None:
+            dictionary['observation_time'] = observed.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+    body = text[header.end():]
+    remarks_at = body.find('RMK')
+    if remarks_at != -1 and (remarks_at == 0 or body[remarks_at - 1] == ' '):
+        remarks = body[remarks_at + 3:].strip()
+        body = body[:remarks_at]
+        dictionary['remarks'] = remarks
+        slp = _SLP.search(remarks)
+        if slp:
+            tenths = int(slp.group(1))
+            base_mb = 1000.0 if tenths < 500 else 900.0
+            dictionary['sea_level_pressure_mb'] = str(base_mb + tenths / 10.0)
+
+    visibility = None
+    weather = []
+    sky_conditions = []
+    for match in _BODY.finditer(body):
+        kind = match.lastgroup
+        if kind == 'wind':
+            knots = _WIND_UNITS_TO_KT[match.group('wind_unit')]
+            wind_dir = match.group('wind_dir')
+            dictionary['wind_dir_degrees'] = wind_dir if wind_dir == 'VRB' else str(int(wind_dir))
+            dictionary['wind_speed_kt'] = str(int(round(int(match.group('wind_speed')) * knots)))
+            if match.group('wind_gust'):
+                dictionary['wind_gust_kt'] = str(int(round(int(match.group('wind_gust')) * knots)))
+        elif kind == 'vis_sm' and visibility is None:
+            visibility = _visibility_statute_mi(match)
+        elif kind == 'vis_m' and visibility is None:
+            visibility = round(int(match.group('vis_m')) / _METERS_PER_STATUTE_MILE, 2)
+        elif kind == 'cavok':
+            visibility = round(9999 / _METERS_PER_STATUTE_MILE, 2)
+        elif kind == 'wx':
+            weather.append(match.group('wx'))
+        elif kind == 'sky':
+            cover = match.group('sky_cover')
+            base = str(int(match.group('sky_base')) * 100)
+            if cover == 'VV':
+                cover = 'OVX'
+                dictionary['vert_vis_ft'] = base
+            sky_conditions.append({'cloud_base_ft_agl': base, 'sky_cover': cover})
+        elif kind == 'temp':
+            dictionary['temp_c'] = str(_celsius(match.group('temp_c')))
+            if match.group('dew_c'):
+                dictionary['dewpoint_c'] = str(_celsius(match.group('dew_c')))
+        elif kind == 'altim':
+            value = int(match.group('altim_value'))
+            if match.group('altim_unit') == 'A':
+                dictionary['altim_in_hg'] = str(value / 100.0)
+            else:
+                dictionary['altim_in_hg'] = str(round(value * _IN_HG_PER_HPA, 2))
+
+    if visibility is not None:
+        dictionary['visibility_statute_mi'] = str(visibility)
+    if weather:
+        dictionary['wx_string'] = ' '.join(weather)
+    dictionary['flight_category'] = flight_category(ceiling(sky_conditions), visibility)
+    dictionary['sky_conditions'] = sky_conditions
+    return dictionary
+
+
+def decode_lines(lines, now=None):
+    """Decodes a feed of raw METARs, one report per line
+
+    Arguments:
+        lines {iterable} -- Raw METAR strings (blank lines are skipped)
+        now {datetime} -- Reference UTC time to resolve each report's month
+
+    Yields:
+        dictionary -- Each decoded METAR
+    """
+    now = now or datetime.utcnow()
+    for line in lines:
+        if line.strip():
+            decoded = decode(line, now)
+            if decoded:
+                yield decoded
@@ -0,0 +1,173 @@
+""" Per-request latency spans and cache counters for the webhook pipeline
+
+Stages of a request are timed with span() and cache outcomes are counted
+with count(). Both are attributed to the request opened by request(),
+which logs them as structured fields when the request ends; process-wide
+counter totals are kept in `counters`.
+
+Set METRICS_HISTOGRAM_SIZE to keep that many recent samples per stage in
+process and report p50/p95/p99 latencies through `histogram`.
+"""
+# -*- coding: utf-8 -*-
+
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+
+
+HISTOGRAM_SIZE = int(os.environ.get('METRICS_HISTOGRAM_SIZE', 0))
+PERCENTILES = (50, 95, 99)
+
+logger = logging.getLogger('flytoday.metrics')
+
+
+class RequestMetrics:
+    """Timings (per stage), counters and descriptive tags of a single request
+
+    Arguments:
+        tags {dict} -- Fields describing the request (e.g. intent, station)
+    """
+
+    __slots__ = ('started', 'spans', 'counters', 'tags')
+
+    def __init__(self, tags=None):
+        self.started = time.perf_counter()
+        self.spans = {}
+        self.counters = {}
+        self.tags = dict(tags or {})
+
+    def fields(self):
+        """Returns the request's metrics as flat structured log fields
+
+        Returns:
+            dictionary -- e.g. {'total_ms': 12.3, 'fetch_ms': 10.1, 'metar_cache.miss': 1}
+        """
+        fields = dict(self.tags)
+        fields['total_ms'] = round((time.perf_counter() - self.started) * 1000, 3)
+        for name, elapsed in self.spans.items():
+            fields[name + '_ms'] = round(elapsed * 1000, 3)
+        fields.update(self.counters)
+        return fields
+
+
+class LatencyHistogram:
+    """Recent latency samples per stage, for percentile summaries
+
+    Arguments:
+        size {int} -- Number of recent samples kept per stage
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage, seconds):
+        """ Adds a latency sample for a stage """
+        with self._lock:
+            samples = self._samples.get(stage)
+            if samples is None:
+                samples = self._samples[stage] = deque(maxlen=self.size)
+            samples.append(seconds)
+
+    def percentiles(self, stage, percentiles=PERCENTILES):
+        """Returns latency percentiles of a stage (nearest-rank)
+
+        Arguments:
+            stage {string} -- The stage name
+            percentiles {tuple} -- Percentiles to compute
+
+        Returns:
+            dictionary -- Percentile to milliseconds (empty if no samples)
+        """
+        with self._lock:
+            samples = sorted(self._samples.get(stage, ()))
+        if not samples:
+            return {}
+        return {
+            percentile: round(samples[min(len(samples) - 1, len(samples) * percentile // 100)] * 1000, 3)
+            for percentile in percentiles
+        }
+
+    def summary(self):
+        """ Returns {stage: {'p50': ms, 'p95': ms, 'p99': ms, 'count': n}} for every stage """
+        with self._lock:
+            stages = {stage: len(samples) for stage, samples in self._samples.items()}
+        summary = {}
+        for stage, sample_count in stages.items():
+            summary[stage] = {'p{}'.format(p): ms for p, ms in self.percentiles(stage).items()}
+            summary[stage]['count'] = sample_count
+        return summary
+
+    def clear(self):
+        """ Forgets every sample """
+        with self._lock:
+            self._samples.clear()
+
+
+_current = contextvars.ContextVar('request_metrics', default=None)
+_counters_lock = threading.Lock()
+counters = Counter()
+histogram = LatencyHistogram(HISTOGRAM_SIZE) if HISTOGRAM_SIZE > 0 else None
+
+
+@contextmanager
+def span(name):
+    """Times a stage of the current request
+
+    Repeated spans of one stage within a request add up.
+
+    Arguments:
+        name {string} -- The stage name, e.g. 'fetch'
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        current = _current.get()
+        if current is not None:
+            current.spans[name] = current.spans.get(name, 0.0) + elapsed
+        if histogram is not None:
+            histogram.record(name, elapsed)
+
+
+def count(name, amount=1):
+    """Counts an event (e.g. 'metar_cache.hit') for the current request and the process
+
+    Arguments:
+        name {string} -- The counter name
+        amount {int} -- Amount to add
+    """
+    current = _current.get()
+    if current is not None:
+        current.counters[name] = current.counters.get(name, 0) + amount
+    with _counters_lock:
+        counters[name] += amount
+
+
+@contextmanager
+def request(**tags):
+    """Collects the spans and counters of one request, logging them when it ends
+
+    Arguments:
+        **tags -- Extra structured fields for the log record (more can be set on .tags)
+
+    Yields:
+        RequestMetrics -- The metrics being collected
+    """
+    metrics = RequestMetrics(tags)
+    token = _current.set(metrics)
+    try:
+        yield metrics
+    finally:
+        _current.reset(token)
+        if histogram is not None:
+            histogram.record('total', time.perf_counter() - metrics.started)
+        fields = metrics.fields()
+        logger.info(json.dumps(fields, sort_keys=True), extra={'metrics': fields})
@@ -0,0 +1,212 @@
+""" Compact, typed METAR observation records """
+# -*- coding: utf-8 -*-
+
+from collections.abc import Mapping
+
+
+FLOAT_FIELDS = (
+    'temp_c', 'dewpoint_c', 'visibility_statute_mi', 'altim_in_hg', 'elevation_m',
+    'latitude', 'longitude', 'sea_level_pressure_mb',
+)
+INT_FIELDS = ('wind_dir_degrees', 'wind_speed_kt', 'wind_gust_kt')
+TEXT_FIELDS = ('raw_text', 'station_id', 'observation_time', 'wx_string', 'flight_category', 'metar_type')
+FIELDS = TEXT_FIELDS + FLOAT_FIELDS + INT_FIELDS
+
+# Separators of the compact serialized form (see to_bytes)
+_FIELD_SEPARATOR = '\x1f'
+_EXTRA_SEPARATOR = '\x1e'
+_NO_SKY_CONDITIONS = '!'
+
+_CONVERTERS = dict(
+    [(field, float) for field in FLOAT_FIELDS] + [(field, int) for field in INT_FIELDS]
+)
+
+
+class Observation(Mapping):
+    """A decoded METAR, stored as typed fields instead of a dict of strings
+
+    Numeric fields are parsed once on construction. The object is also a
+    read-only mapping with exactly the keys and string values that
+    parse_metar_to_dict would have produced, so existing callers (and the
+    weather accessors) keep working. Derived values such as unit
+    conversions are memoized per observation through memoize().
+
+    Arguments:
+        metar_dict {dict} -- A dictionary shaped like parse_metar_to_dict's output
+    """
+
+    __slots__ = FIELDS + ('sky_conditions', '_extra', '_derived')
+
+    def __init__(self, metar_dict):
+        extra = None
+        for key, value in metar_dict.items():
+            if key == 'sky_conditions':
+                continue
+            converter = _CONVERTERS.get(key)
+            if converter is not None:
+                try:
+                    typed = converter(value)
+                except (TypeError, ValueError):
+                    typed = None
+                # Keep the original text when it would not round-trip exactly
+                if typed is not None and str(typed) == value:
+                    object.__setattr__(self, key, typed)
+                    continue
+            elif key in TEXT_FIELDS:
+                object.__setattr__(self, key, value)
+                continue
+            if extra is None:
+                extra = {}
+            extra[key] = value
+        object.__setattr__(self, '_extra', extra)
+        object.__setattr__(self, '_derived', None)
+        sky_conditions = metar_dict.get('sky_conditions')
+        if sky_conditions is not None:
+            sky_conditions = tuple(
+                (cond['sky_cover'], int(cond['cloud_base_ft_agl'])) for cond in sky_conditions
+            )
+            object.__setattr__(self, 'sky_conditions', sky_conditions)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Observation is read-only')
+
+    def __getitem__(self, key):
+        if key in _CONVERTERS or key in TEXT_FIELDS:
+            try:
+                value = object.__getattribute__(self, key)
+            except AttributeError:
+                pass
+            else:
+                return value if key in TEXT_FIELDS else str(value)
+        elif key == 'sky_conditions':
+            try:
+                return [
+                    {'cloud_base_ft_agl': str(base), 'sky_cover': cover}
+                    for cover, base in self.sky_conditions
+                ]
+            except AttributeError:
+                pass
+        if self._extra is not None and key in self._extra:
+            return self._extra[key]
+        raise KeyError(key)
+
+    def __iter__(self):
+        for field in FIELDS:
+            if hasattr(self, field):
+                yield field
+        if self._extra is not None:
+            for key in self._extra:
+                yield key
+        if hasattr(self, 'sky_conditions'):
+            yield 'sky_conditions'
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return 'Observation({!r})'.format(self.to_dict())
+
+    def get_value(self, field, default=None):
+        """Returns the typed value of a field
+
+        Arguments:
+            field {string} -- Field name, e.g. 'temp_c'
+            default {object} -- Returned when the field is missing
+
+        Returns:
+            object -- float/int for numeric fields, string otherwise
+        """
+        try:
+            return object.__getattribute__(self, field)
+        except AttributeError:
+            if self._extra is not None:
+                return self._extra.get(field, default)
+            return default
+
+    def memoize(self, name, compute):
+        """Returns a derived value, computing it on first use only
+
+        Arguments:
+            name {string} -- Name of the derived value
+            compute {callable} -- Called with this observation to compute it
+
+        Returns:
+            object -- The (possibly cached) derived value
+        """
+        derived = self._derived
+        if derived is None:
+            derived = {}
+            object.__setattr__(self, '_derived', derived)
+        elif name in derived:
+            return derived[name]
+        value = derived[name] = compute(self)
+        return value
+
+    def to_dict(self):
+        """ Returns the observation as a plain dictionary of strings """
+        return {key: self[key] for key in self}
+
+    def to_bytes(self):
+        """Serializes the observation to a compact byte string
+
+        The fields are written positionally (in FIELDS order), followed by
+        the sky conditions and any extra fields.
+
+        Returns:
+            bytes -- The serialized observation (see from_bytes)
+        """
+        values = [self[field] if hasattr(self, field) else '' for field in FIELDS]
+        if hasattr(self, 'sky_conditions'):
+            values.append(','.join('{}:{}'.format(cover, base) for cover, base in self.sky_conditions))
+        else:
+            values.append(_NO_SKY_CONDITIONS)
+        extra = self._extra or {}
+        values.append(_EXTRA_SEPARATOR.join('{}={}'.format(key, value) for key, value in extra.items()))
+        return _FIELD_SEPARATOR.join(values).encode('utf-8')
+
+    @classmethod
+    def from_bytes(cls, data):
+        """Deserializes an observation written by to_bytes
+
+        Arguments:
+            data {bytes} -- The serialized observation
+
+        Returns:
+            Observation -- The observation
+        """
+        values = bytes(data).decode('utf-8').split(_FIELD_SEPARATOR)
+        metar_dict = {field: value for field, value in zip(FIELDS, values) if value}
+        sky_conditions = values[len(FIELDS)]
+        if sky_conditions != _NO_SKY_CONDITIONS:
+            metar_dict['sky_conditions'] = [
+                {'sky_cover': cover, 'cloud_base_ft_agl': base}
+                for cover, base in (layer.split(':') for layer in sky_conditions.split(',') if layer)
+            ]
+        extra = values[len(FIELDS) + 1]
+        if extra:
+            for pair in extra.split(_EXTRA_SEPARATOR):
+                key, value = pair.split('=', 1)
+                metar_dict[key] = value
+        return cls(metar_dict)
+
+
+class StaleObservation(Observation):
+    """The last known observation of a station, served because a current one could not be fetched
+
+    Renders exactly like the Observation it copies; callers tell the user
+    how old it is.
+    """
+
+    __slots__ = ()
+
+    @classmethod
+    def copy_of(cls, observation):
+        """Copies an observation
+
+        Arguments:
+            observation {Observation} -- The observation to copy
+
+        Returns:
+            StaleObservation -- The copy
+        """
+        return cls.from_bytes(observation.to_bytes())
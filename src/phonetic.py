@@ -0,0 +1,83 @@
+""" Reads station IDs and numbers aloud in the ICAO phonetic alphabet
+
+Produces exactly what phonetic_alphabet.read does, from a precomputed
+per-character table, and memoizes whole tokens (station IDs, altimeter
+settings, ...) since the same few hundred recur across requests.
+"""
+# -*- coding: utf-8 -*-
+
+from functools import lru_cache
+
+
+PHONETIC_CACHE_SIZE = 4096
+
+_ALPHABET = (
+    'ALFA', 'BRAVO', 'CHARLIE', 'DELTA', 'ECHO', 'FOXTROT', 'GOLF', 'HOTEL', 'INDIA', 'JULIETT', 'KILO', 'LIMA',
+    'MIKE', 'NOVEMBER', 'OSCAR', 'PAPA', 'QUEBEC', 'ROMEO', 'SIERRA', 'TANGO', 'UNIFORM', 'VICTOR', 'WHISKEY',
+    'X-RAY', 'YANKEE', 'ZULU',
+)
+_DIGITS = ('ZERO', 'ONE', 'TWO', 'THREE', 'FOUR', 'FIVE', 'SIX', 'SEVEN', 'EIGHT', 'NINER')
+# Kept as they are; spaces only separate words
+_PUNCTUATION = '.,;:?- '
+
+
+def _build_table():
+    """ Maps every readable character to what it reads as (words padded with spaces) """
+    table = {character: character for character in _PUNCTUATION}
+    for index, word in enumerate(_ALPHABET):
+        letter = chr(ord('A') + index)
+        table[letter] = table[letter.lower()] = ' ' + word + ' '
+    for digit, word in enumerate(_DIGITS):
+        table[str(digit)] = ' ' + word + ' '
+    return table
+
+
+_TABLE = _build_table()
+
+
+class UnsupportedTextError(ValueError):
+    """ Raised for text with characters that cannot be read phonetically """
+
+
+@lru_cache(maxsize=PHONETIC_CACHE_SIZE)
+def _read(text):
+    """ Reads a string (memoized) """
+    try:
+        spelled = ''.join([_TABLE[character] for character in text])
+    except KeyError:
+        raise UnsupportedTextError(text)
+    return ' '.join(spelled.split())
+
+
+def read(text):
+    """Reads text back in the phonetic alphabet, as phonetic_alphabet.read does
+
+    Arguments:
+        text {object} -- The text (or anything, read as str())
+
+    Returns:
+        string -- e.g. 'CHARLIE YANKEE YANKEE ZULU' for 'CYYZ'
+    """
+    return _read(str(text))
+
+
+@lru_cache(maxsize=PHONETIC_CACHE_SIZE)
+def _read_title(text):
+    """ Reads a string in title case (memoized) """
+    return _read(text).title()
+
+
+def read_title(text):
+    """ Reads text back in the phonetic alphabet, in title case ('Charlie Yankee Yankee Zulu') """
+    return _read_title(str(text))
+
+
+@lru_cache(maxsize=PHONETIC_CACHE_SIZE)
+def _read_number(text):
+    """ Reads a number in title case, saying 'point' for '.' (memoized) """
+    return _read(text).replace('.', 'point').title()
+
+
+def read_number(text):
+    """ Reads a number back in the phonetic alphabet, in title case ('Two Niner Point Niner Two') """
+    return _read_number(str(text))
@@ -0,0 +1,183 @@
+""" Keeps the METARs of the most requested airports fresh in the background
+
+It runs as a standalone worker with `python prewarm.py ICAO [ICAO ...]`.
+That worker cannot see the webhook's counts, so the given stations are
+pinned: they are refreshed on every run and never decay away.
+
+The webhook counts its requests per station. On a long-lived server (not
+on GCF, where every instance would run its own throttled scheduler and
+refresh), PREWARM_IN_PROCESS=1 also runs the pre-warmer on a thread of the
+webhook's process (see start_in_process), so the stations it is asked
+about are the ones kept warm.
+"""
+# -*- coding: utf-8 -*-
+
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+import helpers
+
+
+# Routine METARs go out just before the hour; refresh a little after that
+REFRESH_MINUTE = int(os.environ.get('PREWARM_REFRESH_MINUTE', 55))
+TOP_STATIONS = int(os.environ.get('PREWARM_TOP_STATIONS', 300))
+# Counts are multiplied by this after every refresh, so popularity follows recent demand
+POPULARITY_DECAY = 0.5
+# Counts below this are forgotten; pinned stations never drop under PINNED_COUNT
+MIN_COUNT = 0.01
+PINNED_COUNT = 1.0
+PREWARM_IN_PROCESS = os.environ.get('PREWARM_IN_PROCESS', '0') == '1'
+
+
+class StationPopularity:
+    """ Thread-safe, decaying request counts per ICAO code """
+
+    def __init__(self, decay=POPULARITY_DECAY):
+        self.decay = decay
+        self._counts = Counter()
+        self._pinned = set()
+        self._lock = threading.Lock()
+
+    def record(self, icao_code, weight=1.0):
+        """ Counts a request for a station """
+        with self._lock:
+            self._counts[icao_code.upper()] += weight
+
+    def pin(self, icao_code):
+        """ Keeps a station among the counted ones for good, however rarely it is requested """
+        icao_code = icao_code.upper()
+        with self._lock:
+            self._pinned.add(icao_code)
+            self._counts[icao_code] = max(self._counts[icao_code], PINNED_COUNT)
+
+    def top(self, count):
+        """Returns the most requested stations
+
+        Arguments:
+            count {int} -- Maximum number of stations
+
+        Returns:
+            list -- ICAO codes, most requested first
+        """
+        with self._lock:
+            return [icao_code for icao_code, _ in self._counts.most_common(count)]
+
+    def age(self):
+        """ Decays every count, forgetting stations that are no longer asked about """
+        with self._lock:
+            for icao_code in list(self._counts):
+                self._counts[icao_code] *= self.decay
+                if icao_code in self._pinned:
+                    self._counts[icao_code] = max(self._counts[icao_code], PINNED_COUNT)
+                elif self._counts[icao_code] < MIN_COUNT:
+                    del self._counts[icao_code]
+
+
+station_popularity = StationPopularity()
+
+
+def next_refresh(now, minute=REFRESH_MINUTE):
+    """Returns the next refresh time after now
+
+    Arguments:
+        now {datetime} -- The current UTC time
+        minute {int} -- Minute past each hour to refresh at
+
+    Returns:
+        datetime -- The next time at the given minute past the hour
+    """
+    candidate = now.replace(minute=minute, second=0, microsecond=0)
+    if candidate <= now:
+        candidate += timedelta(hours=1)
+    return candidate
+
+
+class Prewarmer:
+    """Refreshes the top stations in bulk shortly after each METAR issuance
+
+    Arguments:
+        popularity {StationPopularity} -- Request counts to pick stations from
+        top_stations {int} -- Number of stations to keep warm
+        minute {int} -- Minute past each hour to refresh at
+        clock {callable} -- Returns the current UTC datetime (for testing)
+    """
+
+    def __init__(self, popularity=station_popularity, top_stations=TOP_STATIONS,
+                 minute=REFRESH_MINUTE, clock=datetime.utcnow):
+        self.popularity = popularity
+        self.top_stations = top_stations
+        self.minute = minute
+        self.clock = clock
+        self._stop = threading.Event()
+        self._thread = None
+
+    def refresh(self):
+        """Fetches fresh METARs for the most requested stations
+
+        Returns:
+            dictionary -- ICAO code to Observation for every refreshed station
+        """
+        stations = self.popularity.top(self.top_stations)
+        if not stations:
+            return {}
+        started = time.monotonic()
+        metars = helpers.get_metars(stations, refresh=True)
+        self.popularity.age()
+        logging.info('Pre-warmed %d/%d stations in %.2fs', len(metars), len(stations), time.monotonic() - started)
+        return metars
+
+    def run(self):
+        """ Refreshes on schedule until stop() is called """
+        while not self._stop.is_set():
+            now = self.clock()
+            delay = (next_refresh(now, self.minute) - now).total_seconds()
+            if self._stop.wait(delay):
+                return
+            try:
+                self.refresh()
+            except Exception as exc:
+                logging.error('Pre-warm refresh failed: %s', exc)
+
+    def start(self):
+        """ Runs the pre-warmer on a daemon thread in this process """
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run, name='prewarmer', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """ Stops the schedule (and waits for the background thread, if any) """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+_prewarmer = None
+_prewarmer_lock = threading.Lock()
+
+
+def start_in_process():
+    """Starts the pre-warmer on a daemon thread of this process, once
+
+    Returns:
+        Prewarmer -- The running pre-warmer
+    """
+    global _prewarmer
+    with _prewarmer_lock:
+        if _prewarmer is None:
+            _prewarmer = Prewarmer()
+            _prewarmer.start()
+    return _prewarmer
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    for seed in sys.argv[1:]:
+        station_popularity.pin(seed)
+    prewarmer = Prewarmer()
+    prewarmer.refresh()
+    prewarmer.run()
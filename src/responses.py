@@ -2,47 +2,197 @@
 # -*- coding: utf-8 -*-
 
 import logging
+import time
+from functools import wraps
+import metrics
+import phonetic
 import weather
-from helpers import get_standard_error_message, get_response
-import phonetic_alphabet as alpha
+from helpers import get_standard_error_message, get_response, get_responses_generation
+from cache import TTLCache
+from templates import OutputBuffer
+from observation import Observation, StaleObservation
 
 
+# Stand-in for the relative time ("5 minutes ago") inside cached renders,
+# substituted on every call so cached entries never go stale
+RELATIVE_TIME_SLOT = '\x00relative_time\x00'
+RENDER_CACHE_TTL = 2 * 60 * 60
+RENDER_CACHE_SIZE = 4096
+# Window of the trend intents, in hours
+TREND_HOURS = 3
+# VFR airports named in an area sweep answer; the rest are only counted
+SWEEP_NAMED = 5
+
+render_cache = TTLCache(ttl=RENDER_CACHE_TTL, max_entries=RENDER_CACHE_SIZE)
+
+
+def _fill_relative_time(rendered, metar_dict):
+    """ Substitutes the current relative observation time into a rendered pair """
+    speech, text = rendered
+    if RELATIVE_TIME_SLOT not in speech and RELATIVE_TIME_SLOT not in text:
+        return speech, text
+    obs_time, relative_time = weather.get_time(metar_dict)
+    return speech.replace(RELATIVE_TIME_SLOT, relative_time), text.replace(RELATIVE_TIME_SLOT, relative_time)
+
+
+def _needs_fields(*fields):
+    """Declares the METAR fields a renderer reads, so a fetch can skip decoding the rest
+
+    Renderers without a declaration get every field.
+    """
+    def decorator(render):
+        render.fields = frozenset(fields)
+        return render
+    return decorator
+
+
+def _needs_history(hours):
+    """Declares that a renderer answers from the last `hours` hours of observations
+
+    Such renderers are given a list of observations, oldest first, instead
+    of a single METAR.
+    """
+    def decorator(render):
+        render.history_hours = hours
+        return render
+    return decorator
+
+
+def _needs_forecast(render):
+    """Declares that a renderer answers from the station's TAF
+
+    Such renderers are given the Forecast, plus the time asked about and
+    the current METAR as keyword arguments.
+    """
+    render.forecast = True
+    return render
+
+
+def _needs_location(render):
+    """Declares that a renderer answers from the stations nearest the user
+
+    Such renderers are given (distance in nautical miles, Station,
+    Observation) tuples, closest first, instead of a single METAR.
+    """
+    render.location = True
+    return render
+
+
+def _needs_route(render):
+    """Declares that a renderer briefs the airports of a route
+
+    Such renderers are given (role, ICAO code, airport name, Observation or
+    None) tuples in route order, instead of a single METAR.
+    """
+    render.route = True
+    return render
+
+
+def _needs_area(render):
+    """Declares that a renderer answers from every station around the airport
+
+    Such renderers are given (distance in nautical miles, Station,
+    Observation) tuples, closest first, instead of a single METAR, and the
+    radius swept (in nautical miles) as the `radius` keyword argument.
+    """
+    render.area = True
+    return render
+
+
+def _cached_render(render):
+    """Memoizes a response renderer per (station, observation time, intent, airport)
+
+    Only Observation records are cached, since they cannot change after
+    being keyed; plain dictionaries are always rendered.
+    """
+    @wraps(render)
+    def wrapper(metar_dict, airport):
+        if not isinstance(metar_dict, Observation):
+            return _fill_relative_time(render(metar_dict, airport), metar_dict)
+        key = (
+            metar_dict.get('station_id'), metar_dict.get('observation_time'),
+            render.__name__, airport, get_responses_generation()
+        )
+        rendered = render_cache.get(key)
+        if rendered is None:
+            metrics.count('render_cache.miss')
+            rendered = render(metar_dict, airport)
+            render_cache.set(key, rendered)
+        else:
+            metrics.count('render_cache.hit')
+        return _fill_relative_time(rendered, metar_dict)
+    return wrapper
+
+
+def add_stale_disclaimer(rendered, metar_dict):
+    """Appends the age of a last known report to a rendered response
+
+    Arguments:
+        rendered {tuple} -- The speech and text responses
+        metar_dict {dict} -- The report they were rendered from
+
+    Returns:
+        tuple -- The speech and text responses
+    """
+    obs_time, relative_time = weather.get_time(metar_dict)
+    if relative_time is None:
+        return rendered
+    values = {'obs_time': obs_time, 'relative_time': relative_time}
+    speech, text = get_response('Stale')
+    return rendered[0] + ' ' + speech.render(values), rendered[1] + '\n' + text.render(values)
+
+
+@_needs_fields('wind_speed_kt', 'wind_dir_degrees')
+@_cached_render
 def get_wind_information(metar_dict, airport):
     """ Returns the current wind information """
     wind_speed, wind_dir = weather.get_wind_information(metar_dict)
+    values = {'airport': airport, 'wind_speed': wind_speed, 'wind_dir': wind_dir}
     speech, text = get_response('Wind')
-    return speech.format(**locals()), text.format(**locals())
+    return speech.render(values), text.render(values)
 
 
+@_needs_fields('visibility_statute_mi')
+@_cached_render
 def get_visibility(metar_dict, airport):
     """ Returns the current visibility """
     visibility, visibility_km = weather.get_visibility(metar_dict)
+    values = {'airport': airport, 'visibility': visibility, 'visibility_km': visibility_km}
     speech, text = get_response('Visibility')
-    return speech.format(**locals()), text.format(**locals())
+    return speech.render(values), text.render(values)
 
 
+@_needs_fields('altim_in_hg')
+@_cached_render
 def get_altimeter(metar_dict, airport):
     """ Returns the current altimeter reading """
-    alt = weather.get_altimeter(metar_dict)
+    values = {'airport': airport, 'alt': weather.get_altimeter(metar_dict)}
     speech, text = get_response('Altimeter')
-    return speech.format(**locals()), text.format(**locals())
+    return speech.render(values), text.render(values)
 
 
+@_needs_fields('temp_c', 'dewpoint_c')
+@_cached_render
 def get_temperature(metar_dict, airport):
     """ Returns the current temperature in celcius and fahrenheit, and dewpoint """
     temp_c, temp_f = weather.get_temperature(metar_dict)
     dew_c, dew_f = weather.get_dewpoint(metar_dict)
+    values = {'airport': airport, 'temp_c': temp_c, 'temp_f': temp_f, 'dew_c': dew_c, 'dew_f': dew_f}
     speech, text = get_response('Temperature')
-    return speech.format(**locals()), text.format(**locals())
+    return speech.render(values), text.render(values)
 
 
+@_needs_fields('elevation_m')
+@_cached_render
 def get_elevation(metar_dict, airport):
     """ Returns the elevation of the aerodrome """
     elevation_m, elevation_f = weather.get_elevation(metar_dict)
+    values = {'airport': airport, 'elevation_m': elevation_m, 'elevation_f': elevation_f}
     speech, text = get_response('Elevation')
-    return speech.format(**locals()), text.format(**locals())
+    return speech.render(values), text.render(values)
 
 
+@_needs_fields('raw_text')
 def get_metar_raw(metar_dict, airport):
     """ Returns the raw METAR data """
     raw = weather.get_metar_raw(metar_dict)
@@ -54,11 +204,9 @@ def replace_point(input_text):
     return input_text.replace('.', 'point')
 
 
+@_cached_render
 def get_metar_parsed(metar_dict, airport):
     """ Returns the human-readable version of the METAR """
-    all_speech = []
-    all_text = []
-
     # Get variables (or None)
     station_id = weather.get_station_id(metar_dict)
     flight_category = weather.get_flight_category(metar_dict)
@@ -68,68 +216,233 @@ def get_metar_parsed(metar_dict, airport):
     temp_c, temp_f = weather.get_temperature(metar_dict)
     dew_c, dew_f = weather.get_dewpoint(metar_dict)
     obs_time, relative_time = weather.get_time(metar_dict)
+    if relative_time:
+        relative_time = RELATIVE_TIME_SLOT
     sky_conditions = weather.get_sky_conditions(metar_dict)
 
-    # Apply Phonetic Alphabet
-    station_id_read = alpha.read(station_id).title()
-    obs_time_read = alpha.read(obs_time).title()
-    wind_speed_read = alpha.read(wind_speed).title()
-    wind_dir_read = alpha.read(wind_dir).title()
-    visibility_read = replace_point(alpha.read(visibility)).title()
-    altimeter_read = replace_point(alpha.read(altimeter)).title()
-    temp_c_read = replace_point(alpha.read(temp_c)).title()
-    dew_c_read = replace_point(alpha.read(dew_c)).title()
+    # Bound once, with the phonetic readings, for every section's templates
+    values = {
+        'airport': airport, 'station_id': station_id, 'flight_category': flight_category,
+        'wind_speed': wind_speed, 'wind_dir': wind_dir, 'visibility': visibility, 'visibility_km': visibility_km,
+        'altimeter': altimeter, 'temp_c': temp_c, 'temp_f': temp_f, 'dew_c': dew_c, 'dew_f': dew_f,
+        'obs_time': obs_time, 'relative_time': relative_time,
+        'station_id_read': phonetic.read_title(station_id),
+        'obs_time_read': phonetic.read_title(obs_time),
+        'wind_speed_read': phonetic.read_title(wind_speed),
+        'wind_dir_read': phonetic.read_title(wind_dir),
+        'visibility_read': phonetic.read_number(visibility),
+        'altimeter_read': phonetic.read_number(altimeter),
+        'temp_c_read': phonetic.read_number(temp_c),
+        'dew_c_read': phonetic.read_number(dew_c),
+    }
+    all_speech = OutputBuffer()
+    all_text = OutputBuffer()
 
     if station_id:
-        all_speech.append(station_id_read + ' - ' + airport.title() + ' Weather.')
-        all_text.append(station_id + ' - ' + airport.title() + ' Weather.')
-    if obs_time and relative_time:
-        speech, text = get_response('Metar', 'both', 'Time')
-        all_speech.append(speech.format(**locals()))
-        all_text.append(text.format(**locals()))
-    if wind_speed and wind_dir:
-        speech, text = get_response('Metar', 'both', 'Wind')
-        all_speech.append(speech.format(**locals()))
-        all_text.append(text.format(**locals()))
-    if flight_category:
-        speech, text = get_response('Metar', 'both', 'FlightCategory')
-        all_speech.append(speech.format(**locals()))
-        all_text.append(text.format(**locals()))
-    if visibility:
-        speech, text = get_response('Metar', 'both', 'Visibility')
-        all_speech.append(speech.format(**locals()))
-        all_text.append(text.format(**locals()))
-    if altimeter:
-        speech, text = get_response('Metar', 'both', 'Altimeter')
-        all_speech.append(speech.format(**locals()))
-        all_text.append(text.format(**locals()))
-    if temp_c:
-        speech, text = get_response('Metar', 'both', 'Temperature')
-        all_speech.append(speech.format(**locals()))
-        all_text.append(text.format(**locals()))
-    if dew_c:
-        speech, text = get_response('Metar', 'both', 'Dewpoint')
-        all_speech.append(speech.format(**locals()))
-        all_text.append(text.format(**locals()))
+        all_speech.section()
+        all_speech.write(values['station_id_read'] + ' - ' + airport.title() + ' Weather.')
+        all_text.section()
+        all_text.write(station_id + ' - ' + airport.title() + ' Weather.')
+    sections = (
+        ('Time', obs_time and relative_time),
+        ('Wind', wind_speed and wind_dir),
+        ('FlightCategory', flight_category),
+        ('Visibility', visibility),
+        ('Altimeter', altimeter),
+        ('Temperature', temp_c),
+        ('Dewpoint', dew_c),
+    )
+    for key, present in sections:
+        if present:
+            speech, text = get_response('Metar', 'both', key)
+            all_speech.section()
+            all_speech.render(speech, values)
+            all_text.section()
+            all_text.render(text, values)
     if sky_conditions:
-        sc_speech = "Sky Conditions are as follows. "
-        sc_text = "Sky Conditions: "
         speech, text = get_response('Metar', 'both', 'SkyCondition')
+        all_speech.section()
+        all_speech.write("Sky Conditions are as follows. ")
+        all_text.section()
+        all_text.write("Sky Conditions: ")
         for condition, agl in sky_conditions:
-            agl_read = alpha.read(agl).title()
-            sc_speech += speech.format(**locals()) + ' '
-            sc_text += text.format(**locals()) + ' '
-        all_speech.append(sc_speech)
-        all_text.append(sc_text)
-    return ' '.join(all_speech), ' '.join(all_text)
+            values['condition'] = condition
+            values['agl'] = agl
+            values['agl_read'] = phonetic.read_title(agl)
+            all_speech.render(speech, values)
+            all_speech.write(' ')
+            all_text.render(text, values)
+            all_text.write(' ')
+    return all_speech.getvalue(), all_text.getvalue()
 
 
+@_needs_fields('flight_category')
+@_cached_render
 def get_flight_category(metar_dict, airport):
     """Gets the flight category from the metar dictionary"""
     flight_category = weather.get_flight_category(metar_dict)
+    values = {'airport': airport, 'flight_category': flight_category}
     try:
         speech, text = get_response('FlightConditions', 'both', flight_category)
-        return speech.format(**locals()), text.format(**locals())
+        return speech.render(values), text.render(values)
     except Exception:
-        default = "It's currently {flight_category} at {airport}.".format(**locals())
+        default = "It's currently {} at {}.".format(flight_category, airport)
         return default, default
+
+
+def _ceiling_phrase(ceiling_ft):
+    """ Describes a ceiling for speech and text """
+    return 'unlimited' if ceiling_ft is None else '{} feet'.format(ceiling_ft)
+
+
+@_needs_history(TREND_HOURS)
+def get_ceiling_trend(observations, airport):
+    """ Returns how the ceiling has changed over the trend window """
+    values = {'airport': airport, 'hours': TREND_HOURS}
+    first, last, trend = weather.get_ceiling_trend(observations)
+    if trend is None:
+        speech, text = get_response('Trend')
+        return speech.render(values), text.render(values)
+    values['first_ceiling'] = _ceiling_phrase(first)
+    values['last_ceiling'] = _ceiling_phrase(last)
+    speech, text = get_response('CeilingTrend', 'both', trend)
+    return speech.render(values), text.render(values)
+
+
+@_needs_history(TREND_HOURS)
+def get_wind_trend(observations, airport):
+    """ Returns how the wind has changed over the trend window """
+    values = {'airport': airport, 'hours': TREND_HOURS}
+    first, last, trend = weather.get_wind_trend(observations)
+    if trend is None:
+        speech, text = get_response('Trend')
+        return speech.render(values), text.render(values)
+    (values['first_speed'], values['first_dir']), (values['last_speed'], values['last_dir']) = first, last
+    speech, text = get_response('WindTrend', 'both', trend)
+    return speech.render(values), text.render(values)
+
+
+@_needs_forecast
+def get_forecast_category(forecast, airport, when=None, metar_dict=None):
+    """ Returns the forecast flight category at the requested time (default: now) """
+    when = time.time() if when is None else when
+    values = {'airport': airport, 'when_time': time.strftime('%H%M', time.gmtime(when))}
+    conditions = forecast.at(when)
+    if conditions is None:
+        speech, text = get_response('Forecast', 'both', 'Unavailable')
+        return speech.render(values), text.render(values)
+    flight_category = values['flight_category'] = conditions['flight_category']
+    all_speech = OutputBuffer()
+    all_text = OutputBuffer()
+    sections = ['standard']
+    temporary = [
+        temporary['flight_category'] for temporary in forecast.temporary_at(when)
+        if temporary['flight_category'] != flight_category
+    ]
+    if temporary:
+        values['temporary_category'] = temporary[0]
+        sections.append('Temporary')
+    current_category = weather.get_flight_category(metar_dict) if metar_dict else None
+    if isinstance(metar_dict, StaleObservation):
+        # Not "right now": a last known report, told with its age
+        values['relative_time'] = weather.get_time(metar_dict)[1]
+        if current_category and values['relative_time']:
+            values['current_category'] = current_category
+            sections.append('LastReported')
+    elif current_category and current_category != flight_category:
+        values['current_category'] = current_category
+        sections.append('Current')
+    for key in sections:
+        speech, text = get_response('Forecast', 'both', key)
+        all_speech.section()
+        all_speech.render(speech, values)
+        all_text.section()
+        all_text.render(text, values)
+    return all_speech.getvalue(), all_text.getvalue()
+
+
+def _render_nearest(key, report, **values):
+    """ Renders a Nearest response for a (distance, Station, Observation) report """
+    distance, station, observation = report
+    values['name'] = station.name
+    values['station_id'] = station.icao
+    values['distance'] = int(round(distance))
+    values['flight_category'] = weather.get_flight_category(observation)
+    speech, text = get_response('Nearest', 'both', key)
+    return speech.render(values), text.render(values)
+
+
+@_needs_location
+def get_nearest_weather(reports, airport):
+    """ Returns the flight category at the closest reporting airport """
+    return _render_nearest('standard', reports[0])
+
+
+@_needs_location
+def get_nearest_vfr(reports, airport):
+    """ Returns the closest airport reporting VFR """
+    for report in reports:
+        if weather.get_flight_category(report[2]) == 'VFR':
+            return _render_nearest('VFR', report)
+    return _render_nearest('NoVFR', reports[0], count=len(reports))
+
+
+@_needs_area
+def get_vfr_nearby(reports, airport, radius):
+    """ Returns the airports reporting VFR around an airport """
+    categories = weather.get_flight_categories([observation for _, _, observation in reports])
+    vfr = [station for (_, station, _), category in zip(reports, categories) if category == 'VFR']
+    values = {
+        'airport': airport, 'total': len(reports), 'count': len(vfr), 'radius': int(round(radius)),
+        'names': ', '.join(station.name for station in vfr[:SWEEP_NAMED]),
+    }
+    if not vfr:
+        key = 'NoVFR'
+    elif len(vfr) > SWEEP_NAMED:
+        key = 'ManyVFR'
+    else:
+        key = 'VFR'
+    speech, text = get_response('Sweep', 'both', key)
+    return speech.render(values), text.render(values)
+
+
+@_needs_route
+def get_route_briefing(briefing, airport):
+    """ Returns the flight category, wind and ceiling at every airport of a route that reported in time """
+    all_speech = OutputBuffer()
+    all_text = OutputBuffer('\n')
+    missing = []
+    values = {'airport': airport}
+    point = get_response('Route', 'both', 'Point')
+    point_no_wind = get_response('Route', 'both', 'PointNoWind')
+    stale_speech, stale_text = get_response('Route', 'both', 'Stale')
+    for role, station_id, name, observation in briefing:
+        if observation is None:
+            missing.append(name)
+            continue
+        values['role'] = role
+        values['station_id'] = station_id
+        values['name'] = name
+        values['flight_category'] = weather.get_flight_category(observation)
+        values['wind_speed'], values['wind_dir'] = weather.get_wind_information(observation)
+        values['ceiling'] = _ceiling_phrase(weather.get_ceiling(observation))
+        speech, text = point if values['wind_speed'] is not None else point_no_wind
+        all_speech.section()
+        all_speech.render(speech, values)
+        all_text.section()
+        all_text.render(text, values)
+        values['relative_time'] = None
+        if isinstance(observation, StaleObservation):
+            values['relative_time'] = weather.get_time(observation)[1]
+        if values['relative_time']:
+            all_speech.section()
+            all_speech.render(stale_speech, values)
+            all_text.render(stale_text, values)
+    if missing:
+        values['missing'] = ', '.join(missing)
+        speech, text = get_response('Route', 'both', 'Missing')
+        all_speech.section()
+        all_speech.render(speech, values)
+        all_text.section()
+        all_text.render(text, values)
+    return all_speech.getvalue(), all_text.getvalue()
@@ -0,0 +1,83 @@
+""" Weather along a route, fetched in bulk under a latency budget """
+# -*- coding: utf-8 -*-
+
+import contextvars
+import logging
+import os
+from concurrent.futures import wait
+import helpers
+import metrics
+import upstream
+from observation import StaleObservation
+
+
+# Dialogflow gives a webhook 5 seconds; leave room for everything else
+ROUTE_BUDGET = float(os.environ.get('ROUTE_BUDGET', 3.5))
+# Airports in one briefing: a route is fetched in one bulk request, but is also read out in full
+MAX_ROUTE_POINTS = int(os.environ.get('MAX_ROUTE_POINTS', 10))
+
+
+def get_route_metars(icao_codes, budget=None):
+    """Gets the METARs of many stations at once, giving up on the upstream if it is too slow
+
+    Stations with a fresh cached report are answered from the cache; the
+    others are fetched together (helpers.get_metars: one bulk request per
+    URL-sized chunk) on the upstream executor, so the wait can be bounded.
+    A fetch still running when the budget runs out is left to finish in the
+    background and fill the cache, but is not waited for. A station with
+    only a stale cached report (a StaleObservation) keeps it if no current
+    one comes back.
+
+    Arguments:
+        icao_codes {iterable} -- ICAO codes to fetch
+        budget {float} -- Seconds to wait for the upstream (ROUTE_BUDGET if None)
+
+    Returns:
+        dictionary -- ICAO code to Observation (or StaleObservation), for the stations that returned a report in time
+    """
+    budget = ROUTE_BUDGET if budget is None else budget
+    metars = {}
+    stale = {}
+    missing = []
+    for icao_code in icao_codes:
+        icao_code = icao_code.upper()
+        if icao_code in metars or icao_code in missing:
+            continue
+        cached = helpers.get_cached_metar(icao_code)
+        if isinstance(cached, StaleObservation):
+            stale[icao_code] = cached
+            missing.append(icao_code)
+        elif cached:
+            metars[icao_code] = cached
+        else:
+            missing.append(icao_code)
+    if not missing:
+        return metars
+    context = contextvars.copy_context()
+    future = upstream.executor.submit(context.run, helpers.get_metars, missing)
+    with metrics.span('route_fetch'):
+        done, not_done = wait([future], timeout=budget)
+    if not_done:
+        metrics.count('route.timed_out', len(missing))
+    elif future.exception() is not None:
+        logging.error('Route METAR fetch failed: %s', future.exception())
+        metrics.count('route.error')
+    else:
+        metars.update(future.result())
+    for icao_code, observation in stale.items():
+        metars.setdefault(icao_code, observation)
+    return metars
+
+
+def get_route_briefing(route, budget=None):
+    """Gets the weather at every airport of a route
+
+    Arguments:
+        route {list} -- (role, ICAO code, airport name) tuples, as from helpers.get_route_from_dialogflow
+        budget {float} -- Seconds to wait for the upstream (ROUTE_BUDGET if None)
+
+    Returns:
+        list -- (role, ICAO code, airport name, Observation or None) in route order
+    """
+    metars = get_route_metars([icao_code for _, icao_code, _ in route], budget)
+    return [(role, icao_code, name, metars.get(icao_code.upper())) for role, icao_code, name in route]
@@ -0,0 +1,365 @@
+""" Shared second-level METAR cache, common to every instance of the webhook
+
+The in-process cache (helpers.metar_cache) is lost on every cold start and
+duplicated across instances. Behind it sits this shared tier: a small
+key/value backend holding compact serialized Observations (see
+Observation.to_bytes), each prefixed with the time it stops being fresh.
+Entries are kept for SHARED_CACHE_STALE_TTL seconds past that, so a stale
+report can still be served while a fresh one is fetched in the background.
+
+The backend is chosen by SHARED_CACHE_URL:
+`sqlite:///path/to/metars.db` (a local file, shared by the processes of
+one host) or `redis://[:password@]host[:port][/db]` (any server speaking
+the Redis protocol). It is disabled when unset.
+"""
+# -*- coding: utf-8 -*-
+
+import abc
+import logging
+import os
+import socket
+import sqlite3
+import struct
+import threading
+import time
+from urllib.parse import urlparse, unquote
+import metrics
+from observation import Observation
+
+
+SHARED_CACHE_URL = os.environ.get('SHARED_CACHE_URL')
+# How long past its freshness an entry may still be served while it is refreshed
+SHARED_CACHE_STALE_TTL = int(os.environ.get('SHARED_CACHE_STALE_TTL', 60 * 60))
+# The shared tier must never be slower than the upstream it saves a trip to
+SHARED_CACHE_TIMEOUT = float(os.environ.get('SHARED_CACHE_TIMEOUT', 0.25))
+KEY_PREFIX = 'metar:'
+
+# Entry header: fresh until (UNIX time)
+_ENTRY_HEADER = struct.Struct('<d')
+
+
+class CacheBackend(abc.ABC):
+    """Interface of a shared key/value store with per-entry expiry
+
+    Values are bytes. Implementations override get_many and set_many;
+    get and set are single-key conveniences.
+    """
+
+    @abc.abstractmethod
+    def get_many(self, keys):
+        """Reads many entries at once
+
+        Arguments:
+            keys {list} -- Keys (strings)
+
+        Returns:
+            dictionary -- Key to value for the keys present and not expired
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def set_many(self, items):
+        """Writes many entries at once, each with its own lifetime
+
+        Arguments:
+            items {dict} -- Key to (value, lifetime in seconds)
+        """
+        raise NotImplementedError
+
+    def get(self, key):
+        """ Reads one entry, returning None if absent or expired """
+        return self.get_many([key]).get(key)
+
+    def set(self, key, value, ttl):
+        """ Writes one entry """
+        self.set_many({key: (value, ttl)})
+
+
+class SQLiteBackend(CacheBackend):
+    """A shared cache in a local SQLite file
+
+    Arguments:
+        path {string} -- Path of the database file
+        clock {callable} -- Returns the current UNIX time (for testing)
+    """
+
+    # Expired rows are purged after this many writes
+    PURGE_INTERVAL = 256
+
+    def __init__(self, path, clock=time.time):
+        self.path = path
+        self.clock = clock
+        self._connection = sqlite3.connect(path, timeout=SHARED_CACHE_TIMEOUT, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._writes = 0
+        with self._lock, self._connection:
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value BLOB, expires_at REAL)'
+            )
+
+    def get_many(self, keys):
+        if not keys:
+            return {}
+        query = 'SELECT key, value FROM entries WHERE expires_at > ? AND key IN ({})'.format(
+            ','.join('?' * len(keys))
+        )
+        with self._lock:
+            rows = self._connection.execute(query, [self.clock()] + list(keys)).fetchall()
+        return {key: bytes(value) for key, value in rows}
+
+    def set_many(self, items):
+        if not items:
+            return
+        now = self.clock()
+        with self._lock, self._connection:
+            self._connection.executemany(
+                'INSERT OR REPLACE INTO entries (key, value, expires_at) VALUES (?, ?, ?)',
+                [(key, value, now + ttl) for key, (value, ttl) in items.items()]
+            )
+            self._writes += len(items)
+            if self._writes >= self.PURGE_INTERVAL:
+                self._writes = 0
+                self._connection.execute('DELETE FROM entries WHERE expires_at <= ?', (now,))
+
+
+class RedisError(Exception):
+    """ An error reply from a Redis server """
+
+
+class RedisBackend(CacheBackend):
+    """A shared cache on a server speaking the Redis protocol (RESP)
+
+    A minimal client: one connection, dropped after any error (including an
+    error reply) and reopened by the next command, and pipelined MGET /
+    SET PX commands.
+
+    Arguments:
+        host {string} -- Server host
+        port {int} -- Server port
+        db {int} -- Database number
+        password {string} -- Password, if the server requires one
+        timeout {float} -- Connect and read timeout, in seconds
+    """
+
+    def __init__(self, host='127.0.0.1', port=6379, db=0, password=None, timeout=SHARED_CACHE_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.db = db
+        self.password = password
+        self.timeout = timeout
+        self._socket = None
+        self._reader = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _encode(*arguments):
+        """ Encodes a command as a RESP array of bulk strings """
+        parts = [b'*%d\r\n' % len(arguments)]
+        for argument in arguments:
+            if not isinstance(argument, bytes):
+                argument = str(argument).encode('utf-8')
+            parts.append(b'$%d\r\n%s\r\n' % (len(argument), argument))
+        return b''.join(parts)
+
+    def _read_reply(self):
+        """ Reads one RESP reply from the connection """
+        line = self._reader.readline()
+        if not line.endswith(b'\r\n'):
+            raise ConnectionError('Connection closed by the Redis server')
+        kind, payload = line[:1], line[1:-2]
+        if kind == b'+':
+            return payload
+        if kind == b'-':
+            raise RedisError(payload.decode('utf-8', 'replace'))
+        if kind == b':':
+            return int(payload)
+        if kind == b'$':
+            length = int(payload)
+            if length < 0:
+                return None
+            data = self._reader.read(length + 2)
+            if len(data) != length + 2:
+                raise ConnectionError('Connection closed by the Redis server')
+            return data[:-2]
+        if kind == b'*':
+            length = int(payload)
+            return None if length < 0 else [self._read_reply() for _ in range(length)]
+        raise ConnectionError('Unexpected Redis reply: {!r}'.format(line))
+
+    def _connect(self):
+        """ Opens the connection, authenticating and selecting the database """
+        self._socket = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._reader = self._socket.makefile('rb')
+        setup = []
+        if self.password:
+            setup.append(('AUTH', self.password))
+        if self.db:
+            setup.append(('SELECT', self.db))
+        if setup:
+            self._execute(setup)
+
+    def _close(self):
+        """ Drops the connection (it is reopened by the next command) """
+        if self._socket is not None:
+            try:
+                self._reader.close()
+                self._socket.close()
+            except OSError:
+                pass
+        self._socket = None
+        self._reader = None
+
+    def _execute(self, commands):
+        """Sends commands in one write and reads their replies (lock must be held)
+
+        Every reply is read before the first error reply is raised, so none
+        is left on the connection to be taken for the reply of a later command.
+        """
+        self._socket.sendall(b''.join(self._encode(*command) for command in commands))
+        replies = []
+        error = None
+        for _ in commands:
+            try:
+                replies.append(self._read_reply())
+            except RedisError as exc:
+                error = error or exc
+                replies.append(None)
+        if error is not None:
+            raise error
+        return replies
+
+    def execute(self, commands):
+        """Runs pipelined commands
+
+        Arguments:
+            commands {list} -- Commands, each a tuple of arguments
+
+        Returns:
+            list -- The reply of every command
+        """
+        with self._lock:
+            try:
+                if self._socket is None:
+                    self._connect()
+                return self._execute(commands)
+            except Exception:
+                self._close()
+                raise
+
+    def get_many(self, keys):
+        if not keys:
+            return {}
+        values = self.execute([('MGET',) + tuple(keys)])[0]
+        if not isinstance(values, list) or not all(value is None or isinstance(value, bytes) for value in values):
+            raise RedisError('Unexpected MGET reply: {!r}'.format(values))
+        return {key: value for key, value in zip(keys, values) if value is not None}
+
+    def set_many(self, items):
+        if not items:
+            return
+        self.execute([
+            ('SET', key, value, 'PX', max(1, int(ttl * 1000))) for key, (value, ttl) in items.items()
+        ])
+
+
+def open_backend(url):
+    """Creates the backend a SHARED_CACHE_URL describes
+
+    Arguments:
+        url {string} -- sqlite:///path or redis://[:password@]host[:port][/db]
+
+    Returns:
+        CacheBackend -- The backend
+    """
+    parsed = urlparse(url)
+    if parsed.scheme == 'sqlite':
+        return SQLiteBackend(parsed.path)
+    if parsed.scheme == 'redis':
+        db = parsed.path.strip('/')
+        return RedisBackend(
+            parsed.hostname or '127.0.0.1', parsed.port or 6379, int(db) if db else 0,
+            unquote(parsed.password) if parsed.password else None
+        )
+    raise ValueError('Unsupported shared cache URL: ' + url)
+
+
+class SharedMetarCache:
+    """Observations in a shared backend, with their freshness
+
+    Backend failures are logged and counted, and read as misses: the shared
+    tier can slow a request down by at most its timeout, never fail it.
+
+    Arguments:
+        backend {CacheBackend} -- The shared store
+        stale_ttl {float} -- Seconds an entry is kept past its freshness
+        clock {callable} -- Returns the current UNIX time (for testing)
+    """
+
+    def __init__(self, backend, stale_ttl=SHARED_CACHE_STALE_TTL, clock=time.time):
+        self.backend = backend
+        self.stale_ttl = stale_ttl
+        self.clock = clock
+
+    def get_many(self, icao_codes):
+        """Reads the observations of many stations
+
+        Arguments:
+            icao_codes {list} -- Upper-cased ICAO codes
+
+        Returns:
+            dictionary -- ICAO code to (Observation, fresh until) for the stations present
+        """
+        try:
+            with metrics.span('shared_cache'):
+                entries = self.backend.get_many([KEY_PREFIX + icao_code for icao_code in icao_codes])
+        except Exception as exc:
+            logging.error('Shared cache read failed: %s', exc)
+            metrics.count('shared_cache.error')
+            return {}
+        found = {}
+        for key, entry in entries.items():
+            try:
+                fresh_until, = _ENTRY_HEADER.unpack_from(entry, 0)
+                found[key[len(KEY_PREFIX):]] = (Observation.from_bytes(entry[_ENTRY_HEADER.size:]), fresh_until)
+            except (struct.error, TypeError, ValueError, IndexError) as exc:
+                logging.error('Unreadable shared cache entry %s: %s', key, exc)
+        return found
+
+    def get(self, icao_code):
+        """Reads the observation of a station
+
+        Arguments:
+            icao_code {string} -- The upper-cased ICAO code
+
+        Returns:
+            tuple -- (Observation, fresh until), or (None, None) if absent
+        """
+        return self.get_many([icao_code]).get(icao_code, (None, None))
+
+    def set_many(self, observations):
+        """Writes observations, each with the time it stops being fresh
+
+        Arguments:
+            observations {dict} -- ICAO code to (Observation, fresh until)
+        """
+        now = self.clock()
+        items = {
+            KEY_PREFIX + icao_code: (
+                _ENTRY_HEADER.pack(fresh_until) + observation.to_bytes(), fresh_until - now + self.stale_ttl
+            )
+            for icao_code, (observation, fresh_until) in observations.items()
+        }
+        if not items:
+            return
+        try:
+            with metrics.span('shared_cache'):
+                self.backend.set_many(items)
+        except Exception as exc:
+            logging.error('Shared cache write failed: %s', exc)
+            metrics.count('shared_cache.error')
+
+    def set(self, icao_code, observation, fresh_until):
+        """ Writes the observation of a station """
+        self.set_many({icao_code: (observation, fresh_until)})
@@ -0,0 +1,255 @@
+""" Local, memory-mapped snapshot of the worldwide METAR bulk cache files
+
+aviationweather.gov publishes every current METAR as one gzipped file
+(metars.cache.xml.gz / metars.cache.csv.gz). build_snapshot streams such a
+file into a compact store: serialized Observation records followed by an
+open-addressing hash table keyed by ICAO code, so a lookup is a hash, a
+probe or two and one record decode, straight from the memory map.
+
+Run standalone to keep a snapshot fresh:
+`python snapshot.py PATH [URL] [INTERVAL_SECONDS]`
+"""
+# -*- coding: utf-8 -*-
+
+import csv
+import gzip
+import io
+import logging
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+import zlib
+import adds
+import upstream
+from observation import Observation
+
+
+BULK_URL = os.environ.get(
+    'METAR_BULK_URL', 'https://www.aviationweather.gov/adds/dataserver_current/current/metars.cache.xml.gz'
+)
+REFRESH_INTERVAL = 5 * 60
+
+# Header: magic, record count, slot count, table offset, creation time
+_HEADER = struct.Struct('<8sIIQd')
+_MAGIC = b'FTSNAP01'
+# Hash table slot: ICAO code (NUL padded), record offset, record length
+_SLOT = struct.Struct('<8sQI')
+_EMPTY_STATION = b'\0' * 8
+
+
+def _slot_index(station, slot_count):
+    """ Returns the home slot of a station code """
+    return zlib.crc32(station) & (slot_count - 1)
+
+
+def _iter_csv_metars(text_stream):
+    """Streams METAR dictionaries out of an ADDS bulk CSV file
+
+    The file starts with a few status lines, then a header row whose
+    sky_cover/cloud_base_ft_agl columns repeat once per cloud layer.
+    """
+    reader = csv.reader(text_stream)
+    header = None
+    for row in reader:
+        if header is None:
+            if row and row[0] == 'raw_text':
+                header = row
+            continue
+        metar_dict = {}
+        sky_conditions = []
+        cover = None
+        for name, value in zip(header, row):
+            if name == 'sky_cover':
+                cover = value
+            elif name == 'cloud_base_ft_agl':
+                if cover and value:
+                    sky_conditions.append({'cloud_base_ft_agl': value, 'sky_cover': cover})
+                cover = None
+            elif value:
+                metar_dict[name] = value
+        metar_dict['sky_conditions'] = sky_conditions
+        yield metar_dict
+
+
+def iter_bulk_metars(path):
+    """Streams METAR dictionaries out of a (optionally gzipped) XML or CSV bulk file
+
+    Arguments:
+        path {string} -- Path of the bulk file (.xml, .csv, optionally .gz)
+
+    Yields:
+        dictionary -- Each METAR, shaped like parse_metar_to_dict's output
+    """
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rb') as binary:
+        if '.csv' in os.path.basename(path):
+            for metar_dict in _iter_csv_metars(io.TextIOWrapper(binary, encoding='utf-8', newline='')):
+                yield metar_dict
+        else:
+            for metar_dict in adds.iter_metars(binary):
+                yield metar_dict
+
+
+def build_snapshot(metars, path):
+    """Writes METARs to a snapshot file, replacing it atomically
+
+    Records are written as they arrive; only the small per-station index is
+    kept in memory. When a station repeats, the newest observation wins.
+
+    Arguments:
+        metars {iterable} -- METAR dictionaries (or Observations)
+        path {string} -- Destination path of the snapshot
+
+    Returns:
+        int -- Number of stations in the snapshot
+    """
+    index = {}
+    temporary = '{}.{}.tmp'.format(path, os.getpid())
+    with open(temporary, 'wb') as snapshot:
+        snapshot.write(b'\0' * _HEADER.size)
+        for metar_dict in metars:
+            station = metar_dict.get('station_id', '').upper().encode('ascii', 'ignore')
+            if not station or len(station) > 8:
+                continue
+            observed = metar_dict.get('observation_time', '')
+            if station in index and index[station][0] >= observed:
+                continue
+            record = Observation(metar_dict).to_bytes()
+            index[station] = (observed, snapshot.tell(), len(record))
+            snapshot.write(record)
+
+        slot_count = 8
+        while slot_count < len(index) * 2:
+            slot_count *= 2
+        table = bytearray(_SLOT.size * slot_count)
+        for station, (_, offset, length) in index.items():
+            slot = _slot_index(station, slot_count)
+            while table[slot * _SLOT.size:slot * _SLOT.size + 8] != _EMPTY_STATION:
+                slot = (slot + 1) & (slot_count - 1)
+            _SLOT.pack_into(table, slot * _SLOT.size, station, offset, length)
+        table_offset = snapshot.tell()
+        snapshot.write(table)
+        snapshot.seek(0)
+        snapshot.write(_HEADER.pack(_MAGIC, len(index), slot_count, table_offset, time.time()))
+    os.replace(temporary, path)
+    return len(index)
+
+
+class SnapshotStore:
+    """Read access to a snapshot file, remapped whenever the file is replaced
+
+    Arguments:
+        path {string} -- Path of the snapshot file
+        check_interval {float} -- Minimum seconds between checks for a new file
+    """
+
+    def __init__(self, path, check_interval=5.0):
+        self.path = path
+        self.check_interval = check_interval
+        self.created_at = None
+        # (memory map, slot count, table offset), swapped as a whole on remap
+        self._state = None
+        self._file_id = None
+        self._count = 0
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        self._refresh()
+        return self._count
+
+    def _refresh(self):
+        """ Maps the snapshot file, again if it was replaced since the last check """
+        now = time.monotonic()
+        if self._checked_at is not None and now - self._checked_at < self.check_interval:
+            return
+        with self._lock:
+            self._checked_at = now
+            try:
+                stat = os.stat(self.path)
+            except OSError:
+                return
+            file_id = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+            if file_id == self._file_id:
+                return
+            with open(self.path, 'rb') as snapshot:
+                mapped = mmap.mmap(snapshot.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, count, slot_count, table_offset, created_at = _HEADER.unpack_from(mapped, 0)
+            if magic != _MAGIC:
+                mapped.close()
+                logging.error('Not a METAR snapshot: ' + self.path)
+                return
+            # Readers holding the old map keep it alive until they are done
+            self._state = (mapped, slot_count, table_offset)
+            self._count = count
+            self.created_at = created_at
+            self._file_id = file_id
+
+    def get(self, icao_code):
+        """Looks up the observation of a station
+
+        Arguments:
+            icao_code {string} -- The ICAO code
+
+        Returns:
+            Observation|None -- The station's observation, or None if absent
+        """
+        self._refresh()
+        state = self._state
+        if state is None:
+            return None
+        mapped, slot_count, table_offset = state
+        station = icao_code.upper().encode('ascii', 'ignore')
+        if not station or len(station) > 8:
+            return None
+        key = station.ljust(8, b'\0')
+        slot = _slot_index(station, slot_count)
+        for _ in range(slot_count):
+            slot_station, offset, length = _SLOT.unpack_from(mapped, table_offset + slot * _SLOT.size)
+            if slot_station == key:
+                return Observation.from_bytes(mapped[offset:offset + length])
+            if slot_station == _EMPTY_STATION:
+                return None
+            slot = (slot + 1) & (slot_count - 1)
+        return None
+
+
+def refresh_snapshot(path, url=BULK_URL):
+    """Downloads the bulk METAR file and rebuilds the snapshot from it
+
+    The download is streamed to disk and parsed incrementally from there.
+
+    Arguments:
+        path {string} -- Path of the snapshot file
+        url {string} -- URL of a bulk METAR file (XML or CSV, optionally gzipped)
+
+    Returns:
+        int -- Number of stations in the new snapshot
+    """
+    download = '{}.{}.{}'.format(path, os.getpid(), os.path.basename(url))
+    try:
+        response = upstream.adds.session.get(url, stream=True, timeout=upstream.adds.timeout)
+        response.raise_for_status()
+        with open(download, 'wb') as bulk:
+            for chunk in response.iter_content(chunk_size=64 * 1024):
+                bulk.write(chunk)
+        return build_snapshot(iter_bulk_metars(download), path)
+    finally:
+        if os.path.exists(download):
+            os.remove(download)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    snapshot_path = sys.argv[1]
+    bulk_url = sys.argv[2] if len(sys.argv) > 2 else BULK_URL
+    interval = float(sys.argv[3]) if len(sys.argv) > 3 else REFRESH_INTERVAL
+    while True:
+        try:
+            logging.info('Snapshot refreshed with %d stations', refresh_snapshot(snapshot_path, bulk_url))
+        except Exception as exc:
+            logging.error('Snapshot refresh failed: %s', exc)
+        time.sleep(interval)
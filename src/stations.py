@@ -0,0 +1,306 @@
+""" Spatial index of reporting stations, for location-based queries
+
+Stations come from a bundled CSV (icao, latitude, longitude, name). They
+are indexed in a KD-tree over points on the unit sphere, so k-nearest
+lookups need no longitude wrap-around or polar special cases, and the
+straight-line (chord) distance orders stations exactly as the
+great-circle distance does.
+
+The bundled list can be regenerated from an ADDS bulk METAR file, which
+carries every reporting station's coordinates:
+`python stations.py BULK_FILE [STATIONS_CSV]`
+"""
+# -*- coding: utf-8 -*-
+
+import csv
+import heapq
+import logging
+import math
+import os
+import sys
+import threading
+from collections import namedtuple
+import helpers
+
+
+STATIONS_PATH = os.environ.get(
+    'STATIONS_PATH', os.path.join(os.path.dirname(os.path.realpath(__file__)), 'stations.csv')
+)
+# Stations whose METARs are fetched (in one bulk request) to answer a nearest-airport query
+NEAREST_CANDIDATES = int(os.environ.get('NEAREST_CANDIDATES', 10))
+# Radius of an area sweep ("which airports near KXYZ are VFR"), and the most a user may ask for
+SWEEP_RADIUS_NM = float(os.environ.get('SWEEP_RADIUS_NM', 100))
+SWEEP_MAX_RADIUS_NM = float(os.environ.get('SWEEP_MAX_RADIUS_NM', 300))
+EARTH_RADIUS_KM = 6371.0
+KM_PER_NAUTICAL_MILE = 1.852
+
+Station = namedtuple('Station', ['icao', 'latitude', 'longitude', 'name'])
+
+
+def _unit_vector(latitude, longitude):
+    """ Returns the point on the unit sphere at a latitude/longitude (degrees) """
+    phi = math.radians(latitude)
+    lam = math.radians(longitude)
+    return (math.cos(phi) * math.cos(lam), math.cos(phi) * math.sin(lam), math.sin(phi))
+
+
+def _km_to_chord_squared(distance_km):
+    """ Converts a great-circle distance to a squared chord length on the unit sphere """
+    chord = 2 * math.sin(min(math.pi / 2, distance_km / (2 * EARTH_RADIUS_KM)))
+    return chord * chord
+
+
+def _chord_to_km(chord_squared):
+    """ Converts a squared chord length on the unit sphere to a great-circle distance """
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(chord_squared) / 2))
+
+
+class StationIndex:
+    """KD-tree of stations for k-nearest lookups
+
+    Arguments:
+        stations {iterable} -- Station tuples
+    """
+
+    def __init__(self, stations):
+        self.stations = list(stations)
+        self._by_icao = {station.icao: station for station in self.stations}
+        points = [(_unit_vector(station.latitude, station.longitude), index)
+                  for index, station in enumerate(self.stations)]
+        self._root = self._build(points, 0)
+
+    def __len__(self):
+        return len(self.stations)
+
+    def get(self, icao_code):
+        """ Returns the station with an ICAO code, or None """
+        return self._by_icao.get(icao_code.upper())
+
+    def _build(self, points, depth):
+        """ Builds a (sub)tree as nested (axis, point, station index, left, right) tuples """
+        if not points:
+            return None
+        axis = depth % 3
+        points.sort(key=lambda point: point[0][axis])
+        middle = len(points) // 2
+        point, index = points[middle]
+        return (
+            axis, point, index,
+            self._build(points[:middle], depth + 1), self._build(points[middle + 1:], depth + 1)
+        )
+
+    def nearest(self, latitude, longitude, count=1):
+        """Finds the stations closest to a location
+
+        Arguments:
+            latitude {float} -- Latitude in degrees
+            longitude {float} -- Longitude in degrees
+            count {int} -- Number of stations to return
+
+        Returns:
+            list -- (distance in km, Station) pairs, closest first
+        """
+        target = _unit_vector(latitude, longitude)
+        # Max-heap (by negated distance) of the best candidates so far
+        best = []
+        # (node, squared distance from the target to the node's side of the split)
+        stack = [(self._root, 0.0)]
+        while stack:
+            node, bound = stack.pop()
+            if node is None or (len(best) == count and bound >= -best[0][0]):
+                continue
+            axis, point, index, left, right = node
+            distance = sum((a - b) * (a - b) for a, b in zip(point, target))
+            if len(best) < count:
+                heapq.heappush(best, (-distance, index))
+            elif distance < -best[0][0]:
+                heapq.heapreplace(best, (-distance, index))
+            offset = target[axis] - point[axis]
+            near, far = (left, right) if offset < 0 else (right, left)
+            # The far side is visited (last) only if it could still hold something closer
+            stack.append((far, offset * offset))
+            stack.append((near, bound))
+        return [
+            (_chord_to_km(-negated), self.stations[index])
+            for negated, index in sorted(best, reverse=True)
+        ]
+
+    def within(self, latitude, longitude, radius_km):
+        """Finds every station within a distance of a location
+
+        Arguments:
+            latitude {float} -- Latitude in degrees
+            longitude {float} -- Longitude in degrees
+            radius_km {float} -- Great-circle radius in kilometers
+
+        Returns:
+            list -- (distance in km, Station) pairs, closest first
+        """
+        target = _unit_vector(latitude, longitude)
+        limit = _km_to_chord_squared(radius_km)
+        found = []
+        stack = [self._root]
+        while stack:
+            node = stack.pop()
+            if node is None:
+                continue
+            axis, point, index, left, right = node
+            distance = sum((a - b) * (a - b) for a, b in zip(point, target))
+            if distance <= limit:
+                found.append((distance, index))
+            offset = target[axis] - point[axis]
+            near, far = (left, right) if offset < 0 else (right, left)
+            stack.append(near)
+            if offset * offset <= limit:
+                stack.append(far)
+        return [(_chord_to_km(distance), self.stations[index]) for distance, index in sorted(found)]
+
+
+def load_stations(path=STATIONS_PATH):
+    """Reads a station list CSV
+
+    Arguments:
+        path {string} -- Path of the CSV (icao, latitude, longitude, name)
+
+    Returns:
+        list -- Station tuples
+    """
+    with open(path, newline='', encoding='utf-8') as station_file:
+        return [
+            Station(row['icao'], float(row['latitude']), float(row['longitude']), row['name'])
+            for row in csv.DictReader(station_file)
+        ]
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def station_index():
+    """ Returns the index of the bundled stations, built on first use """
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = StationIndex(load_stations())
+    return _index
+
+
+def nearest_reports(latitude, longitude, count=NEAREST_CANDIDATES):
+    """Gets the current METARs of the stations closest to a location
+
+    The candidates' reports are fetched together (see helpers.get_metars).
+
+    Arguments:
+        latitude {float} -- Latitude in degrees
+        longitude {float} -- Longitude in degrees
+        count {int} -- Number of stations to consider
+
+    Returns:
+        list -- (distance in nautical miles, Station, Observation) for the stations with a report, closest first
+    """
+    return _reports(station_index().nearest(latitude, longitude, count))
+
+
+def reports_within(latitude, longitude, radius_nm):
+    """Gets the current METARs of every station within a distance of a location
+
+    Arguments:
+        latitude {float} -- Latitude in degrees
+        longitude {float} -- Longitude in degrees
+        radius_nm {float} -- Great-circle radius in nautical miles
+
+    Returns:
+        list -- (distance in nautical miles, Station, Observation) for the stations with a report, closest first
+    """
+    return _reports(station_index().within(latitude, longitude, radius_nm * KM_PER_NAUTICAL_MILE))
+
+
+def _reports(candidates):
+    """Fetches the reports of (distance in km, Station) candidates together
+
+    Distances are given to the intents in nautical miles, the unit of every
+    distance an aviation answer names.
+    """
+    metars = helpers.get_metars([station.icao for _, station in candidates])
+    return [
+        (distance / KM_PER_NAUTICAL_MILE, station, metars[station.icao])
+        for distance, station in candidates if station.icao in metars
+    ]
+
+
+def sweep_reports(icao_code, radius_nm=None):
+    """Gets the current METARs of every station around an airport
+
+    Arguments:
+        icao_code {string} -- the ICAO code of the center airport
+        radius_nm {float} -- Radius in nautical miles (SWEEP_RADIUS_NM if None, at most SWEEP_MAX_RADIUS_NM)
+
+    Returns:
+        list -- (distance in nautical miles, Station, Observation) for the stations with a report, closest first
+    """
+    radius_nm = min(SWEEP_RADIUS_NM if radius_nm is None else radius_nm, SWEEP_MAX_RADIUS_NM)
+    location = station_location(icao_code)
+    if location is None:
+        logging.error('Unknown station location: ' + icao_code)
+        return []
+    return reports_within(location[0], location[1], radius_nm)
+
+
+def station_location(icao_code):
+    """Gets the coordinates of a station, from the index or else from its current METAR
+
+    Arguments:
+        icao_code {string} -- the ICAO code as provided by the user
+
+    Returns:
+        tuple|None -- (latitude, longitude) in degrees, or None if unknown
+    """
+    station = station_index().get(icao_code)
+    if station is not None:
+        return station.latitude, station.longitude
+    metar_dict = helpers.get_metar(icao_code)
+    try:
+        return float(metar_dict['latitude']), float(metar_dict['longitude'])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def write_stations(metars, path=STATIONS_PATH, names=None):
+    """Writes a station list CSV from METARs carrying coordinates
+
+    Arguments:
+        metars {iterable} -- METAR dictionaries (e.g. from snapshot.iter_bulk_metars)
+        path {string} -- Destination CSV
+        names {dict} -- ICAO code to name for the stations that have one (default: the ICAO code)
+
+    Returns:
+        int -- Number of stations written
+    """
+    names = names or {}
+    stations = {}
+    for metar_dict in metars:
+        try:
+            station = Station(
+                metar_dict['station_id'].upper(), float(metar_dict['latitude']),
+                float(metar_dict['longitude']), None
+            )
+        except (KeyError, ValueError):
+            continue
+        stations[station.icao] = station._replace(name=names.get(station.icao, station.icao))
+    temporary = '{}.{}.tmp'.format(path, os.getpid())
+    with open(temporary, 'w', newline='', encoding='utf-8') as station_file:
+        writer = csv.writer(station_file)
+        writer.writerow(Station._fields)
+        for icao_code in sorted(stations):
+            writer.writerow(stations[icao_code])
+    os.replace(temporary, path)
+    return len(stations)
+
+
+if __name__ == '__main__':
+    from snapshot import iter_bulk_metars
+    destination = sys.argv[2] if len(sys.argv) > 2 else STATIONS_PATH
+    known = {station.icao: station.name for station in load_stations(destination)} \
+        if os.path.exists(destination) else {}
+    print('Wrote {} stations'.format(write_stations(iter_bulk_metars(sys.argv[1]), destination, known)))
@@ -0,0 +1,190 @@
+""" TAF forecasts: parsing, time-indexed lookup and caching """
+# -*- coding: utf-8 -*-
+
+import calendar
+import contextvars
+import logging
+import os
+import time
+from bisect import bisect_right
+from xml.etree.ElementTree import ParseError
+import adds
+import helpers
+import metar
+import metrics
+import upstream
+from cache import TTLCache
+
+
+# TAFs are issued every six hours and amended in between; re-check at most
+# every TAF_CACHE_TTL seconds and never keep one past the end of its validity
+TAF_CACHE_TTL = int(os.environ.get('TAF_CACHE_TTL', 30 * 60))
+TAF_CACHE_SIZE = int(os.environ.get('TAF_CACHE_SIZE', 1024))
+TAF_HOURS_BEFORE_NOW = '6'
+
+# Change groups that replace (FM) or amend (BECMG) the prevailing forecast;
+# TEMPO and PROB groups only describe temporary departures from it
+_BASE_CHANGES = (None, 'FM', 'BECMG')
+_CONDITION_FIELDS = ('wind_dir_degrees', 'wind_speed_kt', 'wind_gust_kt', 'visibility_statute_mi', 'wx_string')
+
+taf_cache = TTLCache(ttl=TAF_CACHE_TTL, max_entries=TAF_CACHE_SIZE)
+
+
+def _timestamp(iso_time):
+    """ Converts an ADDS time (YYYY-MM-DDTHH:MM:SSZ) to a UNIX timestamp """
+    return calendar.timegm(time.strptime(iso_time, '%Y-%m-%dT%H:%M:%SZ'))
+
+
+def _flight_category(conditions):
+    """ Derives the flight category of a set of forecast conditions """
+    try:
+        visibility = float(conditions['visibility_statute_mi'])
+    except (KeyError, ValueError):
+        visibility = None
+    return metar.flight_category(metar.ceiling(conditions.get('sky_conditions') or []), visibility)
+
+
+def _overlay(conditions, period):
+    """ Overlays the condition fields a change group mentions onto conditions (in place) """
+    for field in _CONDITION_FIELDS:
+        if field in period:
+            conditions[field] = period[field]
+    if period.get('sky_conditions') or 'sky_conditions' not in conditions:
+        conditions['sky_conditions'] = period.get('sky_conditions', [])
+    conditions['flight_category'] = _flight_category(conditions)
+    return conditions
+
+
+class Forecast:
+    """A decoded TAF, indexed by time
+
+    The prevailing conditions of every FM/BECMG period are resolved once on
+    construction (BECMG only changes the elements it mentions), so finding
+    the conditions at a time is a binary search over the period starts.
+    TEMPO/PROB groups are resolved the same way, over the conditions
+    prevailing when they start.
+
+    Arguments:
+        taf_dict {dict} -- A TAF as returned by adds.parse_taf
+    """
+
+    __slots__ = ('station_id', 'raw_text', 'issue_time', 'valid_from', 'valid_to', '_starts', '_periods', '_temporary')
+
+    def __init__(self, taf_dict):
+        self.station_id = taf_dict.get('station_id')
+        self.raw_text = taf_dict.get('raw_text')
+        self.issue_time = taf_dict.get('issue_time')
+        self.valid_from = _timestamp(taf_dict['valid_time_from'])
+        self.valid_to = _timestamp(taf_dict['valid_time_to'])
+        self._starts = []
+        self._periods = []
+        self._temporary = []
+        prevailing = {}
+        temporary = []
+        for period in sorted(taf_dict.get('forecasts', ()), key=lambda period: period['fcst_time_from']):
+            change = period.get('change_indicator')
+            start = _timestamp(period['fcst_time_from'])
+            if change not in _BASE_CHANGES:
+                temporary.append((start, _timestamp(period['fcst_time_to']), period))
+                continue
+            prevailing = _overlay({} if change == 'FM' else dict(prevailing), period)
+            self._starts.append(start)
+            self._periods.append(prevailing)
+        # Once every base period is known: a TEMPO/PROB group only departs from what prevails as it starts
+        for start, end, period in temporary:
+            index = bisect_right(self._starts, start) - 1
+            conditions = _overlay(dict(self._periods[index]) if index >= 0 else {}, period)
+            conditions['change_indicator'] = period.get('change_indicator')
+            self._temporary.append((start, end, conditions))
+
+    def at(self, timestamp):
+        """Returns the prevailing forecast conditions at a time
+
+        Arguments:
+            timestamp {float} -- UNIX time
+
+        Returns:
+            dictionary|None -- The conditions (with 'flight_category'), or None outside the TAF's validity
+        """
+        if not self.valid_from <= timestamp < self.valid_to:
+            return None
+        index = bisect_right(self._starts, timestamp) - 1
+        return self._periods[index] if index >= 0 else None
+
+    def temporary_at(self, timestamp):
+        """ Returns the conditions of TEMPO/PROB groups in effect at a time """
+        return [conditions for start, end, conditions in self._temporary if start <= timestamp < end]
+
+    def flight_category_at(self, timestamp):
+        """ Returns the forecast flight category at a time, or None if not covered """
+        conditions = self.at(timestamp)
+        return conditions['flight_category'] if conditions else None
+
+
+def _taf_expiry(forecast, now):
+    """ Returns when a cached TAF should be re-checked """
+    return max(min(now + TAF_CACHE_TTL, forecast.valid_to), now + helpers.METAR_CACHE_MIN_TTL)
+
+
+def _fetch_taf(icao_code):
+    """ Fetches and parses the latest TAF of a station, returning None if unavailable """
+    content = helpers.fetch_aviation_gov_xml(icao_code, type='tafs', hours=TAF_HOURS_BEFORE_NOW)
+    if content is None:
+        return None
+    try:
+        with metrics.span('parse'):
+            taf_dict = adds.parse_taf(content)
+            return Forecast(taf_dict) if taf_dict else None
+    except (ParseError, KeyError, ValueError) as exc:
+        logging.error('Unable to parse ADDS TAF response: %s', exc)
+        return None
+
+
+def get_taf(icao_code):
+    """Gets the decoded TAF of a station, cached until re-checked or no longer valid
+
+    Arguments:
+        icao_code {string} -- the ICAO code as provided by the user
+
+    Returns:
+        Forecast|None -- The forecast, or None if unavailable
+    """
+    icao_code = icao_code.upper()
+
+    def load():
+        return _fetch_taf(icao_code)
+
+    forecast, outcome = taf_cache.get_or_load_outcome(icao_code, load, expires=_taf_expiry)
+    metrics.count('taf_cache.' + outcome)
+    return forecast
+
+
+def get_metar_and_taf(icao_code, fields=None):
+    """Gets the current METAR and the TAF of a station in one round trip
+
+    ADDS serves one dataSource per request, so the two requests are sent
+    concurrently over the pooled session rather than one after the other.
+
+    Arguments:
+        icao_code {string} -- the ICAO code as provided by the user
+        fields {iterable} -- METAR fields the caller needs (all fields if None)
+
+    Returns:
+        tuple -- (Observation or empty dict, Forecast or None)
+    """
+    context = contextvars.copy_context()
+    metar_future = upstream.executor.submit(context.run, helpers.get_metar, icao_code, fields)
+    forecast = get_taf(icao_code)
+    return metar_future.result(), forecast
+
+
+async def get_metar_and_taf_async(icao_code, fields=None):
+    """ Async variant of get_metar_and_taf """
+    import asyncio
+    loop = asyncio.get_event_loop()
+    context = contextvars.copy_context()
+    metar_dict, forecast = await asyncio.gather(
+        helpers.get_metar_async(icao_code, fields=fields),
+        loop.run_in_executor(upstream.executor, context.run, get_taf, icao_code),
+    )
+    return metar_dict, forecast
@@ -0,0 +1,176 @@
+""" Process-wide registry of compiled response templates """
+# -*- coding: utf-8 -*-
+
+import os
+import threading
+import metrics
+from string import Formatter
+
+
+RESPONSES_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'responses.yaml')
+
+
+def _segments(template):
+    """Splits a template into (literal, field, format spec, conversion) segments
+
+    Returns None for templates with fields that are more than a plain name
+    (attribute or index lookups, positional or nested fields); those are
+    rendered by str.format_map instead.
+    """
+    segments = []
+    for literal, field, spec, conversion in Formatter().parse(template):
+        if field is not None and (not field.isidentifier() or '{' in spec):
+            return None
+        segments.append((literal, field, spec, conversion))
+    return tuple(segments)
+
+
+class CompiledTemplate(str):
+    """A response template string, compiled once when the registry loads
+
+    Behaves exactly like the original string (so `template.format(**values)`
+    keeps working), but is also pre-split into literal and field segments:
+    rendering looks up only the fields the template uses and appends the
+    pieces to an output list, with the same result as `str.format`.
+    """
+
+    __slots__ = ('fields', '_segments', '_format_map')
+
+    def __new__(cls, template):
+        compiled = super().__new__(cls, template)
+        compiled.fields = frozenset(
+            field for _, field, _, _ in Formatter().parse(template) if field
+        )
+        compiled._segments = _segments(template)
+        compiled._format_map = str(template).format_map
+        return compiled
+
+    def render_into(self, parts, values):
+        """Renders the template, appending the pieces to a list
+
+        Arguments:
+            parts {list} -- The output pieces, joined by the caller
+            values {dict} -- Field values (extra keys are ignored)
+        """
+        if self._segments is None:
+            parts.append(self._format_map(values))
+            return
+        for literal, field, spec, conversion in self._segments:
+            if literal:
+                parts.append(literal)
+            if field is not None:
+                value = values[field]
+                if conversion == 'r':
+                    value = repr(value)
+                elif conversion == 's':
+                    value = str(value)
+                elif conversion == 'a':
+                    value = ascii(value)
+                parts.append(format(value, spec))
+
+    def render(self, values):
+        """Renders the template against a mapping of values
+
+        Arguments:
+            values {dict} -- Field values (extra keys are ignored)
+
+        Returns:
+            string -- The rendered template
+        """
+        parts = []
+        self.render_into(parts, values)
+        return ''.join(parts)
+
+
+class OutputBuffer:
+    """Collects a response made of separated sections, joined once at the end
+
+    Arguments:
+        separator {string} -- Written between sections
+    """
+
+    __slots__ = ('parts', 'separator', 'sections')
+
+    def __init__(self, separator=' '):
+        self.parts = []
+        self.separator = separator
+        self.sections = 0
+
+    def section(self):
+        """ Starts a new section """
+        if self.sections:
+            self.parts.append(self.separator)
+        self.sections += 1
+
+    def write(self, text):
+        """ Appends text to the current section """
+        self.parts.append(text)
+
+    def render(self, template, values):
+        """ Appends a rendered template to the current section """
+        template.render_into(self.parts, values)
+
+    def getvalue(self):
+        """ Returns the whole response """
+        return ''.join(self.parts)
+
+
+def _compile(node):
+    """ Recursively compiles every string leaf of the loaded YAML tree """
+    if isinstance(node, dict):
+        return {key: _compile(value) for key, value in node.items()}
+    if isinstance(node, str):
+        return CompiledTemplate(node)
+    return node
+
+
+class TemplateRegistry:
+    """Loads responses.yaml once per process and reloads it only when it changes
+
+    Arguments:
+        path {string} -- Path of the YAML responses file
+        check_interval {float} -- Minimum seconds between mtime checks
+    """
+
+    def __init__(self, path=RESPONSES_PATH, check_interval=1.0):
+        self.path = path
+        self.check_interval = check_interval
+        self._templates = None
+        self._mtime = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self.generation = 0
+
+    def _load(self, mtime):
+        """ Parses and compiles the YAML file, replacing the current templates """
+        from ruamel.yaml import YAML
+        with metrics.span('template_load'), open(self.path, 'r') as yaml_responses:
+            templates = _compile(YAML(typ='safe').load(yaml_responses))
+        self._templates = templates
+        self._mtime = mtime
+        self.generation += 1
+
+    def templates(self, now):
+        """Returns the compiled template tree, reloading it if the file changed
+
+        Arguments:
+            now {float} -- The current monotonic time
+
+        Returns:
+            dict -- The compiled templates, keyed by category then key
+        """
+        if self._templates is not None and now - self._checked_at < self.check_interval:
+            return self._templates
+        with self._lock:
+            self._checked_at = now
+            mtime = os.stat(self.path).st_mtime_ns
+            if self._templates is None or mtime != self._mtime:
+                self._load(mtime)
+        return self._templates
+
+    def clear(self):
+        """ Drops the loaded templates so the next lookup re-reads the file """
+        with self._lock:
+            self._templates = None
+            self._mtime = None
+            self._checked_at = 0.0
@@ -0,0 +1,202 @@
+""" Resilient HTTP access to the aviationweather.gov data server """
+# -*- coding: utf-8 -*-
+
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+ADDS_URL = os.environ.get(
+    'ADDS_URL', 'https://www.aviationweather.gov/adds/dataserver_current/httpparam'
+)
+# Dialogflow gives a webhook 5 seconds: every attempt and retry of one call
+# fits in REQUEST_BUDGET, leaving the rest for parsing and rendering
+REQUEST_BUDGET = float(os.environ.get('ADDS_REQUEST_BUDGET', 4.0))
+CONNECT_TIMEOUT = float(os.environ.get('ADDS_CONNECT_TIMEOUT', REQUEST_BUDGET / 4))
+READ_TIMEOUT = float(os.environ.get('ADDS_READ_TIMEOUT', REQUEST_BUDGET / 2))
+RETRIES = int(os.environ.get('ADDS_RETRIES', 2))
+POOL_SIZE = 10
+
+
+class CircuitBreaker:
+    """Stops calling a degraded upstream until it has had time to recover
+
+    After failure_threshold consecutive failures the breaker opens and
+    every call is refused for reset_timeout seconds. Then a single trial
+    call is let through: success closes the breaker, failure re-opens it.
+
+    Arguments:
+        failure_threshold {int} -- Consecutive failures that open the breaker
+        reset_timeout {float} -- Seconds to stay open before a trial call
+        clock {callable} -- Returns the current time in seconds (for testing)
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_progress = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        """ Whether calls are currently being refused """
+        with self._lock:
+            return self._opened_at is not None
+
+    def allow(self):
+        """Returns whether a call may be made right now
+
+        Returns:
+            bool -- False while the breaker is open
+        """
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if self._trial_in_progress or self.clock() - self._opened_at < self.reset_timeout:
+                return False
+            self._trial_in_progress = True
+            return True
+
+    def record_success(self):
+        """ Closes the breaker """
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_progress = False
+
+    def record_failure(self):
+        """ Counts a failure, opening the breaker past the threshold """
+        with self._lock:
+            self._failures += 1
+            self._trial_in_progress = False
+            if self._opened_at is not None or self._failures >= self.failure_threshold:
+                self._opened_at = self.clock()
+
+
+# Runs blocking upstream fetches side by side, one thread per pooled connection
+executor = ThreadPoolExecutor(max_workers=POOL_SIZE, thread_name_prefix='upstream')
+
+
+class Upstream:
+    """A pooled keep-alive client with timeouts, jittered retries and a circuit breaker
+
+    Arguments:
+        url {string} -- The endpoint to query
+        retries {int} -- Extra attempts after a failed one
+        backoff {float} -- Base delay in seconds, doubled on every retry
+        max_backoff {float} -- Upper bound on a single delay
+        timeout {tuple} -- (connect, read) timeouts in seconds, of one attempt
+        breaker {CircuitBreaker} -- Breaker guarding this upstream
+        budget {float} -- Seconds all the attempts of one call may take together
+        clock {callable} -- Returns the current time in seconds (for testing)
+    """
+
+    def __init__(self, url=ADDS_URL, retries=RETRIES, backoff=0.2, max_backoff=2.0,
+                 timeout=(CONNECT_TIMEOUT, READ_TIMEOUT), breaker=None, budget=REQUEST_BUDGET,
+                 clock=time.monotonic):
+        self.url = url
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.breaker = breaker or CircuitBreaker()
+        self.budget = budget
+        self.clock = clock
+        self._session = None
+        self._session_lock = threading.Lock()
+
+    @property
+    def session(self):
+        """ The pooled session, created on first use (requests is slow to import) """
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    import requests
+                    from requests.adapters import HTTPAdapter
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE)
+                    session.mount('http://', adapter)
+                    session.mount('https://', adapter)
+                    self._session = session
+        return self._session
+
+    def _delay(self, attempt):
+        """ Returns the jittered delay before retry number attempt (from 0) """
+        delay = min(self.max_backoff, self.backoff * (2 ** attempt))
+        return random.uniform(delay / 2, delay)
+
+    def get(self, params):
+        """Performs a GET request, retrying transient failures
+
+        Connection errors, timeouts and 5xx responses are retried; other
+        non-200 responses are not. Nothing is sent while the breaker is open,
+        and the call gives up once its budget is spent.
+
+        Arguments:
+            params {dict} -- Query string parameters
+
+        Returns:
+            bytes || None -- The response body if successful
+        """
+        if not self.breaker.allow():
+            logging.error('Upstream circuit open, not calling ' + self.url)
+            return None
+        healthy = False
+        try:
+            content, healthy = self._get(params)
+            return content
+        finally:
+            # Anything else raised counts as a failure, so a trial call never stays in progress
+            if healthy:
+                self.breaker.record_success()
+            else:
+                self.breaker.record_failure()
+
+    def _get(self, params):
+        """Performs the attempts of a GET request, within the budget
+
+        No attempt (or backoff) starts past the deadline, and each one's
+        timeouts are cut to the time left.
+
+        Arguments:
+            params {dict} -- Query string parameters
+
+        Returns:
+            tuple -- (response body or None, whether the upstream answered)
+        """
+        from requests import RequestException
+        deadline = self.clock() + self.budget
+        connect_timeout, read_timeout = self.timeout
+        for attempt in range(self.retries + 1):
+            if attempt:
+                delay = self._delay(attempt - 1)
+                if self.clock() + delay >= deadline:
+                    break
+                time.sleep(delay)
+            remaining = deadline - self.clock()
+            if remaining <= 0:
+                break
+            timeout = (min(connect_timeout, remaining), min(read_timeout, remaining))
+            try:
+                response = self.session.get(self.url, params=params, timeout=timeout)
+            except RequestException as exc:
+                logging.error('Upstream request failed: %s', exc)
+                continue
+            if response.status_code == 200:
+                return response.content, True
+            logging.error('Upstream returned HTTP %s', response.status_code)
+            if response.status_code < 500:
+                return None, True
+        else:
+            return None, False
+        logging.error('Upstream request budget of %ss spent', self.budget)
+        return None, False
+
+
+adds = Upstream()
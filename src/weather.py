@@ -2,10 +2,30 @@
 # -*- coding: utf-8 -*-
 
 import logging
+from functools import wraps
+import metar
 from helpers import get_standard_error_message, get_response
-import dateparser
 from datetime import datetime
-import timeago
+from observation import Observation
+
+
+def _memoized_per_observation(accessor):
+    """Caches an accessor's result on Observation records
+
+    The accessor runs once per observation; plain dictionaries (which may
+    be modified between calls) are always recomputed.
+    """
+    @wraps(accessor)
+    def wrapper(metar_dict):
+        if isinstance(metar_dict, Observation):
+            return metar_dict.memoize(accessor.__name__, accessor)
+        return accessor(metar_dict)
+    return wrapper
+
+
+# Changes smaller than these over a trend window are reported as steady
+CEILING_TREND_THRESHOLD_FT = 200
+WIND_TREND_THRESHOLD_KT = 5
 
 
 def _convert_c_to_f(temp_c):
@@ -33,6 +53,7 @@ def get_wind_information(metar_dict):
     return metar_dict['wind_speed_kt'], metar_dict['wind_dir_degrees']
 
 
+@_memoized_per_observation
 def get_visibility(metar_dict):
     """ Returns the current visibility as raw data """
     if 'visibility_statute_mi' not in metar_dict:
@@ -48,6 +69,7 @@ def get_altimeter(metar_dict):
         return metar_dict['altim_in_hg']
 
 
+@_memoized_per_observation
 def get_temperature(metar_dict):
     """ Returns the current temperature in celcius and fahrenheit """
     if 'temp_c' not in metar_dict:
@@ -57,6 +79,7 @@ def get_temperature(metar_dict):
     return str(temp_c), str(temp_f)
 
 
+@_memoized_per_observation
 def get_dewpoint(metar_dict):
     """ Returns the current dewpoint in Celcius and Fahrenheit """
     if 'dewpoint_c' not in metar_dict:
@@ -66,6 +89,7 @@ def get_dewpoint(metar_dict):
     return str(dew_c), str(dew_f)
 
 
+@_memoized_per_observation
 def get_elevation(metar_dict):
     """ Returns the elevation of the aerodrome """
     if 'elevation_m' not in metar_dict:
@@ -75,6 +99,7 @@ def get_elevation(metar_dict):
     return str(elevation_m), str(elevation_f)
 
 
+@_memoized_per_observation
 def get_metar_raw(metar_dict):
     """ Returns the raw METAR data """
     if 'raw_text' not in metar_dict:
@@ -82,6 +107,7 @@ def get_metar_raw(metar_dict):
     return metar_dict['raw_text'].replace('\n', '')
 
 
+@_memoized_per_observation
 def get_flight_category(metar_dict):
     """Gets the flight category from the metar dictionary"""
     if 'flight_category' not in metar_dict:
@@ -91,15 +117,82 @@ def get_flight_category(metar_dict):
     return flight_category
 
 
+def get_flight_categories(observations):
+    """ Returns the flight category of many observations at once (as reported, else derived) """
+    from batch import ObservationBatch
+    return list(ObservationBatch(observations).flight_categories())
+
+
+# Relative time phrasing, as (ago, in-the-future) pairs: "just now", then
+# singular/plural seconds, minutes, hours, days, weeks, months and years
+_RELATIVE_PHRASES = (
+    ('just now', 'a while'),
+    ('%s seconds ago', 'in %s seconds'),
+    ('1 minute ago', 'in 1 minute'),
+    ('%s minutes ago', 'in %s minutes'),
+    ('1 hour ago', 'in 1 hour'),
+    ('%s hours ago', 'in %s hours'),
+    ('1 day ago', 'in 1 day'),
+    ('%s days ago', 'in %s days'),
+    ('1 week ago', 'in 1 week'),
+    ('%s weeks ago', 'in %s weeks'),
+    ('1 month ago', 'in 1 month'),
+    ('%s months ago', 'in %s months'),
+    ('1 year ago', 'in 1 year'),
+    ('%s years ago', 'in %s years'),
+)
+# Size of each unit in the previous one: second, minute, hour, day, week, month
+_RELATIVE_UNITS = (60.0, 60.0, 24.0, 7.0, 365.0 / 7.0 / 12.0, 12.0)
+
+
+def format_relative_time(then, now):
+    """ Returns a phrase like "5 minutes ago" for the time between two naive datetimes """
+    seconds = int((now - then).total_seconds())
+    future = 1 if seconds < 0 else 0
+    amount = abs(seconds)
+    index = 0
+    for unit in _RELATIVE_UNITS:
+        if amount < unit:
+            break
+        amount /= unit
+        index += 1
+    amount = int(amount)
+    index *= 2
+    if amount > (9 if index == 0 else 1):
+        index += 1
+    phrase = _RELATIVE_PHRASES[index][future]
+    return phrase % amount if '%s' in phrase else phrase
+
+
+def parse_observation_time(observation_time):
+    """ Parses an ADDS observation time (YYYY-MM-DDTHH:MM:SSZ) to a naive UTC datetime """
+    if len(observation_time) == 20 and observation_time[10] == 'T' and observation_time[19] == 'Z':
+        try:
+            return datetime(
+                int(observation_time[0:4]), int(observation_time[5:7]), int(observation_time[8:10]),
+                int(observation_time[11:13]), int(observation_time[14:16]), int(observation_time[17:19])
+            )
+        except ValueError:
+            pass
+    import dateparser
+    return dateparser.parse(observation_time).replace(tzinfo=None)
+
+
+@_memoized_per_observation
+def _get_observed_at(metar_dict):
+    """ Returns the observation time as a naive UTC datetime """
+    return parse_observation_time(metar_dict['observation_time'])
+
+
 def get_time(metar_dict):
     """ Returns the absolute and relative time of the METAR """
     if 'observation_time' not in metar_dict:
         logging.error('No observation time in metar_dict')
         return None, None
-    zulu = dateparser.parse(metar_dict['observation_time']).replace(tzinfo=None)
+    zulu = _get_observed_at(metar_dict)
     now = datetime.utcnow().replace(tzinfo=None)
-    relative = timeago.format(zulu, now)
-    hours_mins = str(zulu.strftime("%H")) + str(zulu.strftime("%M"))
+    relative = format_relative_time(zulu, now)
+    hours_mins = '{:02d}{:02d}'.format(zulu.hour, zulu.minute)
     return hours_mins, relative
 
 
@@ -109,6 +202,7 @@ def get_station_id(metar_dict):
         return metar_dict['station_id'].upper()
 
 
+@_memoized_per_observation
 def get_sky_conditions(metar_dict):
     """ Returns list of sky conditions """
     if 'sky_conditions' not in metar_dict:
@@ -132,3 +226,44 @@ def get_sky_conditions(metar_dict):
             cover, cond['cloud_base_ft_agl']
         ))
     return cleaned_conditions
+
+
+@_memoized_per_observation
+def get_ceiling(metar_dict):
+    """ Returns the ceiling in feet AGL, or None if there is no broken/overcast layer """
+    return metar.ceiling(metar_dict.get('sky_conditions') or [])
+
+
+def _trend(first, last, threshold, rising='rising', falling='falling'):
+    """ Describes the change between two values, ignoring changes below threshold """
+    if last - first >= threshold:
+        return rising
+    if first - last >= threshold:
+        return falling
+    return 'steady'
+
+
+def get_ceiling_trend(observations):
+    """ Returns the first and last ceiling (None if unlimited) of a series of observations, and its trend """
+    if len(observations) < 2:
+        return None, None, None
+    first = get_ceiling(observations[0])
+    last = get_ceiling(observations[-1])
+    trend = _trend(
+        float('inf') if first is None else first, float('inf') if last is None else last,
+        CEILING_TREND_THRESHOLD_FT
+    )
+    if first is None and last is None:
+        trend = 'steady'
+    return first, last, trend
+
+
+def get_wind_trend(observations):
+    """ Returns the first and last (speed, direction) of a series of observations, and the speed trend """
+    winds = [get_wind_information(observation) for observation in observations]
+    winds = [(speed, direction) for speed, direction in winds if speed is not None]
+    if len(winds) < 2:
+        return None, None, None
+    first, last = winds[0], winds[-1]
+    trend = _trend(int(first[0]), int(last[0]), WIND_TREND_THRESHOLD_KT, 'increasing', 'decreasing')
+    return first, last, trend
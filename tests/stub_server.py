@@ -0,0 +1,67 @@
+""" A local stand-in for the aviationweather.gov data server """
+
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import urlparse, parse_qs
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class StubServer:
+    """Serves canned responses on localhost and records every request
+
+    Responses are (status, body, delay) tuples, served in order; the last
+    one is repeated once the list runs out. Pass a callable instead of a
+    list to build the response from the parsed query string.
+    """
+
+    def __init__(self, responses=None):
+        self.responses = responses if responses is not None else [(200, b'', 0)]
+        self.requests = []
+        self._lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Headers and body go out as separate writes; without this, Nagle's
+            # algorithm and delayed ACKs add ~40ms to every keep-alive response
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                query = parse_qs(urlparse(self.path).query)
+                status, body, delay = stub._next_response(query)
+                if delay:
+                    time.sleep(delay)
+                self.send_response(status)
+                self.send_header('Content-Type', 'text/xml')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = _ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:{}/adds/dataserver_current/httpparam'.format(self.server.server_port)
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def _next_response(self, query):
+        with self._lock:
+            self.requests.append(query)
+            if callable(self.responses):
+                return self.responses(query)
+            if len(self.responses) > 1:
+                return self.responses.pop(0)
+            return self.responses[0]
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
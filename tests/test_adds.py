@@ -0,0 +1,54 @@
+""" Tests for the streaming ADDS XML parser """
+
+import io
+import os
+import adds
+import helpers
+from bs4 import BeautifulSoup
+from tests.helpers import get_data_directory
+
+
+def load_metar_bytes():
+    """ Loads the METAR fixture as bytes """
+    with open(os.path.join(get_data_directory(), 'metar.txt'), 'rb') as metar:
+        return metar.read()
+
+
+def wrap_response(*metars):
+    """ Wraps METAR elements in an ADDS response envelope """
+    return (
+        b'<?xml version="1.0" encoding="UTF-8"?><response version="1.2"><data num_results="' +
+        str(len(metars)).encode() + b'">' + b''.join(metars) + b'</data></response>'
+    )
+
+
+def test_stream_parser_matches_soup_parser():
+    content = load_metar_bytes()
+    expected = helpers.parse_metar_to_dict(BeautifulSoup(content.decode(), features='html.parser'))
+    assert adds.parse_metar(content) == expected
+
+
+def test_stream_parser_reads_sky_conditions():
+    metar = adds.parse_metar(load_metar_bytes())
+    assert metar['sky_conditions'] == [
+        {'cloud_base_ft_agl': '200', 'sky_cover': 'SCT'},
+        {'cloud_base_ft_agl': '400', 'sky_cover': 'OVC'},
+    ]
+
+
+def test_stream_parser_reads_file_objects_in_chunks(monkeypatch):
+    monkeypatch.setattr(adds, 'CHUNK_SIZE', 16)
+    content = wrap_response(load_metar_bytes(), load_metar_bytes())
+    metars = list(adds.iter_metars(io.BytesIO(content)))
+    assert len(metars) == 2
+    assert metars[1]['station_id'] == 'CYYZ'
+
+
+def test_stream_parser_returns_empty_dict_without_metar():
+    assert adds.parse_metar(wrap_response()) == {}
+
+
+def test_stream_parser_decodes_only_requested_fields():
+    metar = adds.parse_metar(load_metar_bytes(), {'station_id', 'flight_category'})
+    assert metar == {'station_id': 'CYYZ', 'flight_category': 'LIFR'}
+    assert 'sky_conditions' in adds.parse_metar(load_metar_bytes(), {'sky_conditions'})
@@ -7,10 +7,14 @@ import main as api
 import helpers
 import weather
 import responses
+import upstream
 from bs4 import BeautifulSoup
 import json
+import time
+import asyncio
 import pytest
 from tests.helpers import get_data_directory, load_sample_dialogflow_request
+from tests.stub_server import StubServer
 
 
 def test_can_get_aviation_gov_site():
@@ -72,3 +76,116 @@ def testget_intent():
     request_dictionary = load_sample_dialogflow_request()
     intent = helpers.get_intent(request_dictionary)
     assert intent == "get_flight_condition"
+
+
+def test_station_codes_are_chunked_to_the_budget():
+    chunks = list(helpers._chunk_station_codes(['CYYZ', 'CYXU', 'KSFO', 'KJFK'], budget=10))
+    assert chunks == ['CYYZ,CYXU', 'KSFO,KJFK']
+
+
+def test_get_metars_fetches_stations_in_bulk(monkeypatch):
+    metar = open(os.path.join(get_data_directory(), 'metar.txt'), 'rb').read()
+    requested = []
+
+    def fake_fetch(station_string, **kwargs):
+        requested.append((station_string, kwargs))
+        metars = [metar.replace(b'CYYZ', code.encode()) for code in station_string.split(',')]
+        return b'<response><data>' + b''.join(metars) + b'</data></response>'
+
+    monkeypatch.setattr(helpers, 'fetch_aviation_gov_xml', fake_fetch)
+    monkeypatch.setattr(helpers, 'STATION_STRING_BUDGET', 10)
+    helpers.metar_cache.clear()
+    helpers.metar_cache.set('KSFO', {'station_id': 'KSFO'})
+    metars = helpers.get_metars(['cyyz', 'CYXU', 'KSFO', 'CYYZ', 'KJFK'])
+    assert sorted(metars) == ['CYXU', 'CYYZ', 'KJFK', 'KSFO']
+    assert [station_string for station_string, _ in requested] == ['CYYZ,CYXU', 'KJFK']
+    assert all(kwargs['each_station'] for _, kwargs in requested)
+    assert helpers.metar_cache.get('KJFK')['station_id'] == 'KJFK'
+    helpers.metar_cache.clear()
+
+
+def test_end_to_end_api_against_stub_server(monkeypatch):
+    """ Tests the API end-end against a local stand-in for aviation.gov """
+    metar = open(os.path.join(get_data_directory(), 'metar.txt'), 'rb').read()
+    helpers.metar_cache.clear()
+    with StubServer([(200, metar.replace(b'CYYZ', b'CYXU'), 0)]) as stub:
+        monkeypatch.setattr(upstream, 'adds', upstream.Upstream(stub.url, retries=0))
+        speech, text = api.build_response(load_sample_dialogflow_request())
+        assert speech == "It's looking like low IFR right now at London."
+        assert stub.requests[0]['stationString'] == ['CYXU']
+    helpers.metar_cache.clear()
+
+
+def test_degraded_upstream_fails_fast_to_standard_error(monkeypatch):
+    """ Tests an open circuit breaker short-circuits to the standard error """
+    helpers.metar_cache.clear()
+    with StubServer([(503, b'', 0)]) as stub:
+        breaker = upstream.CircuitBreaker(failure_threshold=1, reset_timeout=60)
+        monkeypatch.setattr(upstream, 'adds', upstream.Upstream(stub.url, retries=0, breaker=breaker))
+        assert api.build_response(load_sample_dialogflow_request())[0] == helpers.get_standard_error_message()
+        assert api.build_response(load_sample_dialogflow_request())[0] == helpers.get_standard_error_message()
+        assert len(stub.requests) == 1
+
+
+def test_outage_serves_last_known_report_with_its_age(monkeypatch):
+    """ Tests a failing upstream falls back to the last known report and refreshes it in the background """
+    observed = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(time.time() - 2 * 60 * 60))
+    metar = open(os.path.join(get_data_directory(), 'metar.txt'), 'rb').read()
+    metar = metar.replace(b'CYYZ', b'CYXU').replace(b'2018-10-02T21:00:00Z', observed.encode())
+    helpers.metar_cache.clear()
+    helpers.last_known_good.clear()
+    with StubServer([(200, metar, 0), (503, b'', 0)]) as stub:
+        monkeypatch.setattr(upstream, 'adds', upstream.Upstream(stub.url, retries=0))
+        assert api.build_response(load_sample_dialogflow_request())[0] == \
+            "It's looking like low IFR right now at London."
+        helpers.metar_cache.clear()
+        speech, text = api.build_response(load_sample_dialogflow_request())
+        assert speech == (
+            "It's looking like low IFR right now at London. A newer report isn't in yet, "
+            "so that's from the last one we have, 2 hours ago."
+        )
+        for _ in range(100):
+            if len(stub.requests) == 3:
+                break
+            time.sleep(0.01)
+        assert len(stub.requests) == 3
+    helpers.metar_cache.clear()
+    helpers.last_known_good.clear()
+
+
+def test_asgi_app_serves_fulfillment(monkeypatch):
+    """ Tests the ASGI entry point end-end against the stub server """
+    metar = open(os.path.join(get_data_directory(), 'metar.txt'), 'rb').read()
+    body = json.dumps(load_sample_dialogflow_request()).encode('utf-8')
+    helpers.metar_cache.clear()
+    sent = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': body, 'more_body': False}
+
+    async def send(message):
+        sent.append(message)
+
+    async def serve_concurrently():
+        scope = {'type': 'http', 'method': 'POST', 'path': '/'}
+        await asyncio.gather(*[api.app(scope, receive, send) for _ in range(5)])
+
+    with StubServer([(200, metar.replace(b'CYYZ', b'CYXU'), 0.1)]) as stub:
+        monkeypatch.setattr(upstream, 'adds', upstream.Upstream(stub.url, retries=0))
+        asyncio.run(serve_concurrently())
+        assert len(stub.requests) == 1
+    statuses = [message['status'] for message in sent if message['type'] == 'http.response.start']
+    bodies = [json.loads(message['body']) for message in sent if message['type'] == 'http.response.body']
+    assert statuses == [200] * 5
+    assert bodies[0] == {'fulfillmentText': "It's looking like low IFR right now at London."}
+    helpers.metar_cache.clear()
+
+
+@pytest.mark.parametrize('intent, icao_code', [('get_unknown', 'CYXU'), ('get_flight_condition', 'CY XU')])
+def test_invalid_requests_never_fetch(monkeypatch, intent, icao_code):
+    """ Tests unknown intents and malformed ICAO codes are rejected before any I/O """
+    request = load_sample_dialogflow_request()
+    request['queryResult']['intent']['displayName'] = intent
+    request['queryResult']['parameters']['airport']['ICAO'] = icao_code
+    monkeypatch.setattr(helpers, 'get_metar', lambda *args: pytest.fail('fetched an invalid request'))
+    assert api.build_response(request)[0] == helpers.get_standard_error_message()
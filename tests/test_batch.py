@@ -0,0 +1,65 @@
+""" Tests for the columnar observation batch """
+
+import random
+import metar
+import weather
+from batch import ObservationBatch
+from observation import Observation
+
+
+def random_observation(generator, index):
+    """ Returns a METAR dictionary with random sky conditions and visibility """
+    observation = {'station_id': 'K{:03d}'.format(index)}
+    if generator.random() < 0.9:
+        observation['visibility_statute_mi'] = str(generator.choice([0.25, 0.5, 1.0, 2.5, 3.0, 4.0, 5.0, 6.0, 10.0]))
+    observation['sky_conditions'] = [
+        {
+            'sky_cover': generator.choice(['FEW', 'SCT', 'BKN', 'OVC', 'OVX', 'CLR']),
+            'cloud_base_ft_agl': str(generator.choice([200, 400, 500, 800, 1000, 2500, 3000, 3001, 5000])),
+        }
+        for _ in range(generator.randint(0, 3))
+    ]
+    return observation
+
+
+def test_batch_matches_the_per_station_derivation():
+    generator = random.Random(11)
+    observations = [random_observation(generator, index) for index in range(500)]
+    batch = ObservationBatch(observations)
+    assert len(batch) == 500
+    for observation, ceiling, category in zip(observations, batch.ceilings(), batch.derived_categories()):
+        expected_ceiling = metar.ceiling(observation['sky_conditions'])
+        assert ceiling == (float('inf') if expected_ceiling is None else expected_ceiling)
+        visibility = observation.get('visibility_statute_mi')
+        assert category == metar.flight_category(
+            expected_ceiling, None if visibility is None else float(visibility)
+        )
+
+
+def test_reported_categories_take_precedence():
+    observations = [
+        {'station_id': 'CYYZ', 'flight_category': 'mvfr ', 'visibility_statute_mi': '10.0', 'sky_conditions': []},
+        {'station_id': 'CYXU', 'visibility_statute_mi': '0.5', 'sky_conditions': []},
+        {'station_id': 'CYKF', 'sky_conditions': [{'sky_cover': 'OVC', 'cloud_base_ft_agl': '900'}]},
+    ]
+    assert weather.get_flight_categories(observations) == ['MVFR', 'LIFR', 'IFR']
+
+
+def test_observations_are_read_from_their_typed_fields():
+    generator = random.Random(7)
+    dictionaries = [random_observation(generator, index) for index in range(100)]
+    from_dictionaries = ObservationBatch(dictionaries)
+    from_observations = ObservationBatch([Observation(dictionary) for dictionary in dictionaries])
+    assert list(from_observations.ceilings()) == list(from_dictionaries.ceilings())
+    assert list(from_observations.derived_categories()) == list(from_dictionaries.derived_categories())
+
+
+def test_layers_without_a_base_are_skipped():
+    batch = ObservationBatch([{'station_id': 'CYYZ', 'sky_conditions': [
+        {'sky_cover': 'OVC'}, {'sky_cover': 'BKN', 'cloud_base_ft_agl': '700'},
+    ]}])
+    assert list(batch.ceilings()) == [700.0]
+
+
+def test_empty_batch():
+    assert weather.get_flight_categories([]) == []
@@ -0,0 +1,154 @@
+""" Tests for the in-process caches """
+
+import os
+import threading
+import time
+import cache
+import helpers
+from tests.helpers import get_data_directory
+
+
+class FakeClock:
+    """ A manually advanced clock """
+
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def test_entries_expire_after_ttl():
+    clock = FakeClock()
+    ttl_cache = cache.TTLCache(ttl=10, clock=clock)
+    ttl_cache.set('CYYZ', 'metar')
+    clock.now += 9
+    assert ttl_cache.get('CYYZ') == 'metar'
+    clock.now += 1
+    assert ttl_cache.get('CYYZ') is None
+
+
+def test_least_recently_used_entry_is_evicted():
+    ttl_cache = cache.TTLCache(ttl=10, max_entries=2, clock=FakeClock())
+    ttl_cache.set('CYYZ', 1)
+    ttl_cache.set('CYXU', 2)
+    ttl_cache.get('CYYZ')
+    ttl_cache.set('KSFO', 3)
+    assert ttl_cache.get('CYXU') is None
+    assert ttl_cache.get('CYYZ') == 1
+    assert ttl_cache.get('KSFO') == 3
+
+
+def test_get_or_load_uses_custom_expiry_and_skips_empty_values():
+    clock = FakeClock()
+    ttl_cache = cache.TTLCache(ttl=100, clock=clock)
+    assert ttl_cache.get_or_load('CYYZ', lambda: {}) == {}
+    assert len(ttl_cache) == 0
+    ttl_cache.get_or_load('CYYZ', lambda: {'a': 1}, expires=lambda value, now: now + 5)
+    clock.now += 5
+    assert ttl_cache.get('CYYZ') is None
+
+
+def test_concurrent_misses_share_one_load():
+    ttl_cache = cache.TTLCache(ttl=100)
+    calls = []
+    started = threading.Event()
+    release = threading.Event()
+
+    def loader():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return {'station_id': 'CYYZ'}
+
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(ttl_cache.get_or_load('CYYZ', loader)))
+        for _ in range(5)
+    ]
+    threads[0].start()
+    started.wait(5)
+    for thread in threads[1:]:
+        thread.start()
+    time.sleep(0.05)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert len(calls) == 1
+    assert results == [{'station_id': 'CYYZ'}] * 5
+
+
+def test_metar_expires_when_next_report_could_exist():
+    observed = helpers.observation_timestamp({'observation_time': '2018-10-02T21:00:00Z'})
+    expiry = helpers.metar_expiry({'observation_time': '2018-10-02T21:00:00Z'}, observed + 50 * 60)
+    assert expiry == observed + 60 * 60
+
+
+def test_late_metar_is_still_cached_briefly():
+    observed = helpers.observation_timestamp({'observation_time': '2018-10-02T21:00:00Z'})
+    now = observed + 2 * 60 * 60
+    assert helpers.metar_expiry({'observation_time': '2018-10-02T21:00:00Z'}, now) == \
+        now + helpers.METAR_CACHE_MIN_TTL
+
+
+def test_get_metar_fetches_each_station_once(monkeypatch):
+    fetched = []
+
+    def fake_fetch(icao_code, fields=None):
+        fetched.append(icao_code)
+        return {'station_id': icao_code, 'observation_time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())}
+
+    monkeypatch.setattr(helpers, '_fetch_metar', fake_fetch)
+    helpers.metar_cache.clear()
+    helpers.get_metar('cyyz')
+    helpers.get_metar('CYYZ')
+    assert fetched == ['CYYZ']
+    helpers.metar_cache.clear()
+
+
+def test_replace_keeps_expiry_and_skips_changed_entries():
+    clock = FakeClock()
+    ttl_cache = cache.TTLCache(ttl=10, clock=clock)
+    ttl_cache.set('a', 'old')
+    ttl_cache.replace('a', 'old', 'new')
+    ttl_cache.replace('a', 'old', 'newer')
+    assert ttl_cache.get('a') == 'new'
+    clock.now += 11
+    assert ttl_cache.get('a') is None
+
+
+def test_partial_fetch_is_fully_decoded_on_next_hit(monkeypatch):
+    with open(os.path.join(get_data_directory(), 'metar.txt'), 'rb') as metar:
+        content = metar.read()
+    monkeypatch.setattr(helpers, 'fetch_aviation_gov_xml', lambda icao_code, **kwargs: content)
+    helpers.metar_cache.clear()
+    partial = helpers.get_metar('CYYZ', {'flight_category'})
+    assert sorted(partial) == ['flight_category', 'observation_time', 'station_id']
+    full = helpers.get_metar('CYYZ', {'flight_category'})
+    assert 'raw_text' in full and 'sky_conditions' in full
+    assert helpers.metar_cache.get('CYYZ') is full
+    helpers.metar_cache.clear()
+
+
+def test_get_or_load_outcome_tells_waiters_apart_from_hits():
+    ttl_cache = cache.TTLCache(ttl=10, clock=FakeClock())
+    started = threading.Event()
+    release = threading.Event()
+
+    def loader():
+        started.set()
+        release.wait(5)
+        return 'metar'
+
+    outcomes = []
+    owner = threading.Thread(target=lambda: outcomes.append(ttl_cache.get_or_load_outcome('CYYZ', loader)))
+    owner.start()
+    started.wait(5)
+    waiter = threading.Thread(target=lambda: outcomes.append(ttl_cache.get_or_load_outcome('CYYZ', loader)))
+    waiter.start()
+    time.sleep(0.05)
+    release.set()
+    owner.join(5)
+    waiter.join(5)
+    assert sorted(outcomes) == [('metar', cache.COALESCED), ('metar', cache.MISS)]
+    assert ttl_cache.get_or_load_outcome('CYYZ', loader) == ('metar', cache.HIT)
@@ -0,0 +1,101 @@
+""" Tests for the per-station METAR history and trend intents """
+
+import calendar
+from datetime import datetime, timedelta
+import adds
+import history
+import helpers
+import main as api
+import responses
+import upstream
+import weather
+from observation import Observation
+from tests.helpers import load_sample_dialogflow_request
+from tests.stub_server import StubServer
+
+
+NOW = calendar.timegm(datetime(2018, 10, 2, 22, 30).timetuple())
+
+
+class FakeClock:
+    """ A manually advanced clock """
+
+    def __init__(self, now=NOW):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def metar_xml(hour, ceiling_ft=3000, wind_speed_kt=10):
+    """ Returns a <METAR> element observed at hour:00Z on the test day """
+    return (
+        '<METAR><raw_text>CYYZ</raw_text><station_id>CYYZ</station_id>'
+        '<observation_time>2018-10-02T{:02d}:00:00Z</observation_time>'
+        '<wind_dir_degrees>270</wind_dir_degrees><wind_speed_kt>{}</wind_speed_kt>'
+        '<sky_condition sky_cover="OVC" cloud_base_ft_agl="{}" /></METAR>'
+    ).format(hour, wind_speed_kt, ceiling_ft).encode()
+
+
+def adds_response(*metars):
+    """ Wraps METAR elements in an ADDS response envelope """
+    return b'<response><data>' + b''.join(metars) + b'</data></response>'
+
+
+def observation(hour, ceiling_ft=3000, wind_speed_kt=10):
+    """ Returns an Observation observed at hour:00Z on the test day """
+    return Observation(adds.parse_metar(adds_response(metar_xml(hour, ceiling_ft, wind_speed_kt))))
+
+
+def test_ring_buffer_keeps_newest_observations_in_order():
+    station_history = history.StationHistory('CYYZ', size=2)
+    assert station_history.add([observation(21), observation(20)]) == 2
+    assert station_history.add([observation(21), observation(22)]) == 1
+    times = [obs['observation_time'] for obs in station_history._observations]
+    assert times == ['2018-10-02T21:00:00Z', '2018-10-02T22:00:00Z']
+
+
+def test_queries_fetch_only_reports_newer_than_the_head(monkeypatch):
+    clock = FakeClock()
+    reports = [adds_response(metar_xml(20), metar_xml(21), metar_xml(22)), adds_response(metar_xml(22, 1000))]
+    fetches = []
+
+    def fake_fetch(icao_code, **kwargs):
+        fetches.append(kwargs)
+        return reports.pop(0)
+    monkeypatch.setattr(helpers, 'fetch_aviation_gov_xml', fake_fetch)
+    station_history = history.StationHistory('CYYZ', clock=clock)
+    assert len(station_history.since(3)) == 3
+    assert len(station_history.since(2)) == 2
+    assert fetches == [{'hours': '3.00', 'most_recent': False}]
+    clock.now += 20 * 60
+    assert len(station_history.since(3)) == 3
+    assert fetches[1] == {'hours': '0.85', 'most_recent': False}
+
+
+def test_trends_compare_first_and_last_observations():
+    observations = [observation(20, 3000, 5), observation(21, 1500, 8), observation(22, 800, 20)]
+    assert weather.get_ceiling_trend(observations) == (3000, 800, 'falling')
+    assert weather.get_wind_trend(observations) == (('5', '270'), ('20', '270'), 'increasing')
+    assert weather.get_ceiling_trend(observations[:1]) == (None, None, None)
+
+
+def test_trend_intent_end_to_end_against_stub_server(monkeypatch):
+    now = datetime.utcnow()
+    body = adds_response(*[
+        metar_xml(0, ceiling_ft).replace(b'2018-10-02T00:00:00Z', observed.strftime('%Y-%m-%dT%H:%M:00Z').encode())
+        for observed, ceiling_ft in ((now - timedelta(hours=1), 500), (now, 2000))
+    ])
+    request = load_sample_dialogflow_request()
+    request['queryResult']['intent']['displayName'] = 'get_ceiling_trend'
+    history.history_cache.clear()
+    with StubServer([(200, body.replace(b'CYYZ', b'CYXU'), 0)]) as stub:
+        monkeypatch.setattr(upstream, 'adds', upstream.Upstream(stub.url, retries=0))
+        speech, text = api.build_response(request)
+        assert speech == (
+            'The ceiling at London is rising, from 500 feet to 2000 feet over the last {} hours.'
+            .format(responses.TREND_HOURS)
+        )
+        assert 'mostRecent' not in stub.requests[0]
+        assert stub.requests[0]['hoursBeforeNow'] == ['3.00']
+    history.history_cache.clear()
@@ -0,0 +1,67 @@
+""" Tests for the raw METAR decoder """
+
+import os
+from datetime import datetime
+import adds
+import metar
+from tests.helpers import get_data_directory
+
+
+NOW = datetime(2018, 10, 3)
+
+
+def load_fixture_dict():
+    """ Loads the ADDS-decoded METAR fixture """
+    with open(os.path.join(get_data_directory(), 'metar.txt'), 'rb') as fixture:
+        return adds.parse_metar(fixture.read())
+
+
+def test_decode_matches_adds_decoded_fields():
+    expected = load_fixture_dict()
+    decoded = metar.decode(expected['raw_text'], NOW)
+    for key in ('station_id', 'observation_time', 'temp_c', 'dewpoint_c', 'wind_dir_degrees',
+                'wind_speed_kt', 'visibility_statute_mi', 'sea_level_pressure_mb', 'wx_string',
+                'flight_category', 'metar_type', 'sky_conditions'):
+        assert decoded[key] == expected[key]
+    assert decoded['altim_in_hg'] == '29.95'
+    assert decoded['remarks'] == 'SF3ST5 SLP145'
+
+
+def test_decode_metric_report():
+    decoded = metar.decode(
+        'SPECI EGLL 311250Z AUTO VRB03G15MPS 300V040 9999 VCSH FEW040CB VV002 M02/M05 Q1013 NOSIG',
+        datetime(2018, 11, 2)
+    )
+    assert decoded['metar_type'] == 'SPECI'
+    assert decoded['observation_time'] == '2018-10-31T12:50:00Z'
+    assert decoded['wind_dir_degrees'] == 'VRB'
+    assert decoded['wind_speed_kt'] == '6'
+    assert decoded['wind_gust_kt'] == '29'
+    assert decoded['visibility_statute_mi'] == '6.21'
+    assert decoded['wx_string'] == 'VCSH'
+    assert decoded['temp_c'] == '-2.0'
+    assert decoded['dewpoint_c'] == '-5.0'
+    assert decoded['altim_in_hg'] == '29.91'
+    assert decoded['vert_vis_ft'] == '200'
+    assert decoded['flight_category'] == 'LIFR'
+
+
+def test_decode_resolves_previous_month():
+    decoded = metar.decode('KSFO 302356Z 29012KT 10SM CLR 18/M01 A3001', NOW)
+    assert decoded['observation_time'] == '2018-09-30T23:56:00Z'
+    assert decoded['visibility_statute_mi'] == '10.0'
+    assert decoded['sky_conditions'] == []
+    assert decoded['flight_category'] == 'VFR'
+
+
+def test_flight_category_thresholds():
+    assert metar.flight_category(None, None) == 'VFR'
+    assert metar.flight_category(3000, 10.0) == 'MVFR'
+    assert metar.flight_category(3100, 5.0) == 'MVFR'
+    assert metar.flight_category(900, 10.0) == 'IFR'
+    assert metar.flight_category(None, 2.5) == 'IFR'
+    assert metar.flight_category(None, 0.5) == 'LIFR'
+
+
+def test_decode_unreadable_report_returns_empty_dict():
+    assert metar.decode('not a metar') == {}
@@ -0,0 +1,59 @@
+""" Tests for per-request latency spans and cache counters """
+
+import json
+import logging
+import os
+import helpers
+import main as api
+import metrics
+import upstream
+from tests.helpers import get_data_directory, load_sample_dialogflow_request
+from tests.stub_server import StubServer
+
+
+def test_spans_and_counters_are_attributed_to_the_request():
+    with metrics.request(intent='test') as request_metrics:
+        with metrics.span('fetch'):
+            pass
+        with metrics.span('fetch'):
+            pass
+        metrics.count('metar_cache.hit')
+        metrics.count('metar_cache.hit')
+    fields = request_metrics.fields()
+    assert fields['intent'] == 'test'
+    assert fields['metar_cache.hit'] == 2
+    assert 0 <= fields['fetch_ms'] <= fields['total_ms']
+
+
+def test_spans_outside_a_request_are_not_recorded():
+    with metrics.span('fetch'):
+        pass
+    with metrics.request() as request_metrics:
+        pass
+    assert 'fetch_ms' not in request_metrics.fields()
+
+
+def test_histogram_reports_percentiles():
+    histogram = metrics.LatencyHistogram(size=100)
+    for millis in range(1, 101):
+        histogram.record('fetch', millis / 1000.0)
+    assert histogram.percentiles('fetch') == {50: 51.0, 95: 96.0, 99: 100.0}
+    assert histogram.summary()['fetch']['count'] == 100
+    assert histogram.percentiles('render') == {}
+
+
+def test_build_response_logs_stage_timings_and_cache_outcome(monkeypatch, caplog):
+    metar = open(os.path.join(get_data_directory(), 'metar.txt'), 'rb').read()
+    helpers.metar_cache.clear()
+    caplog.set_level(logging.INFO, logger='flytoday.metrics')
+    with StubServer([(200, metar.replace(b'CYYZ', b'CYXU'), 0)]) as stub:
+        monkeypatch.setattr(upstream, 'adds', upstream.Upstream(stub.url, retries=0))
+        api.build_response(load_sample_dialogflow_request())
+        api.build_response(load_sample_dialogflow_request())
+    first, second = [record.metrics for record in caplog.records]
+    assert first['intent'] == 'get_flight_category' and first['station'] == 'CYXU'
+    assert first['metar_cache.miss'] == 1 and 'metar_cache.hit' not in first
+    assert {'dialogflow_ms', 'fetch_ms', 'parse_ms', 'render_ms'} <= set(first)
+    assert second['metar_cache.hit'] == 1 and 'fetch_ms' not in second
+    assert json.loads(caplog.records[1].getMessage()) == second
+    helpers.metar_cache.clear()
@@ -0,0 +1,77 @@
+""" Tests for the typed Observation record """
+
+import os
+import pytest
+import adds
+import responses
+import weather
+from observation import Observation
+from tests.helpers import get_data_directory
+from tests.helpers import normalize_relative_dates_brackets as normalize
+
+
+def load_fixture_dict():
+    """ Loads the METAR fixture as a parsed dictionary """
+    with open(os.path.join(get_data_directory(), 'metar.txt'), 'rb') as metar:
+        return adds.parse_metar(metar.read())
+
+
+def test_observation_is_a_dict_compatible_view():
+    metar_dict = load_fixture_dict()
+    observation = Observation(metar_dict)
+    assert observation == metar_dict
+    assert dict(observation) == metar_dict
+    assert len(observation) == len(metar_dict)
+    assert 'temp_c' in observation
+    assert 'wind_gust_kt' not in observation
+    assert observation.get('wind_gust_kt') is None
+
+
+def test_observation_parses_numeric_fields_once():
+    observation = Observation(load_fixture_dict())
+    assert observation.temp_c == 13.0
+    assert observation.wind_speed_kt == 8
+    assert observation.get_value('altim_in_hg') == 29.949802
+    assert observation.sky_conditions == (('SCT', 200), ('OVC', 400))
+
+
+def test_observation_keeps_text_that_does_not_round_trip():
+    observation = Observation({'visibility_statute_mi': '6.0+', 'wind_dir_degrees': 'VRB', 'sky_conditions': []})
+    assert observation['visibility_statute_mi'] == '6.0+'
+    assert observation['wind_dir_degrees'] == 'VRB'
+
+
+def test_observation_is_read_only():
+    observation = Observation(load_fixture_dict())
+    with pytest.raises(AttributeError):
+        observation.temp_c = 1.0
+    with pytest.raises(TypeError):
+        observation['temp_c'] = '1.0'
+
+
+def test_weather_accessors_match_dicts_and_are_memoized():
+    metar_dict = load_fixture_dict()
+    observation = Observation(metar_dict)
+    for accessor in (weather.get_visibility, weather.get_temperature, weather.get_dewpoint,
+                     weather.get_elevation, weather.get_metar_raw, weather.get_flight_category,
+                     weather.get_sky_conditions, weather.get_wind_information, weather.get_altimeter):
+        assert accessor(observation) == accessor(metar_dict)
+    assert weather.get_temperature(observation) is weather.get_temperature(observation)
+
+
+def test_responses_render_the_same_from_observations():
+    metar_dict = load_fixture_dict()
+    observation = Observation(metar_dict)
+    speech, text = responses.get_metar_parsed(observation, 'Test Airport')
+    expected_speech, expected_text = responses.get_metar_parsed(metar_dict, 'Test Airport')
+    assert normalize(speech) == normalize(expected_speech)
+    assert normalize(text) == normalize(expected_text)
+
+
+def test_observation_round_trips_through_bytes():
+    metar_dict = load_fixture_dict()
+    metar_dict['quality_control_flags'] = 'auto=TRUE'
+    observation = Observation(metar_dict)
+    restored = Observation.from_bytes(observation.to_bytes())
+    assert restored == metar_dict
+    assert Observation.from_bytes(Observation({'station_id': 'CYYZ'}).to_bytes()) == {'station_id': 'CYYZ'}
@@ -0,0 +1,33 @@
+""" Tests for the built-in phonetic reader """
+
+import random
+import pytest
+import phonetic_alphabet
+import phonetic
+import responses
+
+
+def test_reads_exactly_as_phonetic_alphabet():
+    generator = random.Random(5)
+    characters = 'ABCXYZabcxyz0123456789.,;:?- '
+    samples = ['', ' ', 'CYYZ', 'x-ray', '29.95', '-1.0', '..', ' 1  2 ', 'None', '0.25', '10.0']
+    samples += [''.join(generator.choice(characters) for _ in range(generator.randint(1, 12))) for _ in range(2000)]
+    for sample in samples:
+        expected = phonetic_alphabet.read(sample)
+        assert phonetic.read(sample) == expected
+        assert phonetic.read_title(sample) == expected.title()
+        assert phonetic.read_number(sample) == responses.replace_point(expected).title()
+
+
+def test_reads_non_strings_as_str():
+    assert phonetic.read(1) == phonetic_alphabet.read(1)
+    assert phonetic.read_number(1.0) == 'One Point Zero'
+    assert phonetic.read_title(None) == phonetic_alphabet.read(None).title()
+
+
+@pytest.mark.parametrize('text', ['29.95"', 'é', 'A/B', '1\n'])
+def test_rejects_unsupported_text(text):
+    with pytest.raises(phonetic_alphabet.main.NonSupportedTextException):
+        phonetic_alphabet.read(text)
+    with pytest.raises(phonetic.UnsupportedTextError):
+        phonetic.read(text)
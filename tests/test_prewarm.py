@@ -0,0 +1,89 @@
+""" Tests for the hot-airport pre-warmer, against a local fake upstream """
+
+import os
+from datetime import datetime
+import helpers
+import main
+import prewarm
+import upstream
+from tests.helpers import get_data_directory, load_sample_dialogflow_request
+from tests.stub_server import StubServer
+
+
+def bulk_metars(query):
+    """ Serves one copy of the METAR fixture per requested station """
+    metar = open(os.path.join(get_data_directory(), 'metar.txt'), 'rb').read()
+    stations = query['stationString'][0].split(',')
+    body = b''.join(metar.replace(b'CYYZ', station.encode()) for station in stations)
+    return 200, b'<response><data>' + body + b'</data></response>', 0
+
+
+def test_popularity_ranks_and_decays():
+    popularity = prewarm.StationPopularity(decay=0.5)
+    for icao_code in ['cyyz', 'CYYZ', 'CYYZ', 'KSFO', 'KSFO', 'CYXU']:
+        popularity.record(icao_code)
+    assert popularity.top(2) == ['CYYZ', 'KSFO']
+    for _ in range(7):
+        popularity.age()
+    assert popularity.top(5) == ['CYYZ', 'KSFO']
+
+
+def test_next_refresh_is_after_the_issuance_minute():
+    assert prewarm.next_refresh(datetime(2018, 10, 2, 21, 10), 55) == datetime(2018, 10, 2, 21, 55)
+    assert prewarm.next_refresh(datetime(2018, 10, 2, 21, 55), 55) == datetime(2018, 10, 2, 22, 55)
+    assert prewarm.next_refresh(datetime(2018, 10, 2, 23, 58), 55) == datetime(2018, 10, 3, 0, 55)
+
+
+def test_refresh_warms_top_stations_in_one_request(monkeypatch):
+    popularity = prewarm.StationPopularity()
+    for icao_code in ['CYYZ', 'CYYZ', 'KSFO', 'CYXU']:
+        popularity.record(icao_code)
+    helpers.metar_cache.clear()
+    with StubServer(bulk_metars) as stub:
+        monkeypatch.setattr(upstream, 'adds', upstream.Upstream(stub.url, retries=0))
+        refreshed = prewarm.Prewarmer(popularity, top_stations=2).refresh()
+        assert sorted(refreshed) == ['CYYZ', 'KSFO']
+        assert stub.requests[0]['stationString'] == ['CYYZ,KSFO']
+        assert helpers.get_metar('KSFO')['station_id'] == 'KSFO'
+        assert len(stub.requests) == 1
+    helpers.metar_cache.clear()
+
+
+def test_run_refreshes_at_the_scheduled_minute():
+    prewarmer = prewarm.Prewarmer(
+        prewarm.StationPopularity(), minute=55, clock=lambda: datetime(2018, 10, 2, 21, 54, 59, 950000)
+    )
+    refreshes = []
+
+    def refresh():
+        refreshes.append(1)
+        prewarmer._stop.set()
+
+    prewarmer.refresh = refresh
+    prewarmer.start()
+    prewarmer._thread.join(5)
+    assert refreshes == [1]
+
+
+def test_webhook_requests_are_counted():
+    prewarm.station_popularity.age()
+    main._read_request(load_sample_dialogflow_request())
+    assert 'CYXU' in prewarm.station_popularity.top(1000)
+
+
+def test_pinned_stations_never_decay_away():
+    popularity = prewarm.StationPopularity(decay=0.5)
+    popularity.pin('cyyz')
+    popularity.record('KSFO')
+    for _ in range(20):
+        popularity.age()
+    assert popularity.top(5) == ['CYYZ']
+
+
+def test_webhook_process_runs_the_prewarmer(monkeypatch):
+    started = []
+    monkeypatch.setattr(prewarm, '_prewarmer', None)
+    monkeypatch.setattr(prewarm.Prewarmer, 'start', lambda self: started.append(self))
+    first = prewarm.start_in_process()
+    assert prewarm.start_in_process() is first
+    assert started == [first] and first.popularity is prewarm.station_popularity
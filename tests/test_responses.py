@@ -5,6 +5,8 @@ from tests.helpers import get_data_directory
 from tests.helpers import normalize_relative_dates_brackets as normalize
 import helpers
 import responses
+import adds
+from observation import Observation
 from bs4 import BeautifulSoup
 import pytest
 
@@ -82,3 +84,31 @@ def test_can_get_metar_parsed():
     expected_text = expected[1]
     assert normalize(speech) == normalize(expected_speech)
     assert normalize(text) == normalize(expected_text)
+
+
+def test_rendered_observations_are_cached():
+    """ Tests repeated renders of an observation are served from the render cache """
+    metar = open(os.path.join(get_data_directory(), 'metar.txt'), 'rb').read()
+    observation = Observation(adds.parse_metar(metar))
+    responses.render_cache.clear()
+    first = responses.get_flight_category(observation, 'Test Airport')
+    assert len(responses.render_cache) == 1
+    assert responses.get_flight_category(observation, 'Test Airport') == first
+    responses.get_flight_category(observation, 'Other Airport')
+    assert len(responses.render_cache) == 2
+    responses.render_cache.clear()
+
+
+def test_cached_metar_parsed_fills_relative_time_late(monkeypatch):
+    """ Tests the relative time is substituted into cached renders on every call """
+    metar = open(os.path.join(get_data_directory(), 'metar.txt'), 'rb').read()
+    observation = Observation(adds.parse_metar(metar))
+    responses.render_cache.clear()
+    monkeypatch.setattr(responses.weather, 'get_time', lambda metar_dict: ('2100', '5 minutes ago'))
+    speech, text = responses.get_metar_parsed(observation, 'Test Airport')
+    assert '(5 minutes ago)' in speech and '(5 minutes ago)' in text
+    monkeypatch.setattr(responses.weather, 'get_time', lambda metar_dict: ('2100', '2 hours ago'))
+    speech, text = responses.get_metar_parsed(observation, 'Test Airport')
+    assert '(2 hours ago)' in speech and '(2 hours ago)' in text
+    assert responses.RELATIVE_TIME_SLOT not in speech
+    responses.render_cache.clear()
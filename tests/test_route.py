@@ -0,0 +1,157 @@
+""" Tests for route briefings under a latency budget """
+
+import os
+import time
+import pytest
+import adds
+import helpers
+import main as api
+import metrics
+import responses
+import route
+import upstream
+from observation import Observation, StaleObservation
+from tests.helpers import get_data_directory, load_sample_dialogflow_request
+from tests.stub_server import StubServer
+
+
+# Stations answered too slowly for the budget (one per test, as late fetches still fill the cache)
+SLOW_STATIONS = ('KSLW', 'KSLO')
+
+
+def stub_responses():
+    """ Serves the fixture METAR for every requested station, slowly if any is in SLOW_STATIONS """
+    metar = open(os.path.join(get_data_directory(), 'metar.txt'), 'rb').read()
+    element = metar[metar.index(b'<METAR>'):metar.index(b'</METAR>') + len(b'</METAR>')]
+
+    def respond(query):
+        icao_codes = query['stationString'][0].split(',')
+        body = b'<response><data>' + b''.join(
+            element.replace(b'CYYZ', icao_code.encode()) for icao_code in icao_codes
+        ) + b'</data></response>'
+        return 200, body, 1.0 if set(icao_codes) & set(SLOW_STATIONS) else 0.1
+    return respond
+
+
+def route_request(*airports):
+    """ Builds a route briefing request from (parameter, ICAO code, name) tuples """
+    request = load_sample_dialogflow_request()
+    request['queryResult']['intent']['displayName'] = 'get_route_briefing'
+    parameters = request['queryResult']['parameters']
+    for parameter, icao_code, name in airports:
+        airport = {'ICAO': icao_code, 'name': name}
+        if parameter in ('waypoints', 'alternates'):
+            parameters.setdefault(parameter, []).append(airport)
+        else:
+            parameters[parameter] = airport
+    return request
+
+
+def test_route_is_read_in_order():
+    request = route_request(
+        ('alternates', 'CYKF', 'Waterloo'), ('destination', 'CYYZ', 'Toronto'),
+        ('departure', 'CYXU', 'London'), ('waypoints', 'CYHM', 'Hamilton'),
+    )
+    assert helpers.get_route_from_dialogflow(request) == [
+        ('Departure', 'CYXU', 'London'), ('Waypoint', 'CYHM', 'Hamilton'),
+        ('Destination', 'CYYZ', 'Toronto'), ('Alternate', 'CYKF', 'Waterloo'),
+    ]
+
+
+def test_route_fetches_in_one_bulk_request(monkeypatch):
+    helpers.metar_cache.clear()
+    with StubServer(stub_responses()) as stub:
+        monkeypatch.setattr(upstream, 'adds', upstream.Upstream(stub.url, retries=0))
+        briefing = route.get_route_briefing(
+            [('Departure', 'CYXU', 'London'), ('Waypoint', 'CYHM', 'Hamilton'),
+             ('Destination', 'CYYZ', 'Toronto'), ('Alternate', 'cyxu', 'London')],
+            budget=0.5,
+        )
+        assert [query['stationString'] for query in stub.requests] == [['CYXU,CYHM,CYYZ']]
+    assert [observation['station_id'] for _, _, _, observation in briefing] == ['CYXU', 'CYHM', 'CYYZ', 'CYXU']
+    helpers.metar_cache.clear()
+
+
+def test_route_reports_cached_stations_when_the_upstream_is_too_slow(monkeypatch):
+    helpers.metar_cache.clear()
+    with StubServer(stub_responses()) as stub:
+        monkeypatch.setattr(upstream, 'adds', upstream.Upstream(stub.url, retries=0))
+        helpers.get_metars(['CYXU', 'CYYZ'])
+        started = time.monotonic()
+        briefing = route.get_route_briefing(
+            [('Departure', 'CYXU', 'London'), ('Waypoint', 'CYHM', 'Hamilton'),
+             ('Destination', 'CYYZ', 'Toronto'), ('Alternate', SLOW_STATIONS[0], 'Slow')],
+            budget=0.5,
+        )
+        elapsed = time.monotonic() - started
+        assert stub.requests[-1]['stationString'] == ['CYHM,' + SLOW_STATIONS[0]]
+    assert elapsed < 0.8
+    assert [observation is not None for _, _, _, observation in briefing] == [True, False, True, False]
+    helpers.metar_cache.clear()
+
+
+def test_route_briefing_intent_reports_stations_that_returned(monkeypatch):
+    helpers.metar_cache.clear()
+    monkeypatch.setattr(route, 'ROUTE_BUDGET', 0.5)
+    request = route_request(
+        ('departure', 'CYXU', 'London'), ('destination', 'CYYZ', 'Toronto'), ('alternates', SLOW_STATIONS[1], 'Slow')
+    )
+    with StubServer(stub_responses()) as stub:
+        monkeypatch.setattr(upstream, 'adds', upstream.Upstream(stub.url, retries=0))
+        helpers.get_metars(['CYXU', 'CYYZ'])
+        speech, text = api.build_response(request)
+    assert speech == (
+        'Departure, London: LIFR, winds 340 at 8 knots, ceiling 400 feet. '
+        'Destination, Toronto: LIFR, winds 340 at 8 knots, ceiling 400 feet. '
+        'No report came back in time for Slow.'
+    )
+    helpers.metar_cache.clear()
+
+
+def test_route_needs_departure_and_destination(monkeypatch):
+    monkeypatch.setattr(route, 'get_route_briefing', lambda *args: pytest.fail('fetched an invalid route'))
+    request = route_request(('departure', 'CYXU', 'London'))
+    assert api.build_response(request)[0] == helpers.get_standard_error_message()
+
+
+def test_route_briefing_tells_the_age_of_stale_reports(monkeypatch):
+    observed = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(time.time() - 2 * 60 * 60))
+    metar = open(os.path.join(get_data_directory(), 'metar.txt'), 'rb').read()
+    metar = metar.replace(b'CYYZ', b'CYXU').replace(b'2018-10-02T21:00:00Z', observed.encode())
+    helpers.metar_cache.clear()
+    helpers.metar_cache.set('CYXU', StaleObservation.copy_of(Observation(adds.parse_metar(metar))))
+    request = route_request(('departure', 'CYXU', 'London'), ('destination', 'CYYZ', 'Toronto'))
+    with StubServer([(503, b'', 0)]) as stub:
+        monkeypatch.setattr(upstream, 'adds', upstream.Upstream(stub.url, retries=0))
+        speech, text = api.build_response(request)
+        # The stale report is fetched again with the others
+        assert stub.requests[0]['stationString'] == ['CYXU,CYYZ']
+    assert speech == (
+        'Departure, London: LIFR, winds 340 at 8 knots, ceiling 400 feet. '
+        "That's from its last report, 2 hours ago. "
+        'No report came back in time for Toronto.'
+    )
+    assert text.splitlines()[0].endswith(' ⚠️ last known report, 2 hours ago')
+    helpers.metar_cache.clear()
+
+
+def test_route_fetch_errors_are_logged_and_counted(monkeypatch, caplog):
+    helpers.metar_cache.clear()
+
+    def broken_fetch(icao_codes):
+        raise ValueError('unreadable response')
+    monkeypatch.setattr(helpers, 'get_metars', broken_fetch)
+    with metrics.request() as request_metrics:
+        assert route.get_route_metars(['CYXU', 'CYYZ'], budget=0.5) == {}
+    assert request_metrics.counters['route.error'] == 1
+    assert 'unreadable response' in caplog.text
+
+
+def test_route_points_without_wind_say_so():
+    observation = Observation({
+        'station_id': 'CYXU', 'flight_category': 'VFR',
+        'sky_conditions': [{'sky_cover': 'BKN', 'cloud_base_ft_agl': '3000'}],
+    })
+    speech, text = responses.get_route_briefing([('Departure', 'CYXU', 'London', observation)], 'London')
+    assert speech == 'Departure, London: VFR, no wind reported, ceiling 3000 feet.'
+    assert 'None' not in text
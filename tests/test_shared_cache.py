@@ -0,0 +1,222 @@
+""" Tests for the shared second-level METAR cache """
+
+import os
+import socketserver
+import threading
+import time
+import pytest
+import adds
+import helpers
+import main as api
+import shared_cache
+import upstream
+from observation import Observation, StaleObservation
+from tests.helpers import get_data_directory, load_sample_dialogflow_request
+from tests.stub_server import StubServer
+
+
+class RedisStub:
+    """A local stand-in for a Redis server: MGET, SET (with PX), AUTH and SELECT
+
+    Commands named in failing get an error reply.
+    """
+
+    def __init__(self, failing=()):
+        self.data = {}
+        self.commands = []
+        self.failing = set(failing)
+        stub = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def read_command(self):
+                line = self.rfile.readline()
+                if not line:
+                    return None
+                arguments = []
+                for _ in range(int(line[1:])):
+                    length = int(self.rfile.readline()[1:])
+                    arguments.append(self.rfile.read(length + 2)[:-2])
+                return arguments
+
+            def handle(self):
+                while True:
+                    command = self.read_command()
+                    if command is None:
+                        return
+                    stub.commands.append(command)
+                    name = command[0].upper()
+                    if name in stub.failing:
+                        reply = b'-ERR ' + name + b' failed\r\n'
+                    elif name == b'MGET':
+                        reply = b'*%d\r\n' % (len(command) - 1)
+                        for key in command[1:]:
+                            value = stub.data.get(key)
+                            reply += b'$-1\r\n' if value is None else b'$%d\r\n%s\r\n' % (len(value), value)
+                    elif name == b'SET':
+                        stub.data[command[1]] = command[2]
+                        reply = b'+OK\r\n'
+                    elif name in (b'AUTH', b'SELECT'):
+                        reply = b'+OK\r\n'
+                    else:
+                        reply = b'-ERR unknown command\r\n'
+                    self.wfile.write(reply)
+
+        self.server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def fixture_metar(observation_time):
+    """ Returns the METAR fixture as an ADDS response, observed at another time """
+    metar = open(os.path.join(get_data_directory(), 'metar.txt'), 'rb').read()
+    return metar.replace(b'2018-10-02T21:00:00Z', observation_time.encode())
+
+
+def test_sqlite_backend_expires_entries(tmp_path):
+    now = [1000.0]
+    backend = shared_cache.SQLiteBackend(str(tmp_path / 'shared.db'), clock=lambda: now[0])
+    backend.set_many({'a': (b'1', 10), 'b': (b'2', 20)})
+    assert backend.get_many(['a', 'b', 'c']) == {'a': b'1', 'b': b'2'}
+    now[0] += 10
+    assert backend.get_many(['a', 'b']) == {'b': b'2'}
+    # A second connection (another process) sees the same entries
+    backend.set('a', b'3', ttl=10)
+    other = shared_cache.SQLiteBackend(str(tmp_path / 'shared.db'), clock=lambda: now[0])
+    assert other.get('a') == b'3'
+    assert shared_cache.open_backend('sqlite://' + str(tmp_path / 'shared.db')).path == str(tmp_path / 'shared.db')
+
+
+def test_entries_of_one_batch_keep_their_own_lifetime(tmp_path):
+    now = [1000.0]
+    backend = shared_cache.SQLiteBackend(str(tmp_path / 'shared.db'), clock=lambda: now[0])
+    shared = shared_cache.SharedMetarCache(backend, stale_ttl=60, clock=lambda: now[0])
+    shared.set_many({
+        'CYYZ': (Observation({'station_id': 'CYYZ'}), 1010.0),
+        'KSFO': (Observation({'station_id': 'KSFO'}), 1600.0),
+    })
+    now[0] += 70
+    assert sorted(shared.get_many(['CYYZ', 'KSFO'])) == ['KSFO']
+
+
+def test_redis_backend_round_trips_through_a_local_stand_in():
+    with RedisStub() as stub:
+        backend = shared_cache.open_backend('redis://:secret@127.0.0.1:{}/2'.format(stub.port))
+        backend.set_many({'a': (b'\x00\r\n1', 1.5), 'b': (b'', 2)})
+        assert backend.get_many(['a', 'b', 'c']) == {'a': b'\x00\r\n1', 'b': b''}
+    assert stub.commands[:2] == [[b'AUTH', b'secret'], [b'SELECT', b'2']]
+    assert [b'SET', b'a', b'\x00\r\n1', b'PX', b'1500'] in stub.commands
+    assert [b'SET', b'b', b'', b'PX', b'2000'] in stub.commands
+
+
+def test_redis_error_replies_leave_no_reply_unread():
+    with RedisStub(failing=[b'AUTH']) as stub:
+        backend = shared_cache.open_backend('redis://:wrong@127.0.0.1:{}/2'.format(stub.port))
+        with pytest.raises(shared_cache.RedisError):
+            backend.get_many(['a'])
+        assert backend._socket is None
+        assert shared_cache.SharedMetarCache(backend).get('CYYZ') == (None, None)
+        stub.failing = set()
+        # An error mid-pipeline: the replies after it are read, not left for the next command
+        backend.set('a', b'1', ttl=10)
+        with pytest.raises(shared_cache.RedisError):
+            backend.execute([('SET', 'b', b'2'), ('INCR', 'a'), ('SET', 'c', b'3')])
+        assert backend.get_many(['a', 'b', 'c']) == {'a': b'1', 'b': b'2', 'c': b'3'}
+
+
+class FixedBackend(shared_cache.CacheBackend):
+    """ A backend returning fixed (possibly malformed) entries """
+
+    def __init__(self, entries):
+        self.entries = entries
+
+    def get_many(self, keys):
+        return self.entries
+
+    def set_many(self, items):
+        self.entries.update((key, value) for key, (value, _) in items.items())
+
+
+def test_malformed_entries_read_as_misses():
+    shared = shared_cache.SharedMetarCache(FixedBackend({'metar:CYYZ': 5, 'metar:CYXU': b'\x00'}))
+    assert shared.get_many(['CYYZ', 'CYXU']) == {}
+
+
+def test_incomplete_backends_cannot_be_created():
+    class ReadOnlyBackend(shared_cache.CacheBackend):
+        def get_many(self, keys):
+            return {}
+
+    with pytest.raises(TypeError):
+        ReadOnlyBackend()
+
+
+def test_unreachable_backend_reads_as_a_miss():
+    with RedisStub() as stub:
+        port = stub.port
+    shared = shared_cache.SharedMetarCache(shared_cache.RedisBackend('127.0.0.1', port))
+    assert shared.get('CYYZ') == (None, None)
+    shared.set('CYYZ', Observation({'station_id': 'CYYZ'}), time.time() + 60)
+
+
+def test_cold_instance_is_served_from_the_shared_tier(tmp_path, monkeypatch):
+    now = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+    shared = shared_cache.SharedMetarCache(shared_cache.SQLiteBackend(str(tmp_path / 'shared.db')))
+    monkeypatch.setattr(helpers, '_shared_metar_cache', shared)
+    helpers.metar_cache.clear()
+    with StubServer([(200, fixture_metar(now), 0)]) as stub:
+        monkeypatch.setattr(upstream, 'adds', upstream.Upstream(stub.url, retries=0))
+        assert helpers.get_metar('CYYZ', fields=['flight_category'])['flight_category'] == 'LIFR'
+        # Published in the background, fully decoded
+        for _ in range(100):
+            if shared.get('CYYZ')[0] is not None:
+                break
+            time.sleep(0.01)
+        observation, fresh_until = shared.get('CYYZ')
+        assert 'CYYZ 022100Z' in observation['raw_text']
+        assert fresh_until > time.time()
+        # A cold start loses the in-process tier only
+        helpers.metar_cache.clear()
+        assert helpers.get_metar('CYYZ')['observation_time'] == now
+        assert helpers.get_metars(['CYYZ'])['CYYZ']['observation_time'] == now
+        assert len(stub.requests) == 1
+    helpers.metar_cache.clear()
+
+
+def test_stale_reports_are_served_with_their_age_while_revalidated(tmp_path, monkeypatch):
+    old = '2018-10-02T21:00:00Z'
+    now = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+    shared = shared_cache.SharedMetarCache(shared_cache.SQLiteBackend(str(tmp_path / 'shared.db')))
+    shared.set('CYXU', Observation(adds.parse_metar(fixture_metar(old).replace(b'CYYZ', b'CYXU'))),
+               time.time() - 1)
+    monkeypatch.setattr(helpers, '_shared_metar_cache', shared)
+    helpers.metar_cache.clear()
+    helpers.last_known_good.clear()
+    with StubServer([(200, fixture_metar(now).replace(b'CYYZ', b'CYXU'), 0.2)]) as stub:
+        monkeypatch.setattr(upstream, 'adds', upstream.Upstream(stub.url, retries=0))
+        started = time.monotonic()
+        speech, text = api.build_response(load_sample_dialogflow_request())
+        assert time.monotonic() - started < 0.2
+        assert "that's from the last one we have" in speech
+        stale = helpers.get_metar('CYXU')
+        assert isinstance(stale, StaleObservation) and stale['observation_time'] == old
+        # Not remembered as the station's last known good report
+        assert helpers.last_known_good.get('CYXU') is None
+        for _ in range(100):
+            if helpers.metar_cache.get('CYXU')['observation_time'] == now:
+                break
+            time.sleep(0.01)
+        current = helpers.get_metar('CYXU')
+        assert not isinstance(current, StaleObservation) and current['observation_time'] == now
+        assert shared.get('CYXU')[0]['observation_time'] == now
+        assert len(stub.requests) == 1
+    helpers.metar_cache.clear()
+    helpers.last_known_good.clear()
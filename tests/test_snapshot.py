@@ -0,0 +1,102 @@
+""" Tests for the memory-mapped METAR snapshot store """
+
+import gzip
+import os
+import time
+from bs4 import BeautifulSoup
+import helpers
+import snapshot
+from tests.helpers import get_data_directory
+from tests.stub_server import StubServer
+
+
+CSV_BULK = '''No errors
+No warnings
+12 ms
+data source=metars
+2 results
+raw_text,station_id,observation_time,latitude,longitude,temp_c,dewpoint_c,wind_dir_degrees,wind_speed_kt,\
+sky_cover,cloud_base_ft_agl,sky_cover,cloud_base_ft_agl,flight_category,elevation_m
+KSFO 021856Z 29012KT 10SM FEW015 18/M01 A3001,KSFO,2018-10-02T18:56:00Z,37.62,-122.37,18.0,-1.0,290,12,\
+FEW,1500,,,VFR,3.0
+CYXU 021900Z 00000KT 15SM CLR 12/04 A2998,CYXU,2018-10-02T19:00:00Z,43.03,-81.15,12.0,4.0,0,0,CLR,,,,VFR,278.0
+'''
+
+
+def fixture_metar(station, observation_time='2018-10-02T21:00:00Z'):
+    """ Returns the METAR fixture element for another station and time """
+    metar = open(os.path.join(get_data_directory(), 'metar.txt'), 'rb').read()
+    return metar.replace(b'CYYZ', station.encode()).replace(
+        b'2018-10-02T21:00:00Z', observation_time.encode()
+    )
+
+
+def write_xml_bulk(path, stations):
+    """ Writes a gzipped ADDS bulk XML file """
+    with gzip.open(path, 'wb') as bulk:
+        bulk.write(b'<response><data>' + b''.join(fixture_metar(*station) for station in stations) +
+                   b'</data></response>')
+
+
+def test_snapshot_from_gzipped_xml(tmp_path):
+    bulk = str(tmp_path / 'metars.cache.xml.gz')
+    write_xml_bulk(bulk, [('CYYZ',), ('KSFO',), ('CYXU',)] + [('K%03d' % index,) for index in range(50)])
+    path = str(tmp_path / 'snapshot.bin')
+    assert snapshot.build_snapshot(snapshot.iter_bulk_metars(bulk), path) == 53
+    store = snapshot.SnapshotStore(path)
+    assert len(store) == 53
+    assert store.get('cyyz')['temp_c'] == '13.0'
+    assert store.get('K049')['station_id'] == 'K049'
+    assert store.get('KJFK') is None
+    expected = helpers.parse_metar_to_dict(BeautifulSoup(fixture_metar('KSFO'), features='html.parser'))
+    assert store.get('KSFO') == expected
+
+
+def test_snapshot_from_gzipped_csv(tmp_path):
+    bulk = str(tmp_path / 'metars.cache.csv.gz')
+    with gzip.open(bulk, 'wt') as csv_bulk:
+        csv_bulk.write(CSV_BULK)
+    path = str(tmp_path / 'snapshot.bin')
+    assert snapshot.build_snapshot(snapshot.iter_bulk_metars(bulk), path) == 2
+    store = snapshot.SnapshotStore(path)
+    assert store.get('KSFO')['sky_conditions'] == [{'cloud_base_ft_agl': '1500', 'sky_cover': 'FEW'}]
+    assert store.get('CYXU')['sky_conditions'] == []
+    assert store.get('CYXU')['elevation_m'] == '278.0'
+
+
+def test_newest_report_wins_and_replaced_snapshots_are_remapped(tmp_path):
+    bulk = str(tmp_path / 'metars.cache.xml')
+    with open(bulk, 'wb') as xml_bulk:
+        xml_bulk.write(b'<response><data>' + fixture_metar('CYYZ', '2018-10-02T22:00:00Z') +
+                       fixture_metar('CYYZ', '2018-10-02T21:00:00Z') + b'</data></response>')
+    path = str(tmp_path / 'snapshot.bin')
+    snapshot.build_snapshot(snapshot.iter_bulk_metars(bulk), path)
+    store = snapshot.SnapshotStore(path, check_interval=0)
+    assert store.get('CYYZ')['observation_time'] == '2018-10-02T22:00:00Z'
+    snapshot.build_snapshot([{'station_id': 'CYYZ', 'observation_time': '2018-10-02T23:00:00Z'}], path)
+    assert store.get('CYYZ')['observation_time'] == '2018-10-02T23:00:00Z'
+
+
+def test_get_metar_serves_recent_snapshot_reports(tmp_path, monkeypatch):
+    path = str(tmp_path / 'snapshot.bin')
+    now = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+    snapshot.build_snapshot([
+        {'station_id': 'CYYZ', 'observation_time': now, 'sky_conditions': []},
+        {'station_id': 'CYXU', 'observation_time': '2018-10-02T21:00:00Z', 'sky_conditions': []},
+    ], path)
+    monkeypatch.setattr(helpers, 'SNAPSHOT_PATH', path)
+    monkeypatch.setattr(helpers, '_snapshot_store', None)
+    monkeypatch.setattr(helpers, 'fetch_aviation_gov_xml', lambda icao_code, **kwargs: None)
+    helpers.metar_cache.clear()
+    assert helpers.get_metar('CYYZ')['observation_time'] == now
+    assert helpers.get_metar('CYXU') == {}
+    helpers.metar_cache.clear()
+
+
+def test_refresh_snapshot_downloads_from_local_stub(tmp_path):
+    body = gzip.compress(b'<response><data>' + fixture_metar('CYYZ') + b'</data></response>')
+    path = str(tmp_path / 'snapshot.bin')
+    with StubServer([(200, body, 0)]) as stub:
+        assert snapshot.refresh_snapshot(path, stub.url + '/metars.cache.xml.gz') == 1
+    assert snapshot.SnapshotStore(path).get('CYYZ')['station_id'] == 'CYYZ'
+    assert os.listdir(str(tmp_path)) == ['snapshot.bin']
@@ -0,0 +1,42 @@
+""" Tests that heavy dependencies stay off the cold-start import path """
+
+import os
+import subprocess
+import sys
+
+
+SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'src')
+
+
+def modules_loaded_by(code):
+    """ Returns the top-level package names loaded after running code in a fresh interpreter """
+    script = code + '\nimport sys\nprint(" ".join(sorted({m.split(".")[0] for m in sys.modules})))'
+    output = subprocess.check_output([sys.executable, '-c', script], cwd=SRC, universal_newlines=True)
+    return set(output.split())
+
+
+def test_importing_main_defers_heavy_dependencies():
+    loaded = modules_loaded_by('import main')
+    for heavy in ('requests', 'bs4', 'ruamel', 'dateparser', 'timeago', 'phonetic_alphabet', 'asyncio'):
+        assert heavy not in loaded
+
+
+def test_rendering_a_flight_category_skips_date_and_phonetic_libraries():
+    loaded = modules_loaded_by(
+        'import responses\n'
+        'responses.get_flight_category({"flight_category": "VFR"}, "London")'
+    )
+    assert 'ruamel' in loaded
+    assert 'dateparser' not in loaded
+    assert 'phonetic_alphabet' not in loaded
+
+
+def test_unconfigured_shared_cache_is_never_imported():
+    loaded = modules_loaded_by(
+        'import os\n'
+        'os.environ.pop("SHARED_CACHE_URL", None)\n'
+        'import helpers\n'
+        'assert helpers._shared_cache() is None'
+    )
+    assert 'shared_cache' not in loaded
+    assert 'sqlite3' not in loaded
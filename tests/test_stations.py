@@ -0,0 +1,142 @@
+""" Tests for the station spatial index and nearest-airport intents """
+
+import os
+import random
+import pytest
+import helpers
+import main as api
+import stations
+import upstream
+from tests.helpers import get_data_directory, load_sample_dialogflow_request
+from tests.stub_server import StubServer
+
+
+def brute_force_nearest(station_list, latitude, longitude, count):
+    """ Returns the ICAO codes of the closest stations by checking every one """
+    target = stations._unit_vector(latitude, longitude)
+    return [
+        station.icao for station in sorted(station_list, key=lambda station: sum(
+            (a - b) ** 2 for a, b in zip(stations._unit_vector(station.latitude, station.longitude), target)
+        ))[:count]
+    ]
+
+
+def test_index_matches_brute_force_search():
+    generator = random.Random(7)
+    station_list = [
+        stations.Station(str(index), generator.uniform(-90, 90), generator.uniform(-180, 180), '')
+        for index in range(2000)
+    ]
+    index = stations.StationIndex(station_list)
+    for _ in range(25):
+        latitude, longitude = generator.uniform(-90, 90), generator.uniform(-180, 180)
+        nearest = [station.icao for _, station in index.nearest(latitude, longitude, 5)]
+        assert nearest == brute_force_nearest(station_list, latitude, longitude, 5)
+
+
+def test_range_query_matches_brute_force_search():
+    generator = random.Random(13)
+    station_list = [
+        stations.Station(str(index), generator.uniform(-90, 90), generator.uniform(-180, 180), '')
+        for index in range(2000)
+    ]
+    index = stations.StationIndex(station_list)
+    for _ in range(25):
+        latitude, longitude = generator.uniform(-90, 90), generator.uniform(-180, 180)
+        radius = generator.uniform(100, 2000)
+        found = index.within(latitude, longitude, radius)
+        everything = index.nearest(latitude, longitude, len(station_list))
+        assert [station.icao for _, station in found] == [
+            station.icao for distance, station in everything if distance <= radius
+        ]
+
+
+def test_index_handles_the_antimeridian():
+    index = stations.StationIndex([
+        stations.Station('EAST', 0.0, 179.9, ''), stations.Station('WEST', 0.0, -170.0, ''),
+    ])
+    distance, station = index.nearest(0.0, -179.9, 1)[0]
+    assert station.icao == 'EAST'
+    assert 22 < distance < 23
+
+
+def test_bundled_stations_are_indexed():
+    distance, station = stations.station_index().nearest(43.0, -81.2, 1)[0]
+    assert station.icao == 'CYXU' and distance < 10
+
+
+def test_write_stations_round_trips(tmp_path):
+    path = str(tmp_path / 'stations.csv')
+    metars = [
+        {'station_id': 'cyxu', 'latitude': '43.03', 'longitude': '-81.15'},
+        {'station_id': 'CYYZ', 'latitude': '43.67', 'longitude': '-79.62'},
+        {'station_id': 'XXXX'},
+    ]
+    assert stations.write_stations(metars, path, {'CYXU': 'London'}) == 2
+    assert stations.load_stations(path) == [
+        stations.Station('CYXU', 43.03, -81.15, 'London'), stations.Station('CYYZ', 43.67, -79.62, 'CYYZ'),
+    ]
+
+
+def test_nearest_vfr_intent_fetches_candidates_in_one_request(monkeypatch):
+    metar = open(os.path.join(get_data_directory(), 'metar.txt'), 'rb').read()
+
+    def respond(query):
+        reports = []
+        for icao_code in query['stationString'][0].split(','):
+            report = metar.replace(b'CYYZ', icao_code.encode())
+            if icao_code == 'CYKF':
+                report = report.replace(b'<flight_category>LIFR', b'<flight_category>VFR')
+            reports.append(report[report.index(b'<METAR>'):report.index(b'</METAR>') + 8])
+        return 200, b'<response><data>' + b''.join(reports) + b'</data></response>', 0
+
+    request = load_sample_dialogflow_request()
+    request['queryResult']['intent']['displayName'] = 'get_nearest_vfr'
+    request['originalDetectIntentRequest']['payload'] = {
+        'device': {'location': {'coordinates': {'latitude': 43.0, 'longitude': -81.2}}}
+    }
+    helpers.metar_cache.clear()
+    with StubServer(respond) as stub:
+        monkeypatch.setattr(upstream, 'adds', upstream.Upstream(stub.url, retries=0))
+        speech, text = api.build_response(request)
+        assert len(stub.requests) == 1
+        assert len(stub.requests[0]['stationString'][0].split(',')) == stations.NEAREST_CANDIDATES
+    assert speech == 'The closest VFR airport is Region of Waterloo, 45 nautical miles away.'
+    helpers.metar_cache.clear()
+
+
+def test_location_intents_need_a_location(monkeypatch):
+    request = load_sample_dialogflow_request()
+    request['queryResult']['intent']['displayName'] = 'get_nearest_weather'
+    monkeypatch.setattr(stations, 'nearest_reports', lambda *args: pytest.fail('fetched without a location'))
+    assert api.build_response(request)[0] == helpers.get_standard_error_message()
+
+
+def test_vfr_nearby_intent_sweeps_the_radius(monkeypatch):
+    metar = open(os.path.join(get_data_directory(), 'metar.txt'), 'rb').read()
+
+    def respond(query):
+        reports = []
+        for icao_code in query['stationString'][0].split(','):
+            report = metar.replace(b'CYYZ', icao_code.encode())
+            if icao_code in ('CYKF', 'CYHM'):
+                report = report.replace(b'<flight_category>LIFR', b'<flight_category>VFR')
+            reports.append(report[report.index(b'<METAR>'):report.index(b'</METAR>') + 8])
+        return 200, b'<response><data>' + b''.join(reports) + b'</data></response>', 0
+
+    request = load_sample_dialogflow_request()
+    request['queryResult']['intent']['displayName'] = 'get_vfr_nearby'
+    request['queryResult']['parameters']['distance'] = {'amount': 60, 'unit': 'nmi'}
+    index = stations.station_index()
+    center = index.get('CYXU')
+    expected = index.within(center.latitude, center.longitude, 60 * stations.KM_PER_NAUTICAL_MILE)
+    helpers.metar_cache.clear()
+    with StubServer(respond) as stub:
+        monkeypatch.setattr(upstream, 'adds', upstream.Upstream(stub.url, retries=0))
+        speech, text = api.build_response(request)
+        assert len(stub.requests) == 1
+        assert sorted(stub.requests[0]['stationString'][0].split(',')) == sorted(
+            station.icao for _, station in expected
+        )
+    assert speech.startswith('2 of the {} airports within 60 nautical miles of'.format(len(expected)))
+    helpers.metar_cache.clear()
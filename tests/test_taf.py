@@ -0,0 +1,125 @@
+""" Tests for TAF parsing, time-indexed lookup and the forecast intent """
+
+import calendar
+import os
+import time
+from datetime import datetime
+import adds
+import helpers
+import main as api
+import responses
+import taf
+import upstream
+from observation import Observation
+from tests.helpers import get_data_directory, load_sample_dialogflow_request
+from tests.stub_server import StubServer
+
+
+def load_taf_bytes():
+    """ Loads the TAF fixture as bytes """
+    with open(os.path.join(get_data_directory(), 'taf.txt'), 'rb') as taf_file:
+        return taf_file.read()
+
+
+def at(day, hour):
+    """ Returns the UNIX time of day/hour Z in October 2018 """
+    return calendar.timegm(datetime(2018, 10, day, hour).timetuple())
+
+
+def test_taf_parser_reads_forecast_periods():
+    taf_dict = adds.parse_taf(load_taf_bytes())
+    assert taf_dict['station_id'] == 'KSFO'
+    assert [period.get('change_indicator') for period in taf_dict['forecasts']] == \
+        [None, 'FM', 'BECMG', 'TEMPO', 'FM']
+    assert taf_dict['forecasts'][2]['sky_conditions'] == [{'cloud_base_ft_agl': '800', 'sky_cover': 'OVC'}]
+
+
+def test_forecast_resolves_prevailing_conditions_by_time():
+    forecast = taf.Forecast(adds.parse_taf(load_taf_bytes()))
+    assert forecast.flight_category_at(at(2, 20)) == 'VFR'
+    assert forecast.flight_category_at(at(3, 7)) == 'IFR'
+    # BECMG keeps the wind of the FM group it amends
+    assert forecast.at(at(3, 7))['wind_speed_kt'] == '15'
+    assert [conditions['flight_category'] for conditions in forecast.temporary_at(at(3, 12))] == ['LIFR']
+    assert forecast.flight_category_at(at(3, 20)) == 'VFR'
+    assert forecast.flight_category_at(at(2, 17)) is None
+    assert forecast.flight_category_at(at(4, 0)) is None
+
+
+def test_temporary_groups_only_change_what_they_mention():
+    forecast = taf.Forecast({
+        'station_id': 'KSFO', 'valid_time_from': '2018-10-02T18:00:00Z', 'valid_time_to': '2018-10-04T00:00:00Z',
+        'forecasts': [
+            {'fcst_time_from': '2018-10-02T18:00:00Z', 'fcst_time_to': '2018-10-04T00:00:00Z',
+             'wind_dir_degrees': '290', 'wind_speed_kt': '12', 'visibility_statute_mi': '4.0',
+             'sky_conditions': [{'sky_cover': 'OVC', 'cloud_base_ft_agl': '800'}]},
+            {'change_indicator': 'TEMPO', 'fcst_time_from': '2018-10-03T06:00:00Z',
+             'fcst_time_to': '2018-10-03T10:00:00Z', 'wind_dir_degrees': '300', 'wind_speed_kt': '25'},
+        ],
+    })
+    temporary, = forecast.temporary_at(at(3, 8))
+    assert temporary['flight_category'] == 'IFR'
+    assert temporary['wind_speed_kt'] == '25' and temporary['sky_conditions'] == forecast.at(at(3, 8))['sky_conditions']
+    speech, text = responses.get_forecast_category(forecast, 'San Francisco', when=at(3, 8))
+    assert speech == 'San Francisco is forecast to be IFR at 0800 Zulu.'
+
+
+def test_dialogflow_times_are_read_as_utc():
+    request = {'queryResult': {'parameters': {'time': '2018-10-03T05:00:00-07:00'}}}
+    assert helpers.get_time_from_dialogflow(request) == at(3, 12)
+    request['queryResult']['parameters']['time'] = '11:00:00'
+    assert helpers.get_time_from_dialogflow(request, now=at(3, 12)) == at(4, 11)
+    assert helpers.get_time_from_dialogflow({'queryResult': {'parameters': {}}}) is None
+
+
+def test_forecast_intent_fetches_metar_and_taf_concurrently(monkeypatch):
+    metar = open(os.path.join(get_data_directory(), 'metar.txt'), 'rb').read()
+    bodies = {'metars': metar.replace(b'CYYZ', b'CYXU'), 'tafs': load_taf_bytes().replace(b'KSFO', b'CYXU')}
+    request = load_sample_dialogflow_request()
+    request['queryResult']['intent']['displayName'] = 'get_forecast_category'
+    request['queryResult']['parameters']['time'] = '2018-10-03T12:00:00+00:00'
+    helpers.metar_cache.clear()
+    taf.taf_cache.clear()
+    with StubServer(lambda query: (200, bodies[query['dataSource'][0]], 0.1)) as stub:
+        monkeypatch.setattr(upstream, 'adds', upstream.Upstream(stub.url, retries=0))
+        speech, text = api.build_response(request)
+        assert sorted(query['dataSource'][0] for query in stub.requests) == ['metars', 'tafs']
+        api.build_response(request)
+        assert len(stub.requests) == 2
+        # Both 100ms upstream calls are in flight at once
+        helpers.metar_cache.clear()
+        taf.taf_cache.clear()
+        started = time.monotonic()
+        api.build_response(request)
+        assert time.monotonic() - started < 0.19
+    assert speech == (
+        'London is forecast to be IFR at 1200 Zulu. Temporary LIFR conditions are possible. '
+        "Right now it's LIFR."
+    )
+    helpers.metar_cache.clear()
+    taf.taf_cache.clear()
+
+
+def test_forecast_intent_does_not_present_a_last_known_report_as_current(monkeypatch):
+    observed = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(time.time() - 2 * 60 * 60))
+    metar = open(os.path.join(get_data_directory(), 'metar.txt'), 'rb').read()
+    metar = metar.replace(b'CYYZ', b'CYXU').replace(b'2018-10-02T21:00:00Z', observed.encode())
+    request = load_sample_dialogflow_request()
+    request['queryResult']['intent']['displayName'] = 'get_forecast_category'
+    request['queryResult']['parameters']['time'] = '2018-10-03T12:00:00+00:00'
+    helpers.metar_cache.clear()
+    helpers.last_known_good.clear()
+    taf.taf_cache.clear()
+    helpers._remember('CYXU', Observation(adds.parse_metar(metar)))
+    responses = {'metars': (503, b'', 0), 'tafs': (200, load_taf_bytes().replace(b'KSFO', b'CYXU'), 0)}
+    with StubServer(lambda query: responses[query['dataSource'][0]]) as stub:
+        monkeypatch.setattr(upstream, 'adds', upstream.Upstream(stub.url, retries=0))
+        speech, text = api.build_response(request)
+    assert speech == (
+        'London is forecast to be IFR at 1200 Zulu. Temporary LIFR conditions are possible. '
+        'It was last reported LIFR, 2 hours ago.'
+    )
+    assert text.endswith('Last reported LIFR, 2 hours ago.')
+    helpers.metar_cache.clear()
+    helpers.last_known_good.clear()
+    taf.taf_cache.clear()
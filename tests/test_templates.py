@@ -0,0 +1,81 @@
+""" Tests for the compiled response template registry """
+
+import os
+import time
+import templates
+
+
+def _write(path, content, mtime):
+    """ Writes a responses file and pins its modification time """
+    with open(path, 'w') as handle:
+        handle.write(content)
+    os.utime(path, ns=(mtime, mtime))
+
+
+def test_compiled_template_behaves_like_a_string():
+    template = templates.CompiledTemplate('At {airport}, {wind_speed} knots.')
+    assert template == 'At {airport}, {wind_speed} knots.'
+    assert template.fields == frozenset(['airport', 'wind_speed'])
+    assert template.format(airport='CYYZ', wind_speed=8) == 'At CYYZ, 8 knots.'
+    assert template.render({'airport': 'CYYZ', 'wind_speed': 8, 'extra': 1}) == 'At CYYZ, 8 knots.'
+
+
+def test_compiled_segments_render_exactly_like_str_format():
+    values = {'airport': 'London', 'alt': 29.95, 'count': 3, 'none': None, 'name': 'Région'}
+    for template in ['', 'plain', '{airport}', 'At {airport}: {alt} {{braces}} {none}', '{alt:.1f}|{count:>4}',
+                     '{name!r} {name!a} {name!s}', '{airport[0]} {airport.upper}', '{} {0}']:
+        compiled = templates.CompiledTemplate(template)
+        try:
+            expected = template.format_map(values)
+        except (IndexError, KeyError, ValueError):
+            continue
+        assert compiled.render(values) == expected
+
+
+def test_every_response_template_renders_like_str_format():
+    loaded = templates.TemplateRegistry().templates(time.monotonic())
+    for category in loaded.values():
+        for key in category.values():
+            for template in key.values():
+                values = {field: '<{}>'.format(field) for field in template.fields}
+                assert template.render(values) == str(template).format(**values)
+
+
+def test_output_buffer_joins_sections():
+    buffer = templates.OutputBuffer('\n')
+    assert buffer.getvalue() == ''
+    buffer.section()
+    buffer.render(templates.CompiledTemplate('{a}!'), {'a': 1})
+    buffer.section()
+    buffer.write('')
+    buffer.section()
+    buffer.write('x')
+    assert buffer.getvalue() == '1!\n\nx'
+
+
+def test_registry_loads_once(tmp_path):
+    path = str(tmp_path / 'responses.yaml')
+    _write(path, 'Wind:\n  standard:\n    speech: "one"\n    text: "one"\n', 1000000000)
+    registry = templates.TemplateRegistry(path, check_interval=0)
+    first = registry.templates(time.monotonic())
+    assert registry.templates(time.monotonic()) is first
+    assert first['Wind']['standard']['speech'] == 'one'
+
+
+def test_registry_reloads_when_file_changes(tmp_path):
+    path = str(tmp_path / 'responses.yaml')
+    _write(path, 'Wind:\n  standard:\n    speech: "one"\n    text: "one"\n', 1000000000)
+    registry = templates.TemplateRegistry(path, check_interval=0)
+    assert registry.templates(time.monotonic())['Wind']['standard']['speech'] == 'one'
+    _write(path, 'Wind:\n  standard:\n    speech: "two"\n    text: "two"\n', 2000000000)
+    assert registry.templates(time.monotonic())['Wind']['standard']['speech'] == 'two'
+
+
+def test_registry_skips_mtime_checks_within_interval(tmp_path):
+    path = str(tmp_path / 'responses.yaml')
+    _write(path, 'Wind:\n  standard:\n    speech: "one"\n    text: "one"\n', 1000000000)
+    registry = templates.TemplateRegistry(path, check_interval=60)
+    registry.templates(100.0)
+    _write(path, 'Wind:\n  standard:\n    speech: "two"\n    text: "two"\n', 2000000000)
+    assert registry.templates(110.0)['Wind']['standard']['speech'] == 'one'
+    assert registry.templates(161.0)['Wind']['standard']['speech'] == 'two'
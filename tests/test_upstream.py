@@ -0,0 +1,119 @@
+""" Tests for the pooled upstream client, against a local stub server """
+
+import time
+import pytest
+import upstream
+from tests.stub_server import StubServer
+
+
+class FakeClock:
+    """ A manually advanced clock """
+
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def make_upstream(url, **kwargs):
+    """ Builds a client with no backoff delay and short timeouts """
+    options = {'retries': 2, 'backoff': 0, 'timeout': (0.5, 0.2)}
+    options.update(kwargs)
+    return upstream.Upstream(url, **options)
+
+
+def test_returns_body_on_success():
+    with StubServer([(200, b'<response/>', 0)]) as stub:
+        client = make_upstream(stub.url)
+        assert client.get({'stationString': 'CYYZ'}) == b'<response/>'
+        assert stub.requests[0]['stationString'] == ['CYYZ']
+
+
+def test_retries_server_errors():
+    with StubServer([(503, b'', 0), (502, b'', 0), (200, b'ok', 0)]) as stub:
+        assert make_upstream(stub.url).get({}) == b'ok'
+        assert len(stub.requests) == 3
+
+
+def test_does_not_retry_client_errors():
+    with StubServer([(404, b'', 0), (200, b'ok', 0)]) as stub:
+        assert make_upstream(stub.url).get({}) is None
+        assert len(stub.requests) == 1
+
+
+def test_read_timeout_is_a_failure():
+    with StubServer([(200, b'slow', 0.5)]) as stub:
+        assert make_upstream(stub.url, retries=0).get({}) is None
+
+
+def test_breaker_opens_and_fails_fast():
+    clock = FakeClock()
+    breaker = upstream.CircuitBreaker(failure_threshold=2, reset_timeout=30, clock=clock)
+    with StubServer([(500, b'', 0)]) as stub:
+        client = make_upstream(stub.url, retries=0, breaker=breaker)
+        client.get({})
+        client.get({})
+        assert breaker.is_open
+        client.get({})
+        assert len(stub.requests) == 2
+
+
+def test_breaker_closes_after_successful_trial():
+    clock = FakeClock()
+    breaker = upstream.CircuitBreaker(failure_threshold=1, reset_timeout=30, clock=clock)
+    with StubServer([(500, b'', 0), (200, b'ok', 0)]) as stub:
+        client = make_upstream(stub.url, retries=0, breaker=breaker)
+        assert client.get({}) is None
+        assert breaker.is_open
+        clock.now += 31
+        assert client.get({}) == b'ok'
+        assert not breaker.is_open
+
+
+class BrokenSession:
+    """ A session whose requests fail with something other than a RequestException """
+
+    def get(self, *args, **kwargs):
+        raise RuntimeError('unexpected')
+
+
+def test_unexpected_error_during_trial_counts_as_a_failure():
+    clock = FakeClock()
+    breaker = upstream.CircuitBreaker(failure_threshold=1, reset_timeout=30, clock=clock)
+    with StubServer([(500, b'', 0), (200, b'ok', 0)]) as stub:
+        client = make_upstream(stub.url, retries=0, breaker=breaker)
+        assert client.get({}) is None
+        session = client.session
+        clock.now += 31
+        client._session = BrokenSession()
+        with pytest.raises(RuntimeError):
+            client.get({})
+        assert breaker.is_open
+        client._session = session
+        clock.now += 31
+        assert client.get({}) == b'ok'
+        assert not breaker.is_open
+
+
+def test_default_timeouts_fit_the_webhook_deadline():
+    assert upstream.REQUEST_BUDGET < 5
+    assert upstream.CONNECT_TIMEOUT <= upstream.REQUEST_BUDGET and upstream.READ_TIMEOUT <= upstream.REQUEST_BUDGET
+
+
+def test_slow_upstream_is_cut_off_at_the_budget():
+    with StubServer([(200, b'slow', 2)]) as stub:
+        client = make_upstream(stub.url, retries=5, timeout=(5, 5), budget=0.3)
+        started = time.monotonic()
+        assert client.get({}) is None
+        assert time.monotonic() - started < 0.6
+        assert len(stub.requests) == 1
+
+
+def test_retries_stop_at_the_budget():
+    with StubServer([(503, b'', 0.1)]) as stub:
+        client = make_upstream(stub.url, retries=20, budget=0.35)
+        started = time.monotonic()
+        assert client.get({}) is None
+        assert time.monotonic() - started < 0.6
+        assert 2 <= len(stub.requests) <= 4
@@ -5,6 +5,7 @@ import weather
 import helpers
 from tests.helpers import get_data_directory
 from bs4 import BeautifulSoup
+from datetime import datetime, timedelta
 
 
 metar = open(os.path.join(get_data_directory(), 'metar.txt'), 'r').read()
@@ -190,3 +191,23 @@ def test_when_weird_sky_condition_return_weird():
     conditions = weather.get_sky_conditions(metar_dict)
     assert conditions[0][0] == 'WEIRD'
     assert conditions[0][1] == '500'
+
+
+def test_parse_observation_time_fast_path():
+    assert weather.parse_observation_time('2018-10-02T21:00:00Z') == datetime(2018, 10, 2, 21, 0, 0)
+
+
+def test_parse_observation_time_falls_back_to_general_parser():
+    assert weather.parse_observation_time('2018-10-02 21:00') == datetime(2018, 10, 2, 21, 0, 0)
+
+
+def test_format_relative_time():
+    now = datetime(2020, 1, 1)
+    cases = {
+        0: 'just now', 9: 'just now', 10: '10 seconds ago', 60: '1 minute ago', 119: '1 minute ago',
+        120: '2 minutes ago', 3600: '1 hour ago', 7200: '2 hours ago', 86400: '1 day ago',
+        604800: '1 week ago', 2700000: '1 month ago', 5259600: '2 months ago', 31536000: '1 year ago',
+        63072000: '2 years ago', -120: 'in 2 minutes',
+    }
+    for seconds, expected in cases.items():
+        assert weather.format_relative_time(now - timedelta(seconds=seconds), now) == expected